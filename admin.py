@@ -1,45 +1,222 @@
-from django.contrib import admin
+import codecs
 
+from django import forms
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+from .content import FORMATS, ImportErrors, import_questions, read_rows, export_rows, render_rows
 from .models.exercise import Exercise, Question
-from .models.user import User, ExerciseState, AnswerGiven
+from .models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+
+
+def _export_response(questions):
+    response = StreamingHttpResponse(
+        render_rows(export_rows(questions)), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="questions.csv"'
+    return response
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses PostgreSQL's estimate of the number of rows when the whole of a large table is listed.
+
+    Counting every row takes longer the more rows there are, the estimate is kept up to date by
+    ANALYZE. Lists which are filtered are counted.
+    """
+    # Tables with fewer rows than this are counted, the estimate might be a long way out
+    min_estimate = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row is not None and row[0] >= self.min_estimate:
+                return int(row[0])
+        return super(EstimatedCountPaginator, self).count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """For the tables which grow with each turn.
+
+    The pages are counted once (or estimated, see EstimatedCountPaginator), not counted again
+    without the filters.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class QuestionImportForm(forms.Form):
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=[(f, f) for f in FORMATS])
+    dry_run = forms.BooleanField(required=False, help_text="Check the file without saving it.")
 
 
 class QuestionAdmin(admin.ModelAdmin):
     list_display = [f.name for f in Question._meta.fields]
     list_filter = ('exercise', )
+    list_select_related = ('exercise', )
+    actions = ['export_questions']
+
+    def export_questions(self, request, queryset):
+        return _export_response(queryset)
+    export_questions.short_description = "Export the selected questions"
+
+    def get_urls(self):
+        return [
+            url(r'^import/$', self.admin_site.admin_view(self.import_view),
+                name='word_finding_question_import'),
+        ] + super(QuestionAdmin, self).get_urls()
+
+    def import_view(self, request):
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+
+        form = QuestionImportForm(request.POST or None, request.FILES or None)
+        import_errors = []
+        if form.is_valid():
+            lines = codecs.iterdecode(form.cleaned_data['file'], 'utf-8')
+            try:
+                result = import_questions(
+                    read_rows(lines, form.cleaned_data['format']),
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+            except ImportErrors as e:
+                import_errors = e.errors
+            except UnicodeDecodeError:
+                form.add_error('file', "The file must be UTF-8")
+            else:
+                message = "{} questions added, {} updated and {} unchanged".format(
+                    result.added, result.updated, result.unchanged)
+                if form.cleaned_data['dry_run']:
+                    message += " (dry run, nothing was saved)"
+                self.message_user(request, message, messages.SUCCESS)
+                return HttpResponseRedirect(reverse('admin:word_finding_question_changelist'))
+
+        return TemplateResponse(request, 'admin/word_finding/question/import.html', dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Import questions",
+            form=form,
+            import_errors=import_errors,
+        ))
 
 
 class ExerciseAdmin(admin.ModelAdmin):
     list_display = [f.name for f in Exercise._meta.fields]
+    actions = ['export_questions']
 
+    def export_questions(self, request, queryset):
+        return _export_response(Question.objects.filter(exercise__in=queryset))
+    export_questions.short_description = "Export the selected exercises' questions"
 
-class ExerciseStateAdmin(admin.ModelAdmin):
+
+class ExerciseStateAdmin(LargeTableAdmin):
     list_display = [f.name for f in ExerciseState._meta.fields]
-    list_filter = ('user', 'exercise')
+    # There are too many users for a list of them, they are searched for instead
+    list_filter = ('exercise', 'completed')
+    list_select_related = ('user', 'exercise', 'current_question', 'last_question')
+    search_fields = ('=user__user_id', )
+    raw_id_fields = ('user', 'current_question', 'last_question')
+
 
+class ExerciseProgressAdmin(LargeTableAdmin):
+    list_display = [f.name for f in ExerciseProgress._meta.fields]
+    list_filter = ('exercise', )
+    list_select_related = ('user', 'exercise')
+    search_fields = ('=user__user_id', )
+    raw_id_fields = ('user', )
 
-class UserAdmin(admin.ModelAdmin):
+
+class UserAdmin(LargeTableAdmin):
     list_display = [f.name for f in User._meta.fields]
+    search_fields = ('user_id', )
+
+
+class AnswerAnalyticsForm(forms.Form):
+    exercise = forms.ModelChoiceField(
+        Exercise.objects.all(), required=False, empty_label="All exercises")
+    min_answers = forms.IntegerField(
+        initial=10, min_value=1, help_text="Only list questions with this many answers.")
+    min_exercises = forms.IntegerField(
+        initial=3, min_value=2, help_text="Only list users who have answered this many exercises.")
 
 
-class AnswerGivenAdmin(admin.ModelAdmin):
+class AnswerGivenAdmin(LargeTableAdmin):
+    list_filter = ('is_correct', )
+    list_select_related = (
+        'exercise_state__user', 'exercise_state__exercise', 'question__exercise')
+    search_fields = ('=exercise_state__user__user_id', )
+    raw_id_fields = ('exercise_state', 'question')
+
     @property
     def list_display(self):
         fields = [f.name for f in AnswerGiven._meta.fields]
-        fields.append('correct')
         fields.append('exercise')
         return fields
 
     def exercise(self, obj):
         return obj.question.exercise
+    exercise.admin_order_field = 'question__exercise'
+
+    def get_urls(self):
+        return [
+            url(r'^analytics/$', self.admin_site.admin_view(self.analytics_view),
+                name='word_finding_answergiven_analytics'),
+        ] + super(AnswerGivenAdmin, self).get_urls()
+
+    def analytics_view(self, request, limit=20):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
 
-    def correct(self, obj):
-        return obj.correct()
-    correct.boolean = True
+        form = AnswerAnalyticsForm(request.GET or None)
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Answer analytics",
+            form=form,
+        )
+        if form.is_valid():
+            try:
+                # Only imported when it is used, so registering the admin doesn't import it
+                from .analytics import analyse
+                result = analyse(form.cleaned_data['exercise'])
+            except ImproperlyConfigured as e:
+                self.message_user(request, str(e), messages.ERROR)
+            else:
+                questions = result.questions(form.cleaned_data['min_answers'])[:limit]
+                most, least = result.improvement(form.cleaned_data['min_exercises'], limit)
+                text = Question.objects.in_bulk([q.question_id for q in questions])
+                user_ids = dict(User.objects.filter(
+                    pk__in=[u.user_pk for u in most + least]).values_list('pk', 'user_id'))
+                context.update(
+                    num_answers=result.num_answers,
+                    questions=[(q, text[q.question_id]) for q in questions],
+                    improvement=[
+                        ("Most improved users", [(u, user_ids[u.user_pk]) for u in most]),
+                        ("Least improved users", [(u, user_ids[u.user_pk]) for u in least]),
+                    ],
+                    retries=result.retries(),
+                    max_attempts=result.max_attempts,
+                )
+        return TemplateResponse(
+            request, 'admin/word_finding/answergiven/analytics.html', context)
 
 
 admin.site.register(Exercise, ExerciseAdmin)
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(User, UserAdmin)
 admin.site.register(ExerciseState, ExerciseStateAdmin)
+admin.site.register(ExerciseProgress, ExerciseProgressAdmin)
 admin.site.register(AnswerGiven, AnswerGivenAdmin)
@@ -0,0 +1,266 @@
+"""Statistics over all the answers given, for the clinicians.
+
+analyse() reads the exercise states and their answers a chunk of states at a time, into NumPy
+arrays, and adds each chunk to running totals kept for each question and user. Only one chunk
+is in memory at a time, so it works over any number of answers, the totals take memory in
+proportion to the number of questions and users.
+
+It works out:
+
+* how hard each question is: the proportion of answers which were correct, and of first
+  attempts which were correct,
+* each user's accuracy, and its trend: the slope of the line fitted to the accuracy of each of
+  their exercises in turn, so a positive trend means they are getting more right,
+* how many attempts it took to answer a question, and how often the question was answered in
+  the end.
+
+It needs numpy, which is only used here. Answers from before is_correct was stored are marked
+with the catalogue, as in backfill_answer_correctness.
+"""
+import collections
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max
+
+from .catalogue import get_catalogue
+from .models.user import User, ExerciseState, AnswerGiven
+from .models.exercise import Question
+
+
+QuestionStats = collections.namedtuple('QuestionStats', (
+    'question_id',
+    'answers',
+    'correct',
+    'accuracy',
+    # The proportion of the times it was asked that the first answer was correct
+    'first_attempt_accuracy',
+    'mean_attempts',
+))
+
+UserStats = collections.namedtuple('UserStats', (
+    'user_pk',
+    # The number of exercises with answers
+    'exercises',
+    'answers',
+    'correct',
+    'accuracy',
+    # The change in accuracy from one exercise to the next, None with fewer than two exercises
+    'trend',
+))
+
+RetryStats = collections.namedtuple('RetryStats', (
+    'attempts',
+    # The number of times a question took this many attempts
+    'times',
+    # How many of those were answered correctly in the end
+    'answered',
+))
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImproperlyConfigured("The answer analytics need the numpy package")
+    return numpy
+
+
+class AnswerAnalytics(object):
+    """The totals for each question and user, in arrays indexed by their pks."""
+    # The totals kept for each question and each user
+    QUESTION_TOTALS = ('answers', 'correct', 'asked', 'first_correct')
+    USER_TOTALS = ('exercises', 'answers', 'correct', 'x', 'y', 'xx', 'xy')
+    # The sums for the users' trends, where x numbers their exercises and y is the accuracy
+    TREND_TOTALS = ('x', 'y', 'xx', 'xy')
+
+    def __init__(self, max_question_pk, max_user_pk, max_attempts):
+        np = _numpy()
+        self.questions_totals = {
+            name: np.zeros(max_question_pk + 1, dtype=np.int64) for name in self.QUESTION_TOTALS}
+        self.users_totals = {
+            name: np.zeros(
+                max_user_pk + 1, dtype=np.float64 if name in self.TREND_TOTALS else np.int64)
+            for name in self.USER_TOTALS}
+        # Counted up to max_attempts, the last count is for max_attempts or more
+        self.max_attempts = max_attempts
+        self.retries_times = np.zeros(max_attempts + 1, dtype=np.int64)
+        self.retries_answered = np.zeros(max_attempts + 1, dtype=np.int64)
+        self.num_answers = 0
+
+    def add_chunk(self, state_users, answer_states, answer_questions, answer_correct):
+        """Adds the answers to a chunk of exercise states to the totals.
+
+        state_users maps each state's pk to its user's pk. The answers are in arrays of their
+        state, question and whether they were correct, ordered by state, question and then the
+        order they were given. All of a state's answers must be in the same chunk.
+        """
+        np = _numpy()
+        n = len(answer_states)
+        if not n:
+            return
+        self.num_answers += n
+        correct = answer_correct.astype(np.int64)
+        questions = self.questions_totals
+        num_questions = len(questions['answers'])
+        questions['answers'] += np.bincount(answer_questions, minlength=num_questions)
+        questions['correct'] += np.bincount(
+            answer_questions, weights=correct, minlength=num_questions).astype(np.int64)
+
+        # Each run of answers to the same question in the same state is one time it was asked
+        new_run = np.empty(n, dtype=bool)
+        new_run[0] = True
+        new_run[1:] = (
+            (answer_states[1:] != answer_states[:-1]) |
+            (answer_questions[1:] != answer_questions[:-1]))
+        starts = np.flatnonzero(new_run)
+        attempts = np.diff(np.append(starts, n))
+        answered = np.maximum.reduceat(correct, starts)
+        run_questions = answer_questions[starts]
+        questions['asked'] += np.bincount(run_questions, minlength=num_questions)
+        questions['first_correct'] += np.bincount(
+            run_questions, weights=correct[starts], minlength=num_questions).astype(np.int64)
+        capped = np.minimum(attempts, len(self.retries_times) - 1)
+        self.retries_times += np.bincount(capped, minlength=len(self.retries_times))
+        self.retries_answered += np.bincount(
+            capped, weights=answered, minlength=len(self.retries_times)).astype(np.int64)
+
+        # The accuracy of each state, in the order they were started
+        states, state_index = np.unique(answer_states, return_inverse=True)
+        state_answers = np.bincount(state_index)
+        state_correct = np.bincount(state_index, weights=correct)
+        users = np.array([state_users[pk] for pk in states.tolist()], dtype=np.int64)
+        self._add_exercises(users, state_answers, state_correct)
+
+    def _add_exercises(self, users, state_answers, state_correct):
+        "Adds each exercise's accuracy to the user's totals, for their trends."
+        np = _numpy()
+        totals = self.users_totals
+        num_users = len(totals['answers'])
+        # Number each user's exercises in turn, carrying on from the chunks before
+        order = np.argsort(users, kind='stable')
+        sorted_users = users[order]
+        first = np.flatnonzero(np.append(True, sorted_users[1:] != sorted_users[:-1]))
+        group_sizes = np.diff(np.append(first, len(users)))
+        rank = np.empty(len(users), dtype=np.int64)
+        rank[order] = np.arange(len(users)) - np.repeat(first, group_sizes)
+        x = (totals['exercises'][users] + rank).astype(np.float64)
+        y = state_correct / state_answers
+
+        def add(name, weights=None):
+            added = np.bincount(users, weights=weights, minlength=num_users)
+            totals[name] += added.astype(totals[name].dtype)
+
+        add('answers', state_answers)
+        add('correct', state_correct)
+        add('x', x)
+        add('y', y)
+        add('xx', x * x)
+        add('xy', x * y)
+        add('exercises')
+
+    def questions(self, min_answers=1):
+        "The stats for each question with at least min_answers, hardest first."
+        np = _numpy()
+        totals = self.questions_totals
+        pks = np.flatnonzero(totals['answers'] >= max(min_answers, 1))
+        answers = totals['answers'][pks]
+        correct = totals['correct'][pks]
+        asked = totals['asked'][pks]
+        accuracy = correct / answers
+        first_attempt_accuracy = totals['first_correct'][pks] / asked
+        mean_attempts = answers / asked
+        order = np.lexsort((pks, -mean_attempts, accuracy))
+        return [
+            QuestionStats(*row) for row in zip(
+                pks[order].tolist(), answers[order].tolist(), correct[order].tolist(),
+                accuracy[order].tolist(), first_attempt_accuracy[order].tolist(),
+                mean_attempts[order].tolist())
+        ]
+
+    def users(self, min_exercises=1):
+        """The stats for each user with answers in at least min_exercises exercises, with the
+        most improved first."""
+        np = _numpy()
+        totals = self.users_totals
+        pks = np.flatnonzero(totals['exercises'] >= max(min_exercises, 1))
+        n = totals['exercises'][pks].astype(np.float64)
+        x, y = totals['x'][pks], totals['y'][pks]
+        # The least squares slope, which needs more than one exercise
+        denominator = n * totals['xx'][pks] - x * x
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = np.where(
+                denominator > 0, (n * totals['xy'][pks] - x * y) / denominator, np.nan)
+        answers = totals['answers'][pks]
+        correct = totals['correct'][pks]
+        accuracy = correct / answers
+        order = np.lexsort((pks, -np.where(np.isnan(trend), -np.inf, trend)))
+        return [
+            UserStats(pk, exercises, answers, correct, accuracy, None if t != t else t)
+            for pk, exercises, answers, correct, accuracy, t in zip(
+                pks[order].tolist(), totals['exercises'][pks][order].tolist(),
+                answers[order].tolist(), correct[order].tolist(), accuracy[order].tolist(),
+                trend[order].tolist())
+        ]
+
+    def improvement(self, min_exercises=2, limit=20):
+        "The limit most improved users, and the limit least improved, least improved first."
+        users = [u for u in self.users(min_exercises) if u.trend is not None]
+        return users[:limit], users[max(limit, len(users) - limit):][::-1]
+
+    def retries(self):
+        "How many times questions took each number of attempts, up to max_attempts or more."
+        return [
+            RetryStats(attempts, times, answered)
+            for attempts, (times, answered) in enumerate(zip(
+                self.retries_times.tolist(), self.retries_answered.tolist()))
+            if attempts and times
+        ]
+
+
+def analyse(exercise=None, chunk_size=10000, max_attempts=10):
+    """Works out the analytics for all the answers given, or just those to one exercise.
+
+    Reads chunk_size exercise states at a time, with their answers. Only the states and answers
+    which exist when it starts are included.
+    """
+    states = ExerciseState.objects.order_by('pk')
+    if exercise is not None:
+        states = states.filter(exercise=exercise)
+    max_state_pk = ExerciseState.objects.aggregate(pk=Max('pk'))['pk'] or 0
+    max_answer_pk = AnswerGiven.objects.aggregate(pk=Max('pk'))['pk'] or 0
+    analytics = AnswerAnalytics(
+        max_question_pk=Question.objects.aggregate(pk=Max('pk'))['pk'] or 0,
+        max_user_pk=User.objects.aggregate(pk=Max('pk'))['pk'] or 0,
+        max_attempts=max_attempts,
+    )
+    states = states.filter(pk__lte=max_state_pk)
+
+    last_pk = 0
+    while True:
+        state_users = collections.OrderedDict(
+            states.filter(pk__gt=last_pk).values_list('pk', 'user')[:chunk_size])
+        if not state_users:
+            break
+        first_pk = next(iter(state_users))
+        last_pk = next(reversed(state_users))
+        answers = AnswerGiven.objects.filter(
+            exercise_state__in=states.filter(pk__gte=first_pk, pk__lte=last_pk),
+            pk__lte=max_answer_pk,
+        ).order_by('exercise_state', 'question', 'pk').values_list(
+            'exercise_state', 'question', 'is_correct', 'answer')
+        analytics.add_chunk(state_users, *_columns(answers))
+    return analytics
+
+
+def _columns(answers):
+    "The answers' states, questions and whether they were correct, as arrays."
+    np = _numpy()
+    rows = list(answers)
+    matchers = get_catalogue().matchers if any(row[2] is None for row in rows) else None
+    states = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    questions = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    correct = np.fromiter((
+        matchers[question].matches(answer) if is_correct is None else is_correct
+        for _, question, is_correct, answer in rows
+    ), dtype=bool, count=len(rows))
+    return states, questions, correct
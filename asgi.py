@@ -0,0 +1,143 @@
+"""An ASGI application for the webhook.
+
+Django 1.11 has no async views, so this serves the webhook's urls (urls.py) itself. Requests are
+read and responses written on the event loop, and only the view (views.index takes the turn, which
+works with the database) runs on a pool of threads. A slow client doesn't hold a thread, so the
+threads only limit how many turns use the database at once. Run it with an ASGI server once
+DJANGO_SETTINGS_MODULE is set:
+
+    uvicorn apps.word_finding.asgi:application
+
+The number of threads is WORD_FINDING_ASGI_THREADS, 8 by default. When the server starts the
+application it is warmed up before it takes any requests, see warmup.py.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpRequest, HttpResponseNotFound, QueryDict
+from django.urls import resolve
+
+
+class WebhookApplication(object):
+    def __init__(self, max_threads=None):
+        self.max_threads = max_threads
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            max_threads = self.max_threads or getattr(settings, 'WORD_FINDING_ASGI_THREADS', 8)
+            self._executor = ThreadPoolExecutor(
+                max_threads, thread_name_prefix='word_finding turn')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError("Can't handle {} connections".format(scope['type']))
+
+        body = await _read_body(receive)
+        status, headers, content = await self.respond(scope, body)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def respond(self, scope, body):
+        """Runs the view for a request, an HTTP scope and its body, on the thread pool.
+
+        Returns (status, headers, content).
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, _respond, scope, body)
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_event_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await loop.run_in_executor(self.executor, _warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def _respond(scope, body):
+    "Runs on the thread pool, handling the connection the way Django's request signals do."
+    close_old_connections()
+    try:
+        request = _request(scope, body)
+        try:
+            match = resolve(request.path_info, urlconf='apps.word_finding.urls')
+            response = match.func(request, *match.args, **match.kwargs)
+        except Http404:
+            response = HttpResponseNotFound()
+    finally:
+        close_old_connections()
+    headers = [
+        (name.encode('latin-1'), value.encode('latin-1')) for name, value in response.items()]
+    return response.status_code, headers, response.content
+
+
+def _request(scope, body):
+    "The HttpRequest for an HTTP scope and its body, with the META a WSGI server would give."
+    request = HttpRequest()
+    request.method = scope['method']
+    request.path = request.path_info = scope['path']
+    query_string = scope.get('query_string', b'').decode('latin-1')
+    request.GET = QueryDict(query_string)
+    request.META.update(
+        REQUEST_METHOD=scope['method'],
+        PATH_INFO=scope['path'],
+        SCRIPT_NAME=scope.get('root_path', ''),
+        QUERY_STRING=query_string,
+        CONTENT_LENGTH=str(len(body)),
+    )
+    if scope.get('server'):
+        request.META['SERVER_NAME'], request.META['SERVER_PORT'] = (
+            scope['server'][0], str(scope['server'][1]))
+    if scope.get('client'):
+        request.META['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            request.META[name] = value
+            continue
+        name = 'HTTP_' + name
+        if name in request.META:
+            value = request.META[name] + ',' + value
+        request.META[name] = value
+    # What HttpRequest.body returns, it is only read from the WSGI input if this isn't set
+    request._body = body
+    return request
+
+
+def _warm_up():
+    "Warms up, if it fails the server still starts, and views.ready says it isn't ready."
+    from .warmup import try_warm_up
+
+    try_warm_up()
+
+
+def get_application():
+    django.setup(set_prefix=False)
+    return WebhookApplication()
+
+
+application = get_application()
@@ -0,0 +1,222 @@
+"""An in memory copy of the exercises and their questions.
+
+Exercises and questions only change when they are edited in the admin, so rather than reading
+them from the database on every turn each process keeps a catalogue of them. Saving or deleting
+an exercise or question clears the catalogue in this process, and changes a version stamp in the
+cache so that other processes notice the change and rebuild theirs. For that to work across
+processes a shared cache backend (memcached, redis, ...) needs to be configured.
+"""
+import bisect
+import logging
+import threading
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models.exercise import Exercise, Question
+from .responses import QuestionSpeech, SSMLError
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'word_finding:catalogue_version'
+
+
+def _version_check_interval():
+    "How often, in seconds, to check whether another process has changed the catalogue."
+    return getattr(settings, 'WORD_FINDING_CATALOGUE_CHECK_INTERVAL', 5)
+
+
+class CataloguedQuestion(object):
+    """A question, along with everything about it which can be worked out in advance.
+
+    That includes the compiled AnswerMatcher, used to check answers to it, and the QuestionSpeech
+    with what we say about it.
+    """
+    def __init__(self, question):
+        self.question = question
+        self.pk = question.pk
+        self.exercise_id = question.exercise_id
+        self.text = question.question
+        self.answers = tuple(question.answers)
+        self.matcher = question.matcher
+        try:
+            self.speech = QuestionSpeech(question)
+        except SSMLError as e:
+            # One bad question shouldn't stop every turn, so it is said without any SSML markup
+            logger.warning("Question %s can't be said with SSML: %s", question.pk, e)
+            self.speech = QuestionSpeech(question, plain=True)
+
+    def model_answer(self, answer=None):
+        return self.speech.model_answer_for(answer).text
+
+
+class CataloguedExercise(object):
+    def __init__(self, exercise, questions):
+        self.exercise = exercise
+        self.pk = exercise.pk
+        self.enabled = exercise.enabled
+        self.questions = tuple(questions)
+        self.question_pks = tuple(q.pk for q in self.questions)
+        # Where each question is in question_pks, by pk
+        self.question_index = {pk: i for i, pk in enumerate(self.question_pks)}
+        # Changes whenever a question is added to or removed from the exercise
+        self.revision = zlib.crc32(','.join(str(pk) for pk in self.question_pks).encode())
+
+    def question_after(self, pk):
+        "The next question after the one with the given pk, or None if it is the last."
+        i = bisect.bisect_right(self.question_pks, pk)
+        if i < len(self.questions):
+            return self.questions[i]
+        return None
+
+    def to_bitmap(self, pks):
+        "The question pks given as an int, with a bit set for each one in the exercise's order."
+        return sum(1 << i for i, pk in enumerate(self.question_pks) if pk in pks)
+
+    def from_bitmap(self, bitmap):
+        "The question pks in a bitmap made by to_bitmap."
+        return set(pk for i, pk in enumerate(self.question_pks) if bitmap >> i & 1)
+
+
+class Catalogue(object):
+    """All the exercises, enabled or not, and their questions in a consistent order."""
+    def __init__(self, version):
+        self.version = version
+
+        questions_by_exercise = {}
+        self.questions = {}
+        for question in Question.objects.order_by('exercise_id', 'pk'):
+            catalogued = CataloguedQuestion(question)
+            self.questions[question.pk] = catalogued
+            questions_by_exercise.setdefault(question.exercise_id, []).append(catalogued)
+
+        self.exercises = {}
+        for exercise in Exercise.objects.order_by('pk'):
+            questions = questions_by_exercise.get(exercise.pk, ())
+            for catalogued in questions:
+                catalogued.question.exercise = exercise
+            self.exercises[exercise.pk] = CataloguedExercise(exercise, questions)
+
+        self.enabled_exercises = tuple(e for e in self.exercises.values() if e.enabled)
+        self.matchers = {pk: q.matcher for pk, q in self.questions.items()}
+
+    def exercise(self, pk):
+        return self.exercises[pk]
+
+    def question(self, pk):
+        return self.questions[pk]
+
+
+_lock = threading.Lock()
+_catalogue = None
+_generation = 0
+_version_checked_at = 0
+
+
+def _shared_version():
+    "The version other processes are using, or a new one if nobody has set it yet."
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def get_catalogue():
+    """Returns the catalogue, building it if it isn't built or is out of date."""
+    global _catalogue, _version_checked_at
+
+    catalogue = _catalogue
+    now = time.monotonic()
+    if catalogue is not None and now - _version_checked_at < _version_check_interval():
+        return catalogue
+
+    version = _shared_version()
+    _version_checked_at = now
+    if catalogue is not None and catalogue.version == version:
+        return catalogue
+
+    with _lock:
+        if _catalogue is not None and _catalogue.version == version:
+            return _catalogue
+        generation = _generation
+        catalogue = Catalogue(version)
+        # Only keep it if nothing was changed while we were building it
+        if generation == _generation:
+            _catalogue = catalogue
+    return catalogue
+
+
+def get_question(pk):
+    """Returns the catalogued question, rebuilding the catalogue if it doesn't know about it.
+
+    The question might have been added by another process since we last checked the version.
+    """
+    try:
+        return get_catalogue().question(pk)
+    except KeyError:
+        pass
+    invalidate()
+    try:
+        return get_catalogue().question(pk)
+    except KeyError:
+        raise Question.DoesNotExist
+
+
+def get_exercise(pk):
+    try:
+        return get_catalogue().exercise(pk)
+    except KeyError:
+        pass
+    invalidate()
+    try:
+        return get_catalogue().exercise(pk)
+    except KeyError:
+        raise Exercise.DoesNotExist
+
+
+def invalidate():
+    "Throws away this process's catalogue, it will be rebuilt the next time it is needed."
+    global _catalogue, _generation
+    with _lock:
+        _catalogue = None
+        _generation += 1
+
+
+def _change_version():
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+    invalidate()
+
+
+def content_changed():
+    """Called when exercises or questions change, to rebuild the catalogues in every process.
+
+    Saving and deleting does this already, it only needs to be called after changes which don't
+    send signals, like bulk_create and update.
+    """
+    invalidate()
+    # Other processes can't see the change until it is committed
+    transaction.on_commit(_change_version)
+
+
+@receiver(post_save, sender=Exercise)
+@receiver(post_delete, sender=Exercise)
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def _content_changed(sender, **kwargs):
+    content_changed()
+
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    if setting == 'WORD_FINDING_ANSWER_MATCHING':
+        # The matchers are built with it
+        invalidate()
@@ -0,0 +1,94 @@
+"""Measures how long a new webhook process takes to answer its first turn.
+
+Run in a new process by the measure_startup command, with the same settings:
+
+    python -m apps.word_finding.coldstart [--warm-up]
+
+It sets Django up, imports the views and takes a turn for a new user, then another for another
+user, timing each step, and prints the timings as JSON. With --warm-up it warms up (see
+warmup.py) before the first turn, as a worker does before it is ready. The turns are welcome turns,
+taken in a transaction which is rolled back, so they don't leave anything in the database.
+
+Only the standard library is imported before the timing starts.
+"""
+import json
+import os
+import sys
+import time
+
+
+# The modules a worker which only serves the webhook shouldn't need to import
+UNNEEDED_MODULES = (
+    'apps.word_finding.admin',
+    'apps.word_finding.analytics',
+    'django.contrib.admin.sites',
+    'libs.google_actions.tests',
+    'numpy',
+)
+
+
+def measure(warm_up=False):
+    started = time.time()
+    timings = {}
+    step_started = time.perf_counter()
+
+    def step(name):
+        nonlocal step_started
+        now = time.perf_counter()
+        timings[name] = now - step_started
+        step_started = now
+
+    import django
+    django.setup()
+    step('setup')
+    from apps.word_finding import views
+    step('import')
+    from apps.word_finding import warmup
+    if warm_up:
+        warmup.warm_up()
+    elif warmup.is_ready():
+        # Only the servers warm up by themselves (see wsgi.py), so this shouldn't happen
+        raise RuntimeError("Already warmed up, the first turn wouldn't be cold")
+    step('warm_up')
+
+    from django.db import transaction
+
+    user_id = 'measure-startup-{}'.format(os.getpid())
+    step_started = time.perf_counter()
+    with transaction.atomic():
+        views.index(_welcome_request(user_id + '-first'))
+        step('first_turn')
+        first_response = time.time()
+        views.index(_welcome_request(user_id + '-second'))
+        step('second_turn')
+        transaction.set_rollback(True)
+
+    return {
+        'started': started,
+        'first_response': first_response,
+        'timings': timings,
+        'modules': len(sys.modules),
+        'unneeded_modules': [m for m in UNNEEDED_MODULES if m in sys.modules],
+    }
+
+
+def _welcome_request(user_id):
+    "The request Actions sends when a user starts a conversation."
+    from django.http import HttpRequest
+
+    body = json.dumps({
+        'user': {'user_id': user_id},
+        'conversation': {'conversation_id': user_id, 'conversation_token': None},
+        'inputs': [{'raw_inputs': [{'query': ''}]}],
+    }).encode('utf-8')
+    request = HttpRequest()
+    request.method = request.META['REQUEST_METHOD'] = 'POST'
+    request.META['CONTENT_TYPE'] = 'application/json'
+    request.META['CONTENT_LENGTH'] = str(len(body))
+    # What HttpRequest.body returns, it is only read from the WSGI input if this isn't set
+    request._body = body
+    return request
+
+
+if __name__ == '__main__':
+    print(json.dumps(measure(warm_up='--warm-up' in sys.argv[1:])))
@@ -0,0 +1,222 @@
+"""Importing and exporting the exercises' questions in bulk.
+
+Each row is a question, with the fields in FIELDS: the exercise's name, the question, the response
+and the answer. Rows are read and written as CSV (with a header row) or as JSON lines, a batch at a
+time, so files with any number of questions can be used.
+"""
+import csv
+import io
+import json
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from .catalogue import content_changed
+from .models.exercise import Exercise, Question, answer_errors
+
+
+FIELDS = ('exercise', 'question', 'response', 'answer')
+FORMATS = ('csv', 'jsonl')
+
+ImportResult = namedtuple('ImportResult', ('added', 'updated', 'unchanged'))
+
+# How many questions are updated by each UPDATE, each one adds five parameters to it, and SQLite
+# allows 999
+UPDATE_BATCH_SIZE = 100
+
+
+class ImportErrors(Exception):
+    "The problems with the rows imported, as (line number, message) pairs."
+    def __init__(self, errors):
+        super(ImportErrors, self).__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        return '\n'.join('Line {}: {}'.format(line, message) for line, message in self.errors)
+
+
+def read_rows(lines, format='csv'):
+    """Yields (line number, row) for each row in lines, an iterable of text lines.
+
+    The row is a dict, or None if it couldn't be read.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+    else:
+        raise ValueError("Unknown format {}".format(format))
+
+
+def import_questions(rows, batch_size=500, dry_run=False):
+    """Adds the questions in rows, (line number, row) pairs from read_rows.
+
+    If the exercise already has the question its response and answer are updated, and exercises
+    which don't exist are added. All the rows are checked, and if there are any problems
+    ImportErrors is raised with all of them and nothing is saved. With dry_run nothing is saved
+    either way. Returns an ImportResult.
+    """
+    errors = []
+    seen = {}
+    exercise_pks = {}
+    added = updated = unchanged = 0
+
+    with transaction.atomic():
+        for batch in _batches(rows, batch_size):
+            checked = []
+            for line_number, row in batch:
+                row, row_errors = _check_row(row)
+                if not row_errors:
+                    key = (row['exercise'], row['question'])
+                    if key in seen:
+                        row_errors = ['The same question as line {}'.format(seen[key])]
+                    else:
+                        seen[key] = line_number
+                errors.extend((line_number, message) for message in row_errors)
+                checked.append(row)
+
+            # Once there is a problem nothing will be saved, the rows are only checked
+            if not errors:
+                batch_added, batch_updated = _save_batch(checked, exercise_pks)
+                added += batch_added
+                updated += batch_updated
+                unchanged += len(checked) - batch_added - batch_updated
+
+        if errors:
+            raise ImportErrors(errors)
+        if dry_run:
+            transaction.set_rollback(True)
+        elif added or updated:
+            content_changed()
+
+    return ImportResult(added, updated, unchanged)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _check_row(row):
+    "Returns the row with its fields cleaned, and a list of its problems."
+    if row is None:
+        return None, ['Not valid JSON']
+    if not isinstance(row, dict):
+        return None, ['Not a JSON object']
+
+    cleaned = {}
+    errors = []
+    for field in FIELDS:
+        value = row.get(field)
+        cleaned[field] = '' if value is None else str(value).strip()
+        if not cleaned[field] and field != 'response':
+            errors.append('The {} is missing'.format(field))
+
+    max_length = Exercise._meta.get_field('name').max_length
+    if len(cleaned['exercise']) > max_length:
+        errors.append('Exercise names must be at most {} characters'.format(max_length))
+    cleaned['answer'] = cleaned['answer'].lower()
+    errors.extend(answer_errors(cleaned['answer']))
+    return cleaned, errors
+
+
+def _save_batch(rows, exercise_pks):
+    "Saves the rows, returns how many questions were added and updated."
+    names = set(row['exercise'] for row in rows)
+    _add_exercises(names - set(exercise_pks), exercise_pks)
+
+    existing = {}
+    for exercise_pk, question, pk, response, answer in Question.objects.filter(
+            exercise__in=set(exercise_pks[name] for name in names),
+            question__in=set(row['question'] for row in rows),
+    ).values_list('exercise', 'question', 'pk', 'response', 'answer'):
+        existing[(exercise_pk, question)] = (pk, response, answer)
+
+    new = []
+    changed = []
+    for row in rows:
+        exercise_pk = exercise_pks[row['exercise']]
+        try:
+            pk, response, answer = existing[(exercise_pk, row['question'])]
+        except KeyError:
+            new.append(Question(
+                exercise_id=exercise_pk,
+                question=row['question'],
+                response=row['response'],
+                answer=row['answer'],
+            ))
+            continue
+        if (response, answer) != (row['response'], row['answer']):
+            changed.append((pk, row))
+
+    Question.objects.bulk_create(new)
+    for batch in _batches(changed, UPDATE_BATCH_SIZE):
+        _update_questions(batch)
+    return len(new), len(changed)
+
+
+def _update_questions(changed):
+    "Sets the response and answer of each question from its row, with one query."
+    fields = {}
+    for name in ('response', 'answer'):
+        fields[name] = Case(
+            *[When(pk=pk, then=Value(row[name])) for pk, row in changed],
+            output_field=Question._meta.get_field(name))
+    Question.objects.filter(pk__in=[pk for pk, _ in changed]).update(**fields)
+
+
+def _add_exercises(names, exercise_pks):
+    "Adds the pks of the exercises with the names to exercise_pks, adding those which don't exist."
+    if not names:
+        return
+    found = dict(Exercise.objects.filter(name__in=names).values_list('name', 'pk'))
+    missing = names - set(found)
+    if missing:
+        Exercise.objects.bulk_create(Exercise(name=name) for name in missing)
+        found.update(Exercise.objects.filter(name__in=missing).values_list('name', 'pk'))
+    exercise_pks.update(found)
+
+
+def export_rows(questions=None):
+    "Yields a row for each question, ordered by exercise. questions is a Question queryset."
+    if questions is None:
+        questions = Question.objects.all()
+    return (
+        dict(zip(FIELDS, values))
+        for values in questions.order_by('exercise__name', 'pk').values_list(
+            'exercise__name', 'question', 'response', 'answer').iterator()
+    )
+
+
+def render_rows(rows, format='csv'):
+    "Yields the text for the rows, a line at a time, in a form read_rows can read."
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif format == 'jsonl':
+        for row in rows:
+            yield json.dumps(row) + '\n'
+    else:
+        raise ValueError("Unknown format {}".format(format))
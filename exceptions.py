@@ -14,3 +14,8 @@ class NoExercisesAvailable(Exception):
 
 class MaxQuestionRetriesReached(Exception):
     pass
+
+
+class StaleExerciseState(Exception):
+    "The exercise state has been changed by another turn since it was loaded."
+    pass
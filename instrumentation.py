@@ -0,0 +1,255 @@
+"""Measuring where the time goes in each turn.
+
+views.index measures each turn: the total time, the time spent parsing the Actions request,
+taking the turn and building the response, and the number of database queries and the time they
+took. The measurements are sent to the sinks set with WORD_FINDING_METRICS_SINKS, in the same way
+as the session store:
+
+    WORD_FINDING_METRICS_SINKS = [
+        {'BACKEND': 'apps.word_finding.instrumentation.LoggingSink',
+         'OPTIONS': {'slow_turn': 0.5}},
+        {'BACKEND': 'apps.word_finding.instrumentation.HistogramSink'},
+    ]
+
+RecordingSink keeps each measurement, it is used by the benchmark_turns command.
+
+The histograms are served in Prometheus's text format by views.metrics. With no sinks (the
+default) the queries aren't counted.
+
+Turns are measured by kind, one of the kinds in turn.py, or FINISHED for a turn which finished
+the exercise, or replay.REPLAYED for a request which was answered from the replay cache.
+"""
+import bisect
+import collections
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+FINISHED = 'finished'
+
+TurnMetrics = collections.namedtuple('TurnMetrics', (
+    'kind',
+    'user_id',
+    'exercise_id',
+    'total',
+    'parse',
+    'turn',
+    'respond',
+    'queries',
+    'query_time',
+))
+
+
+class LoggingSink(object):
+    """Logs each turn, or with slow_turn only the turns which took longer than that (in seconds).
+
+    The user and exercise are logged too, to find out which are slow.
+    """
+    def __init__(self, logger='apps.word_finding.metrics', level=logging.INFO, slow_turn=None):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+        self.slow_turn = slow_turn
+
+    def send(self, metrics):
+        if self.slow_turn is not None and metrics.total < self.slow_turn:
+            return
+        self.logger.log(
+            self.level,
+            "%s turn for user %s, exercise %s: %.1fms (parse %.1fms, turn %.1fms, respond "
+            "%.1fms), %d queries in %.1fms",
+            metrics.kind, metrics.user_id, metrics.exercise_id, metrics.total * 1000,
+            metrics.parse * 1000, metrics.turn * 1000, metrics.respond * 1000, metrics.queries,
+            metrics.query_time * 1000,
+        )
+
+
+class HistogramSink(object):
+    """Keeps a histogram of the time taken by each kind of turn, and totals of the rest.
+
+    buckets are the upper bounds of the histogram's buckets, in seconds.
+    """
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    TOTALS = ('total', 'parse', 'turn', 'respond', 'queries', 'query_time')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._kinds = {}
+
+    def send(self, metrics):
+        with self._lock:
+            kind = self._kinds.get(metrics.kind)
+            if kind is None:
+                kind = self._kinds[metrics.kind] = {
+                    'count': 0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                }
+                kind.update((name, 0) for name in self.TOTALS)
+            kind['count'] += 1
+            kind['buckets'][bisect.bisect_left(self.buckets, metrics.total)] += 1
+            for name in self.TOTALS:
+                kind[name] += getattr(metrics, name)
+
+    def snapshot(self):
+        """For each kind of turn, its count, the totals and the number of turns in each bucket.
+
+        The last bucket is for the turns slower than all the buckets.
+        """
+        with self._lock:
+            return {
+                kind: dict(values, buckets=list(values['buckets']))
+                for kind, values in self._kinds.items()
+            }
+
+    def prometheus_text(self):
+        lines = [
+            '# HELP word_finding_turn_seconds Time taken by each turn.',
+            '# TYPE word_finding_turn_seconds histogram',
+        ]
+        kinds = sorted(self.snapshot().items())
+        for kind, values in kinds:
+            cumulative = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, values['buckets']):
+                cumulative += count
+                lines.append('word_finding_turn_seconds_bucket{{kind="{}",le="{}"}} {}'.format(
+                    kind, bound, cumulative))
+            lines.append('word_finding_turn_seconds_sum{{kind="{}"}} {!r}'.format(
+                kind, values['total']))
+            lines.append('word_finding_turn_seconds_count{{kind="{}"}} {}'.format(
+                kind, values['count']))
+
+        for name, total, description in (
+                ('parse_seconds', 'parse', 'Time spent parsing Actions requests.'),
+                ('turn_seconds', 'turn', 'Time spent taking turns.'),
+                ('respond_seconds', 'respond', 'Time spent building Actions responses.'),
+                ('queries', 'queries', 'Database queries made.'),
+                ('query_seconds', 'query_time', 'Time spent on database queries.')):
+            metric = 'word_finding_turn_{}_total'.format(name)
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} counter'.format(metric))
+            for kind, values in kinds:
+                lines.append('{}{{kind="{}"}} {!r}'.format(metric, kind, values[total]))
+        return '\n'.join(lines) + '\n'
+
+
+class RecordingSink(object):
+    "Keeps the measurements of the last max_turns turns, for benchmarks and tests."
+    def __init__(self, max_turns=100000):
+        self.turns = collections.deque(maxlen=max_turns)
+
+    def send(self, metrics):
+        self.turns.append(metrics)
+
+
+class Measurement(object):
+    """Measures a turn, see measure_turn."""
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.times = dict.fromkeys(('parse', 'turn', 'respond'), 0)
+        self._recorded = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if self.sinks:
+            self._force_debug_cursor = connection.force_debug_cursor
+            if not self._force_debug_cursor and not settings.DEBUG:
+                # Nothing else is using the log, so it can't be full
+                connection.queries_log.clear()
+            connection.force_debug_cursor = True
+            self._first_query = len(connection.queries_log)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        total = time.perf_counter() - self._started
+        if not self.sinks:
+            return
+        queries = list(connection.queries_log)[self._first_query:]
+        connection.force_debug_cursor = self._force_debug_cursor
+        if not connection.force_debug_cursor and not settings.DEBUG:
+            # Only kept to be counted, don't let them build up
+            connection.queries_log.clear()
+        if self._recorded is None or exc_type is not None:
+            return
+
+        kind, user_id, exercise_id = self._recorded
+        metrics = TurnMetrics(
+            kind=kind,
+            user_id=user_id,
+            exercise_id=exercise_id,
+            total=total,
+            queries=len(queries),
+            query_time=sum(float(q['time']) for q in queries),
+            **self.times
+        )
+        for sink in self.sinks:
+            sink.send(metrics)
+
+    def timing(self, name):
+        return _Timing(self.times, name)
+
+    def record(self, kind, user_id, exercise_id=None):
+        "Says what the turn was, it is only sent to the sinks once this has been called."
+        self._recorded = (kind, user_id, exercise_id)
+
+
+class _Timing(object):
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.times[self.name] += time.perf_counter() - self._started
+
+
+def measure_turn():
+    """Returns a context manager which measures a turn:
+
+        with measure_turn() as measurement:
+            with measurement.timing('parse'):
+                ...
+            measurement.record(kind, user_id, exercise_id)
+    """
+    return Measurement(get_sinks())
+
+
+def percentile(values, percent):
+    "The nearest-rank percentile of some sorted values, 0 if there aren't any."
+    if not values:
+        return 0
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+_sinks = None
+
+
+def get_sinks():
+    global _sinks
+    if _sinks is None:
+        _sinks = [
+            import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            for config in getattr(settings, 'WORD_FINDING_METRICS_SINKS', [])
+        ]
+    return _sinks
+
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    global _sinks
+    if setting == 'WORD_FINDING_METRICS_SINKS':
+        _sinks = None
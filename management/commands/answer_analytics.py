@@ -0,0 +1,71 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.word_finding.analytics import analyse
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the hardest questions, the users whose accuracy is improving most and least, "
+        "and how many attempts questions take, over all the answers given. Reads the answers a "
+        "chunk at a time, so it can be run on any number of them. Needs numpy.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exercise', help="Only the answers to the exercise with this name.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help="How many exercise states to read, with their answers, at a time.")
+        parser.add_argument(
+            '--limit', type=int, default=20, help="How many questions and users to list.")
+        parser.add_argument(
+            '--min-answers', type=int, default=10,
+            help="Only list questions with at least this many answers.")
+        parser.add_argument(
+            '--min-exercises', type=int, default=3,
+            help="Only list users who have answered at least this many exercises.")
+
+    def handle(self, *args, **options):
+        exercise = None
+        if options['exercise']:
+            try:
+                exercise = Exercise.objects.get(name=options['exercise'])
+            except Exercise.DoesNotExist:
+                raise CommandError("There is no exercise called {}".format(options['exercise']))
+        try:
+            analytics = analyse(exercise, chunk_size=options['chunk_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        self.stdout.write("{} answers".format(analytics.num_answers))
+
+        limit = options['limit']
+        questions = analytics.questions(options['min_answers'])[:limit]
+        text = Question.objects.in_bulk([q.question_id for q in questions])
+        self.stdout.write("\nHardest questions")
+        self.stdout.write('{:>8}{:>10}{:>10}{:>10}  {}'.format(
+            'answers', 'correct', 'first', 'attempts', 'question'))
+        for q in questions:
+            self.stdout.write('{:>8}{:>10.1%}{:>10.1%}{:>10.2f}  {}'.format(
+                q.answers, q.accuracy, q.first_attempt_accuracy, q.mean_attempts,
+                text[q.question_id]))
+
+        most, least = analytics.improvement(options['min_exercises'], limit)
+        user_ids = dict(User.objects.filter(
+            pk__in=[u.user_pk for u in most + least]).values_list('pk', 'user_id'))
+        for title, rows in (("Most improved users", most), ("Least improved users", least)):
+            self.stdout.write("\n" + title)
+            self.stdout.write('{:>10}{:>8}{:>10}{:>10}  {}'.format(
+                'exercises', 'answers', 'correct', 'trend', 'user'))
+            for u in rows:
+                self.stdout.write('{:>10}{:>8}{:>10.1%}{:>+10.3f}  {}'.format(
+                    u.exercises, u.answers, u.accuracy, u.trend, user_ids[u.user_pk]))
+
+        self.stdout.write("\nAttempts at each question")
+        self.stdout.write('{:>10}{:>10}{:>10}'.format('attempts', 'times', 'answered'))
+        for r in analytics.retries():
+            attempts = str(r.attempts)
+            if r.attempts == analytics.max_attempts:
+                attempts += '+'
+            self.stdout.write('{:>10}{:>10}{:>10.1%}'.format(
+                attempts, r.times, r.answered / r.times))
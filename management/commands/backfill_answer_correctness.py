@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.word_finding.catalogue import get_catalogue
+from apps.word_finding.matching import match_many
+from apps.word_finding.models.user import AnswerGiven
+
+
+class Command(BaseCommand):
+    help = (
+        "Works out is_correct and matched_answer for answers given before they were stored. "
+        "Each batch is committed as it goes, so it can be stopped and run again to carry on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="How many answers to update in each transaction.")
+        parser.add_argument(
+            '--recompute', action='store_true',
+            help="Mark every answer again, not just those which haven't been marked. "
+                 "Useful after changing the answers to questions.")
+        parser.add_argument(
+            '--start-after', type=int, default=0,
+            help="Only mark answers with an id greater than this, to resume a --recompute.")
+
+    def handle(self, *args, **options):
+        answers = AnswerGiven.objects.filter(pk__gt=options['start_after']).order_by('pk')
+        if not options['recompute']:
+            answers = answers.filter(is_correct__isnull=True)
+        total = answers.count()
+        self.stdout.write("{} answers to mark".format(total))
+
+        matchers = get_catalogue().matchers
+        done = 0
+        last_pk = options['start_after']
+        while True:
+            batch = list(answers.filter(pk__gt=last_pk).values_list(
+                'pk', 'question_id', 'answer')[:options['batch_size']])
+            if not batch:
+                break
+            matches = match_many(((q, a) for _, q, a in batch), matchers)
+            self._update(((pk, m) for (pk, _, _), m in zip(batch, matches)))
+
+            done += len(batch)
+            last_pk = batch[-1][0]
+            self.stdout.write("{}/{} answers marked, up to id {}".format(done, total, last_pk))
+
+        self.stdout.write(self.style.SUCCESS("Marked {} answers".format(done)))
+
+    @staticmethod
+    def _update(marked):
+        """Saves the (pk, matched answer) pairs, with one UPDATE for each different match."""
+        pks_by_match = {}
+        for pk, matched in marked:
+            pks_by_match.setdefault(matched, []).append(pk)
+        with transaction.atomic():
+            for matched, pks in pks_by_match.items():
+                AnswerGiven.objects.filter(pk__in=pks).update(
+                    is_correct=matched is not None,
+                    matched_answer=matched or '',
+                )
@@ -0,0 +1,222 @@
+import json
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from libs.google_actions.tests.mocks import MockRequest
+
+from apps.word_finding import catalogue
+from apps.word_finding.instrumentation import get_sinks, percentile
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+from apps.word_finding.turn import TOKEN_DO_ANOTHER_EXERCISE
+from apps.word_finding.views import index
+
+
+PREFIX = 'benchmark-turns-'
+QUESTION = re.compile(r'benchmark question (\d+)-(\d+)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds exercises, and users who have done some of them, with the test factories, then "
+        "has scripted conversations with views.index and reports the turns per second, latency "
+        "percentiles and queries per turn for each kind of turn. Runs against the default "
+        "database, so point the settings at SQLite or Postgres to compare them. Everything it "
+        "adds is deleted afterwards. With --compare it fails if the results are worse than a "
+        "previous --save, to check a branch for performance regressions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exercises', type=int, default=10)
+        parser.add_argument(
+            '--questions', type=int, default=20, help="The number of questions per exercise.")
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument(
+            '--history', type=int, default=3,
+            help="How many exercises each user has already completed.")
+        parser.add_argument(
+            '--turns', type=int, default=50, help="The number of turns for each user.")
+        parser.add_argument(
+            '--correct-rate', type=float, default=0.7,
+            help="How often the scripted answers are correct.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save', help="Save the results as JSON to this file.")
+        parser.add_argument('--compare', help="Compare the results with those in this file.")
+        parser.add_argument(
+            '--threshold', type=float, default=10,
+            help="How much worse, as a percentage, the turns per second and latency can be "
+                 "than those being compared with. Any increase in queries fails.")
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            answers = self._seed(options)
+            results = self._replay(answers, options)
+        finally:
+            User.objects.filter(user_id__startswith=PREFIX).delete()
+            Exercise.objects.filter(name__startswith=PREFIX).delete()
+
+        self._report(results)
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self._compare(json.load(f), results, options['threshold'])
+
+    def _seed(self, options):
+        "Adds the exercises and users, returns the answer to each question by its number."
+        from factory.random import reseed_random
+        from apps.word_finding.tests.factories import (
+            ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory,
+            AnswerGivenFactory,
+        )
+
+        reseed_random(options['seed'])
+        started = time.time()
+        exercises = [
+            ExerciseFactory(name='{}{}'.format(PREFIX, e)) for e in range(options['exercises'])]
+        answers = {}
+        questions = []
+        for e, exercise in enumerate(exercises):
+            for q in range(options['questions']):
+                answers[(e, q)] = _word(e * options['questions'] + q)
+                questions.append(QuestionFactory.build(
+                    exercise=exercise,
+                    question='benchmark question {}-{} is BLANK'.format(e, q),
+                    answer=answers[(e, q)],
+                ))
+        Question.objects.bulk_create(questions)
+        catalogue.content_changed()
+
+        User.objects.bulk_create(
+            UserFactory.build(user_id='{}{}'.format(PREFIX, u)) for u in range(options['users']))
+        users = list(User.objects.filter(user_id__startswith=PREFIX).order_by('pk'))
+        ExerciseState.objects.bulk_create(
+            ExerciseStateFactory.build(
+                user=user,
+                exercise=random.choice(exercises),
+                current_question=None,
+                completed=True,
+            )
+            for user in users
+            for _ in range(options['history'])
+        )
+        states = ExerciseState.objects.filter(user__in=users)
+        questions_by_exercise = {}
+        for question in Question.objects.filter(exercise__in=exercises):
+            questions_by_exercise.setdefault(question.exercise_id, []).append(question)
+        AnswerGiven.objects.bulk_create(
+            AnswerGivenFactory.build(
+                exercise_state=state,
+                question=question,
+                answer=question.answer,
+                is_correct=True,
+                matched_answer=question.answer,
+            )
+            for state in states
+            for question in questions_by_exercise[state.exercise_id]
+        )
+        ExerciseProgress.rebuild(User.objects.filter(user_id__startswith=PREFIX))
+
+        self.stdout.write(
+            "Added {} exercises of {} questions, and {} users who have done {} of them, "
+            "in {:.1f}s".format(
+                len(exercises), options['questions'], len(users), options['history'],
+                time.time() - started))
+        return answers
+
+    def _replay(self, answers, options):
+        "Takes the turns for each user in turn, returns the results."
+        user_ids = ['{}{}'.format(PREFIX, u) for u in range(options['users'])]
+        conversations = {user_id: ('', None) for user_id in user_ids}
+        catalogue.get_catalogue()
+
+        with override_settings(WORD_FINDING_METRICS_SINKS=[
+                {'BACKEND': 'apps.word_finding.instrumentation.RecordingSink'}]):
+            sink = get_sinks()[0]
+            started = time.time()
+            for _ in range(options['turns']):
+                for user_id in user_ids:
+                    text, token = conversations[user_id]
+                    response = json.loads(index(MockRequest(
+                        text=text, user_id=user_id, conversation_token=token)).content.decode())
+                    conversations[user_id] = self._reply(response, answers, options)
+            taken = time.time() - started
+            turns = list(sink.turns)
+
+        results = {
+            'database': connection.vendor,
+            'turns': len(turns),
+            'seconds': taken,
+            'turns_per_second': len(turns) / taken,
+            'kinds': {},
+        }
+        by_kind = {'all': turns}
+        for metrics in turns:
+            by_kind.setdefault(metrics.kind, []).append(metrics)
+        for kind, kind_turns in by_kind.items():
+            latencies = sorted(m.total for m in kind_turns)
+            results['kinds'][kind] = {
+                'turns': len(kind_turns),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'queries': sum(m.queries for m in kind_turns) / len(kind_turns),
+            }
+        return results
+
+    def _reply(self, response, answers, options):
+        "Returns what the user says next, and the conversation token to send."
+        token = response.get('conversation_token')
+        if token == TOKEN_DO_ANOTHER_EXERCISE:
+            return 'yes', token
+        text = json.dumps(response)
+        matches = QUESTION.findall(text)
+        if matches and random.random() < options['correct_rate']:
+            e, q = matches[-1]
+            return answers[(int(e), int(q))], token
+        return 'wrong', token
+
+    def _report(self, results):
+        self.stdout.write(
+            "{} turns on {} in {:.2f}s, {:.1f} turns/s".format(
+                results['turns'], results['database'], results['seconds'],
+                results['turns_per_second']))
+        self.stdout.write('{:<20}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+            'kind', 'turns', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for kind, values in sorted(results['kinds'].items()):
+            self.stdout.write('{:<20}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}'.format(
+                kind, values['turns'], values['p50'] * 1000, values['p95'] * 1000,
+                values['p99'] * 1000, values['queries']))
+
+    def _compare(self, baseline, results, threshold):
+        regressions = []
+        allowed = 1 + threshold / 100.0
+        if results['turns_per_second'] * allowed < baseline['turns_per_second']:
+            regressions.append("turns/s fell from {:.1f} to {:.1f}".format(
+                baseline['turns_per_second'], results['turns_per_second']))
+        for kind, values in sorted(results['kinds'].items()):
+            before = baseline['kinds'].get(kind)
+            if before is None:
+                continue
+            if values['p95'] > before['p95'] * allowed:
+                regressions.append("{} p95 rose from {:.2f}ms to {:.2f}ms".format(
+                    kind, before['p95'] * 1000, values['p95'] * 1000))
+            if values['queries'] > before['queries'] + 1e-9:
+                regressions.append("{} queries per turn rose from {:.1f} to {:.1f}".format(
+                    kind, before['queries'], values['queries']))
+
+        if regressions:
+            raise CommandError("Slower than {}:\n{}".format(
+                baseline.get('database', 'before'), '\n'.join(regressions)))
+        self.stdout.write("No worse than the results compared with")
+
+
+def _word(number):
+    "A word made of letters, different for each number."
+    return 'word' + ''.join(chr(ord('a') + int(digit)) for digit in str(number))
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from apps.word_finding import catalogue
+from apps.word_finding.asgi import WebhookApplication, _respond
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import User, ExerciseState
+
+
+PREFIX = 'compare-concurrency-'
+SCOPE = {'type': 'http', 'method': 'POST', 'path': '/'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Has many conversations with the webhook at once, first with a thread for each request "
+        "like the WSGI view, then with the ASGI application, using the same number of threads. "
+        "Each request takes --client-delay seconds to arrive, which a WSGI worker spends waiting "
+        "on its thread and the ASGI application spends on the event loop. That is the only "
+        "difference: the ASGI application still takes each turn on a thread, so waiting for the "
+        "database holds a thread in both, and ASGI only helps with waiting for clients. Neither "
+        "side runs a real server. With --client-delay 0 they should take about as long. "
+        "The conversations are with users it adds, in a disabled exercise it adds, so nobody "
+        "else is asked its questions, and they are deleted afterwards. SQLite only allows one "
+        "writer, so with it some turns fail with 'database is locked', and are counted as "
+        "errors.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument(
+            '--turns', type=int, default=5, help="The number of requests in each conversation.")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--client-delay', type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        exercise = self._seed(options['turns'])
+        try:
+            for name, run in (('sync', self._run_sync), ('async', self._run_async)):
+                self._delete_users()
+                self._in_flight = self._peak_in_flight = self._errors = 0
+                self._lock = threading.Lock()
+                user_ids = [
+                    '{}{}'.format(PREFIX, i) for i in range(options['conversations'])]
+                self._add_users(user_ids, exercise)
+
+                started = time.time()
+                run(user_ids, options)
+                taken = time.time() - started
+
+                num_turns = len(user_ids) * options['turns']
+                self.stdout.write(
+                    "{}: {} turns in {:.2f}s, {:.1f} turns/s, at most {} requests in flight, "
+                    "{} errors".format(
+                        name, num_turns, taken, num_turns / taken, self._peak_in_flight,
+                        self._errors))
+        finally:
+            self._delete_users()
+            Exercise.objects.filter(name=PREFIX).delete()
+            catalogue.invalidate()
+
+    def _seed(self, turns):
+        # Disabled, so it isn't started for anyone, the users it adds have it in progress
+        exercise = Exercise.objects.create(name=PREFIX, enabled=False)
+        Question.objects.bulk_create(
+            Question(exercise=exercise, question='question {}'.format(i), answer='answer')
+            for i in range(turns)
+        )
+        catalogue.invalidate()
+        return exercise
+
+    def _add_users(self, user_ids, exercise):
+        "Adds the users, each already asked the exercise's first question."
+        first = exercise.question_set.order_by('pk').first()
+        User.objects.bulk_create(User(user_id=user_id) for user_id in user_ids)
+        ExerciseState.objects.bulk_create(
+            ExerciseState(
+                user_id=pk, exercise=exercise, current_question=first, last_question=first)
+            for pk in User.objects.filter(user_id__in=user_ids).values_list('pk', flat=True))
+
+    def _delete_users(self):
+        User.objects.filter(user_id__startswith=PREFIX).delete()
+
+    def _script(self, turns):
+        # Answers each of the questions, the last finishes the exercise
+        return ['answer'] * turns
+
+    def _run_sync(self, user_ids, options):
+        def converse(user_id):
+            token = None
+            for text in self._script(options['turns']):
+                self._started()
+                # A WSGI worker has the request from when it starts to arrive
+                time.sleep(options['client_delay'])
+                try:
+                    response = _respond(SCOPE, _body(user_id, text, token))
+                except Exception:
+                    response = (500, [], b'')
+                token = self._finished(*response)
+
+        with ThreadPoolExecutor(options['workers']) as executor:
+            list(executor.map(converse, user_ids))
+
+    def _run_async(self, user_ids, options):
+        application = WebhookApplication(max_threads=options['workers'])
+
+        async def converse(user_id):
+            token = None
+            for text in self._script(options['turns']):
+                self._started()
+                await asyncio.sleep(options['client_delay'])
+                try:
+                    response = await application.respond(
+                        SCOPE, _body(user_id, text, token))
+                except Exception:
+                    response = (500, [], b'')
+                token = self._finished(*response)
+
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(asyncio.gather(*[converse(u) for u in user_ids]))
+        finally:
+            application.executor.shutdown()
+
+    def _started(self):
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _finished(self, status, headers, content):
+        "Returns the conversation token for the next request."
+        with self._lock:
+            self._in_flight -= 1
+            if status != 200:
+                self._errors += 1
+                return None
+        return json.loads(content.decode('utf-8')).get('conversation_token')
+
+
+def _body(user_id, text, conversation_token):
+    return json.dumps({
+        'user': {'user_id': user_id},
+        'conversation': {'conversation_id': user_id, 'conversation_token': conversation_token},
+        'inputs': [{'raw_inputs': [{'query': text}]}],
+    }).encode('utf-8')
@@ -0,0 +1,187 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+from apps.word_finding.turn import take_turn
+
+
+EXPLAIN = {
+    'sqlite': 'EXPLAIN QUERY PLAN',
+    'postgresql': 'EXPLAIN',
+}
+
+PREFIX = 'explain-turn-queries-'
+
+# The turns whose queries are explained, and what is said in each
+TURNS = (('incorrect answer', 'wrong'), ('correct answer', 'answer'))
+
+# The statement and table of a query, to name it by
+QUERY = re.compile(r'^(SELECT|INSERT|UPDATE|DELETE)\b(?:.*?\b(?:FROM|INTO))? "?(\w+)"?', re.S)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with users and their answers, then takes some turns for one of them "
+        "and shows the query plan and timing for each of the queries the turns made. The "
+        "session store isn't used, so the turns load everything from the database. Each query "
+        "is timed --repeat times, the changes they make are rolled back. Everything it adds is "
+        "rolled back afterwards, unless --keep is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=1000000)
+        parser.add_argument('--exercises', type=int, default=20)
+        parser.add_argument(
+            '--questions', type=int, default=25, help="The number of questions per exercise.")
+        parser.add_argument(
+            '--states-per-user', type=int, default=4,
+            help="How many exercises each user has started, all but the last are completed.")
+        parser.add_argument(
+            '--repeat', type=int, default=100, help="How many times to time each query.")
+        parser.add_argument('--keep', action='store_true', help="Don't roll back the data.")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._seed(options)
+                self._analyze()
+                self._explain(options['repeat'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Rolled back")
+
+    def _seed(self, options):
+        started = time.time()
+        answers_per_user = options['questions'] * options['states_per_user']
+        num_users = max(1, options['answers'] // answers_per_user)
+        num_states = num_users * options['states_per_user']
+
+        exercises = [
+            Exercise(name='{}{}'.format(PREFIX, i), enabled=True)
+            for i in range(options['exercises'])
+        ]
+        Exercise.objects.bulk_create(exercises)
+        exercise_pks = list(Exercise.objects.filter(
+            name__startswith=PREFIX).values_list('pk', flat=True).order_by('pk'))
+        Question.objects.bulk_create(
+            Question(exercise_id=e, question='question {}'.format(q), answer='answer')
+            for e in exercise_pks
+            for q in range(options['questions'])
+        )
+        question_pks = {}
+        for pk, exercise_pk in Question.objects.filter(
+                exercise__in=exercise_pks).values_list('pk', 'exercise').order_by('pk'):
+            question_pks.setdefault(exercise_pk, []).append(pk)
+
+        User.objects.bulk_create(
+            User(user_id='{}{}'.format(PREFIX, i)) for i in range(num_users))
+        user_pks = list(User.objects.filter(
+            user_id__startswith=PREFIX).values_list('pk', flat=True).order_by('pk'))
+
+        ExerciseState.objects.bulk_create(
+            ExerciseState(
+                user_id=user_pks[i % num_users],
+                exercise_id=exercise_pks[(i // num_users) % len(exercise_pks)],
+                completed=i < num_users * (options['states_per_user'] - 1),
+            )
+            for i in range(num_states)
+        )
+        states = ExerciseState.objects.filter(
+            user__in=user_pks).values_list('pk', 'exercise').order_by('pk').iterator()
+
+        batch = []
+        num_answers = 0
+        for state_pk, exercise_pk in states:
+            for question_pk in question_pks[exercise_pk]:
+                batch.append(AnswerGiven(
+                    exercise_state_id=state_pk,
+                    question_id=question_pk,
+                    answer='answer',
+                    is_correct=True,
+                    matched_answer='answer',
+                ))
+            if len(batch) >= 10000:
+                AnswerGiven.objects.bulk_create(batch)
+                num_answers += len(batch)
+                batch = []
+        AnswerGiven.objects.bulk_create(batch)
+        num_answers += len(batch)
+
+        self.stdout.write("Added {} users, {} states and {} answers in {:.1f}s".format(
+            num_users, num_states, num_answers, time.time() - started))
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (User, ExerciseState, AnswerGiven):
+                    cursor.execute('ANALYZE {}'.format(model._meta.db_table))
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def _turn_queries(self):
+        """The queries made during the TURNS, for one of the users added, as (name, sql).
+
+        The user's exercise in progress is at its first question. Each turn is rolled back.
+        """
+        user = User.objects.filter(user_id__startswith=PREFIX).order_by('pk').first()
+        state = user._filter_current_exercise_state().get()
+        first = AnswerGiven.objects.filter(
+            exercise_state=state).values_list('question', flat=True).order_by('pk').first()
+        ExerciseState.objects.filter(pk=state.pk).update(
+            current_question=first, last_question=first)
+        ExerciseProgress.rebuild(User.objects.filter(pk=user.pk))
+
+        queries = []
+        seen = set()
+        store = {'BACKEND': 'apps.word_finding.sessions.DatabaseSessionStore'}
+        for name, text in TURNS:
+            with override_settings(WORD_FINDING_SESSION_STORE=store), \
+                    CaptureQueriesContext(connection) as captured:
+                try:
+                    with transaction.atomic():
+                        take_turn(user.user_id, text)
+                        raise Rollback
+                except Rollback:
+                    pass
+            for query in captured.captured_queries:
+                match = QUERY.match(query['sql'])
+                # Leaving out the savepoints
+                if match is None or query['sql'] in seen:
+                    continue
+                seen.add(query['sql'])
+                queries.append(('{}: {} {}'.format(name, *match.groups()), query['sql']))
+        return queries
+
+    def _explain(self, repeat):
+        explain = EXPLAIN.get(connection.vendor, 'EXPLAIN')
+        for name, sql in self._turn_queries():
+            with connection.cursor() as cursor:
+                cursor.execute('{} {}'.format(explain, sql))
+                plan = cursor.fetchall()
+
+                taken = 0
+                for _ in range(repeat):
+                    savepoint = transaction.savepoint()
+                    started = time.time()
+                    cursor.execute(sql)
+                    if cursor.description is not None:
+                        cursor.fetchall()
+                    taken += time.time() - started
+                    transaction.savepoint_rollback(savepoint)
+                taken /= max(repeat, 1)
+
+            self.stdout.write('')
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                '{} ({:.3f}ms)'.format(name, taken * 1000)))
+            self.stdout.write(sql)
+            for row in plan:
+                self.stdout.write('    ' + ' '.join(str(column) for column in row))
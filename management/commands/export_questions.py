@@ -0,0 +1,34 @@
+import io
+
+from django.core.management.base import BaseCommand
+
+from apps.word_finding.content import FORMATS, export_rows, render_rows
+from apps.word_finding.models.exercise import Question
+
+
+class Command(BaseCommand):
+    help = "Writes the questions to a file import_questions can read, or to stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help="The file's format, by default worked out from its extension.")
+        parser.add_argument(
+            '--exercise', action='append', dest='exercises',
+            help="Only export the questions for the exercise with this name, can be repeated.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        questions = Question.objects.all()
+        if options['exercises']:
+            questions = questions.filter(exercise__name__in=options['exercises'])
+
+        if path == '-':
+            for text in render_rows(export_rows(questions), format):
+                self.stdout.write(text, ending='')
+            return
+        with io.open(path, 'w', encoding='utf-8', newline='') as out:
+            out.writelines(render_rows(export_rows(questions), format))
@@ -0,0 +1,46 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.word_finding.content import FORMATS, ImportErrors, import_questions, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Adds questions from a CSV or JSON lines file, with the columns exercise, question, "
+        "response and answer. Questions the exercise already has are updated. Every row is "
+        "checked first, if any have problems they are all listed and nothing is saved.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to import, or - for stdin.")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help="The file's format, by default worked out from its extension.")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--dry-run', action='store_true', help="Check the file without saving anything.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+        if path == '-':
+            lines = sys.stdin
+        else:
+            lines = io.open(path, encoding='utf-8', newline='')
+        try:
+            result = import_questions(
+                read_rows(lines, format),
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+            )
+        except ImportErrors as e:
+            raise CommandError("Nothing was imported:\n{}".format(e))
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+        self.stdout.write("{} questions added, {} updated and {} unchanged{}".format(
+            result.added, result.updated, result.unchanged,
+            " (dry run, nothing was saved)" if options['dry_run'] else ""))
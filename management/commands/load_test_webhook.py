@@ -0,0 +1,245 @@
+import asyncio
+import json
+import random
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from apps.word_finding.catalogue import get_catalogue
+from apps.word_finding.instrumentation import percentile
+from apps.word_finding.models.user import User, ExerciseState, AnswerGiven
+from apps.word_finding.turn import TOKEN_DO_ANOTHER_EXERCISE
+
+
+class Command(BaseCommand):
+    help = (
+        "Has many conversations at once with a running webhook, posting Actions requests the "
+        "way Google does. Answers are correct at --correct-rate, using the questions in the "
+        "database, so it has to use the same database as the server. Reports the turns per "
+        "second, errors and latency, then checks the database for problems, like users with "
+        "more than one exercise in progress or answers which weren't saved.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="The webhook's URL.")
+        parser.add_argument('--conversations', type=int, default=1000)
+        parser.add_argument(
+            '--turns', type=int, default=20, help="The number of requests in each conversation.")
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help="How many requests can be waiting for a response at once, by default one for "
+                 "each conversation.")
+        parser.add_argument('--correct-rate', type=float, default=0.7)
+        parser.add_argument(
+            '--think-time', type=float, default=0,
+            help="How long, in seconds, the user takes to answer.")
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument(
+            '--prefix', default='load-test-',
+            help="The start of the user ids, each conversation is with a different user.")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--delete-users', action='store_true', help="Delete the users afterwards.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        # By what is said when asking the question, as text and as SSML
+        self.answers = {}
+        for q in get_catalogue().questions.values():
+            self.answers[q.text] = self.answers[q.speech.prompt.ssml] = q.answers[0]
+        self.question_lengths = sorted(set(len(text) for text in self.answers), reverse=True)
+        self.latencies = []
+        self.errors = {}
+        self.num_requests = 0
+        self.answers_sent = 0
+
+        loop = asyncio.get_event_loop()
+        self.semaphore = asyncio.Semaphore(
+            options['concurrency'] or options['conversations'])
+        started = time.time()
+        loop.run_until_complete(asyncio.gather(*[
+            self._converse('{}{}'.format(options['prefix'], i))
+            for i in range(options['conversations'])
+        ]))
+        taken = time.time() - started
+
+        self._report(taken)
+        self._check_database()
+        if options['delete_users']:
+            User.objects.filter(user_id__startswith=options['prefix']).delete()
+
+    async def _converse(self, user_id):
+        text = ''
+        token = None
+        for _ in range(self.options['turns']):
+            if self.options['think_time']:
+                await asyncio.sleep(self.random.uniform(0, 2 * self.options['think_time']))
+            response = await self._request(user_id, text, token)
+            if response is None:
+                # Start again, like a user would if the action failed
+                text, token = '', None
+                continue
+            if not response.get('expect_user_response', True):
+                return
+            text, token = self._reply(response)
+
+    async def _request(self, user_id, text, token):
+        "Posts a turn, returns the response, or None if there was an error."
+        body = json.dumps({
+            'user': {'user_id': user_id, 'locale': 'en-GB'},
+            'conversation': {
+                'conversation_id': user_id,
+                'type': 'ACTIVE' if token else 'NEW',
+                'conversation_token': token,
+            },
+            'inputs': [{
+                'intent': 'actions.intent.TEXT',
+                'raw_inputs': [{'input_type': 'VOICE', 'query': text}],
+                'arguments': [{'name': 'text', 'raw_text': text, 'text_value': text}],
+            }],
+        })
+        if text and token != TOKEN_DO_ANOTHER_EXERCISE:
+            self.answers_sent += 1
+
+        async with self.semaphore:
+            self.num_requests += 1
+            started = time.perf_counter()
+            try:
+                status, content = await asyncio.wait_for(
+                    _post(self.options['url'], body.encode('utf-8')), self.options['timeout'])
+            except asyncio.TimeoutError:
+                return self._error('timeout')
+            except (OSError, ValueError) as e:
+                return self._error(type(e).__name__)
+            self.latencies.append(time.perf_counter() - started)
+
+        if status != 200:
+            return self._error('HTTP {}'.format(status))
+        try:
+            return json.loads(content.decode('utf-8'))
+        except ValueError:
+            return self._error('not JSON')
+
+    def _error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        return None
+
+    def _reply(self, response):
+        "Returns what the user says next, and the conversation token to send."
+        token = response.get('conversation_token')
+        if token == TOKEN_DO_ANOTHER_EXERCISE:
+            return 'yes', token
+        try:
+            prompt = response['expected_inputs'][0]['input_prompt']['initial_prompts'][0]
+        except (KeyError, IndexError):
+            prompt = {}
+        if 'ssml' in prompt:
+            # With WORD_FINDING_SSML, the SSML is said instead
+            said = prompt['ssml']
+            if said.endswith('</speak>'):
+                said = said[:-len('</speak>')]
+        else:
+            said = prompt.get('text_to_speech', '')
+        if self.random.random() < self.options['correct_rate']:
+            # The question is at the end of what was said
+            for length in self.question_lengths:
+                answer = self.answers.get(said[-length:])
+                if answer is not None:
+                    return answer, token
+        return 'wrong', token
+
+    def _report(self, taken):
+        latencies = sorted(self.latencies)
+        num_errors = sum(self.errors.values())
+        num_requests = self.num_requests
+        self.stdout.write("{} requests in {:.1f}s, {:.1f} turns/s".format(
+            num_requests, taken, (num_requests - num_errors) / taken))
+        self.stdout.write("{} errors ({:.2%}){}".format(
+            num_errors, num_errors / max(num_requests, 1),
+            ': ' + ', '.join('{} {}'.format(n, kind) for kind, n in sorted(self.errors.items()))
+            if num_errors else ''))
+        self.stdout.write(
+            "latency p50 {:.1f}ms, p95 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms".format(
+                percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+                percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000))
+
+    def _check_database(self):
+        prefix = self.options['prefix']
+        duplicates = ExerciseState.objects.filter(
+            user__user_id__startswith=prefix,
+            completed=False,
+        ).values('user').annotate(n=Count('pk')).filter(n__gt=1).count()
+        if duplicates:
+            self.stdout.write(self.style.ERROR(
+                "{} users have more than one exercise in progress".format(duplicates)))
+        else:
+            self.stdout.write("No users have more than one exercise in progress")
+
+        stored = AnswerGiven.objects.filter(
+            exercise_state__user__user_id__startswith=prefix).count()
+        message = "{} answers sent, {} saved".format(self.answers_sent, stored)
+        if stored > self.answers_sent:
+            self.stdout.write(self.style.ERROR(message + ", some more than once"))
+        elif stored < self.answers_sent:
+            self.stdout.write(self.style.WARNING(
+                message + ", the rest failed or haven't been written yet"))
+        else:
+            self.stdout.write(message)
+
+
+async def _post(url, body):
+    "Posts the body to the url with HTTP/1.1, returns the status and the content."
+    parts = urlsplit(url)
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port, ssl=ssl.create_default_context() if https else None)
+    try:
+        writer.write(
+            'POST {} HTTP/1.1\r\n'
+            'Host: {}\r\n'
+            'Content-Type: application/json\r\n'
+            'Content-Length: {}\r\n'
+            'Connection: close\r\n'
+            '\r\n'.format(parts.path or '/', parts.netloc, len(body)).encode('latin-1') + body)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        length = None
+        chunked = False
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = value.strip().lower().endswith('chunked')
+        if chunked:
+            content = await _read_chunks(reader)
+        elif length is not None:
+            content = await reader.readexactly(length)
+        else:
+            content = await reader.read()
+        return status, content
+    finally:
+        writer.close()
+
+
+async def _read_chunks(reader):
+    "Reads a body sent with Transfer-Encoding: chunked, as ASGI servers do without a length."
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+        if not size:
+            # Any trailers, up to the blank line which ends them
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
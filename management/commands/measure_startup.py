@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.word_finding.instrumentation import percentile
+
+
+# What is reported for each run, from the timings coldstart.measure returns
+STEPS = ('setup', 'import', 'warm_up', 'first_turn', 'second_turn')
+PROFILES = ('cold', 'warmed')
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts new processes with the same settings, and reports how long each takes to set "
+        "Django up, import the views, warm up and take its first turns, and how long it is from "
+        "starting the process to the first response. Each run is done cold, taking the first "
+        "turn straight away, and warmed, warming up first as a worker does before it is ready. "
+        "With --compare it fails if the results are worse than a previous --save, to check a "
+        "branch for cold start regressions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs', type=int, default=5,
+            help="How many processes to start for each profile, the medians are reported.")
+        parser.add_argument('--save', help="Save the results as JSON to this file.")
+        parser.add_argument('--compare', help="Compare the results with those in this file.")
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help="How much slower, as a percentage, the first response can be than the one "
+                 "being compared with.")
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in PROFILES:
+            runs = [self._run(profile == 'warmed') for _ in range(options['runs'])]
+            results[profile] = {
+                name: percentile(sorted(run[name] for run in runs), 50)
+                for name in STEPS + ('first_response', 'modules')
+            }
+            results[profile]['unneeded_modules'] = sorted(set(
+                module for run in runs for module in run['unneeded_modules']))
+
+        self._report(results)
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self._compare(json.load(f), results, options['threshold'])
+
+    def _run(self, warm_up):
+        "Measures a new process, returns its timings."
+        command = [sys.executable, '-m', 'apps.word_finding.coldstart']
+        if warm_up:
+            command.append('--warm-up')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        started = time.time()
+        try:
+            output = subprocess.check_output(command, env=env, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            raise CommandError("The process failed:\n{}".format(e.output.decode('utf-8')))
+        measured = json.loads(output.decode('utf-8').splitlines()[-1])
+        run = dict(measured['timings'])
+        run['first_response'] = measured['first_response'] - started
+        run['modules'] = measured['modules']
+        run['unneeded_modules'] = measured['unneeded_modules']
+        return run
+
+    def _report(self, results):
+        self.stdout.write('{:<10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+            'profile', 'setup', 'import', 'warm up', 'turn 1', 'turn 2', 'response', 'modules'))
+        for profile in PROFILES:
+            values = results[profile]
+            self.stdout.write('{:<10}{}{:>10}'.format(
+                profile,
+                ''.join('{:>10.1f}'.format(values[name] * 1000)
+                        for name in STEPS + ('first_response',)),
+                values['modules']))
+        self.stdout.write("Times in ms, response is from starting the process to the first "
+                          "response")
+        for profile in PROFILES:
+            unneeded = results[profile]['unneeded_modules']
+            if unneeded:
+                self.stdout.write("{} imported modules the webhook doesn't need: {}".format(
+                    profile, ', '.join(unneeded)))
+
+    def _compare(self, baseline, results, threshold):
+        regressions = []
+        allowed = 1 + threshold / 100.0
+        for profile in PROFILES:
+            before, after = baseline.get(profile), results[profile]
+            if before is None:
+                continue
+            for name in ('first_response', 'first_turn'):
+                if after[name] > before[name] * allowed:
+                    regressions.append("{} {} rose from {:.1f}ms to {:.1f}ms".format(
+                        profile, name.replace('_', ' '), before[name] * 1000,
+                        after[name] * 1000))
+
+        if regressions:
+            raise CommandError("Slower to start than before:\n{}".format('\n'.join(regressions)))
+        self.stdout.write("No slower to start than the results compared with")
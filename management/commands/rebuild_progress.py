@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from apps.word_finding.models.user import User, ExerciseProgress
+
+
+class Command(BaseCommand):
+    help = (
+        "Works out each user's progress in each exercise from their history again, a batch of "
+        "users at a time. Run it once after adding the progress table, so it includes what users "
+        "did before, and whenever it might be wrong. Turns taken while a batch is rebuilt might "
+        "not be counted, so it is best run when it is quiet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'user_ids', nargs='*', help="Only rebuild the progress of these users.")
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="How many users to rebuild in each transaction.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user_ids']:
+            users = users.filter(user_id__in=options['user_ids'])
+        total = users.count()
+        self.stdout.write("{} users to rebuild".format(total))
+
+        done = rows = 0
+        last_pk = 0
+        while True:
+            batch = list(users.filter(pk__gt=last_pk).values_list(
+                'pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            rows += ExerciseProgress.rebuild(User.objects.filter(pk__in=batch))
+
+            done += len(batch)
+            last_pk = batch[-1]
+            self.stdout.write("{}/{} users rebuilt".format(done, total))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the progress of {} users, in {} exercises between them".format(done, rows)))
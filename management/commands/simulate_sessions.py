@@ -0,0 +1,73 @@
+import collections
+import io
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from apps.word_finding.simulation import simulate_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "Has a conversation with each user in a JSON file, which maps their user_ids to lists of "
+        "what they say, without Google. The turns are taken in the same way as by the webhook, "
+        "a batch of users at a time, and what would be said to them can be saved to another "
+        "JSON file. Use it to try new exercises with scripted answers, or to warm the session "
+        "store. Only use it for users who aren't talking to the webhook.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The JSON file of scripts, or - for stdin.")
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="How many users to take the turns of in each transaction.")
+        parser.add_argument(
+            '--output', help="Save what would be said to each user, as JSON, to this file.")
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Roll back everything the conversations change.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            if path == '-':
+                scripts = json.load(sys.stdin, object_pairs_hook=collections.OrderedDict)
+            else:
+                with io.open(path, encoding='utf-8') as f:
+                    scripts = json.load(f, object_pairs_hook=collections.OrderedDict)
+        except ValueError as e:
+            raise CommandError("{} isn't JSON: {}".format(path, e))
+        if not isinstance(scripts, dict) or not all(
+                isinstance(texts, list) for texts in scripts.values()):
+            raise CommandError("{} should map user_ids to lists of what they say".format(path))
+
+        started = time.time()
+        if options['dry_run']:
+            with transaction.atomic():
+                results = simulate_sessions(scripts, batch_size=options['batch_size'])
+                transaction.set_rollback(True)
+        else:
+            # Each batch is committed in its own transaction
+            results = simulate_sessions(scripts, batch_size=options['batch_size'])
+        taken = time.time() - started
+
+        turns = sum(len(user_results) for user_results in results.values())
+        kinds = collections.Counter(r.kind for user_results in results.values()
+                                    for r in user_results)
+        self.stdout.write("{} turns for {} users in {:.2f}s, {:.1f} turns/s{}".format(
+            turns, len(results), taken, turns / taken if taken else 0,
+            " (dry run, nothing was saved)" if options['dry_run'] else ""))
+        for kind, count in sorted(kinds.items()):
+            self.stdout.write('{:<20}{:>8}'.format(kind, count))
+
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(collections.OrderedDict(
+                    (user_id, [
+                        collections.OrderedDict((('kind', r.kind), ('text', r.text)))
+                        for r in user_results
+                    ])
+                    for user_id, user_results in results.items()
+                ), f, indent=2)
@@ -0,0 +1,198 @@
+"""Matching what the user said against a question's correct answers.
+
+An AnswerMatcher is built once from a question's answers, after that checking an answer is a few
+dictionary lookups for each word the user said. The catalogue keeps a matcher for every question,
+so the views and the admin don't have to build them.
+
+Speech recognition sometimes hears a word a little wrong, or writes a word which sounds the same
+(flour for flower). Matchers can also accept words within a few edits of an answer, and words
+which sound like one, set with WORD_FINDING_ANSWER_MATCHING:
+
+    WORD_FINDING_ANSWER_MATCHING = {
+        'max_edits': 1,
+        'min_fuzzy_length': 5,
+        'phonetic': True,
+        'min_phonetic_length': 4,
+    }
+
+Both are off by default, as they also accept some different words which are close (horse for
+house). Short words are left out for the same reason. The words they accept are worked out when
+the matcher is built, so they only add dictionary lookups too.
+"""
+import re
+
+from django.conf import settings
+
+
+_NOT_LETTERS = re.compile(r'[^a-z]+')
+
+ARTICLES = frozenset(('a', 'an', 'the'))
+
+
+def normalize(text):
+    """Returns the words in the text, lower cased and without any punctuation or articles."""
+    return [w for w in _NOT_LETTERS.sub(' ', text.lower()).split() if w not in ARTICLES]
+
+
+def _keys(word):
+    "The forms of the word to look up, so that plurals match the singular and vice versa."
+    keys = (word, )
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        keys += (word[:-1], )
+        if word.endswith('es'):
+            keys += (word[:-2], )
+        if word.endswith('ies'):
+            keys += (word[:-3] + 'y', )
+    return keys
+
+
+# Rewrites a word as it sounds, applied in turn, see phonetic_key
+_PHONETIC_RULES = tuple((re.compile(pattern), replacement) for pattern, replacement in (
+    (r'^[gkp]n', 'n'),
+    (r'^wr', 'r'),
+    (r'^wh', 'w'),
+    (r'^x', 's'),
+    (r'mb$', 'm'),
+    (r'ph', 'f'),
+    (r'sch', 'sk'),
+    (r'tch', 'ch'),
+    (r'[cs]h', 'X'),
+    (r'th', '0'),
+    (r'ck', 'k'),
+    (r'c(?=[eiy])', 's'),
+    (r'dg(?=[eiy])', 'j'),
+    (r'gh(?![aeiou])', ''),
+    (r'g(?=[eiy])', 'j'),
+    (r'[cq]', 'k'),
+    (r'x', 'ks'),
+    (r'z', 's'),
+    (r'v', 'f'),
+    # Silent after a vowel (saw, flower), or before a consonant
+    (r'(?<=[aeiou])[wy]|[why](?![aeiou])', ''),
+    (r'(.)\1+', r'\1'),
+))
+
+_VOWELS = re.compile(r'[aeiou]')
+
+
+def phonetic_key(word):
+    """Roughly how a lower case word sounds, in the style of Metaphone.
+
+    Words which sound the same usually have the same key: pair and pear, flour and flower, knight
+    and night. So do some which don't, as the vowels are left out after the first letter.
+    """
+    for pattern, replacement in _PHONETIC_RULES:
+        word = pattern.sub(replacement, word)
+    if not word:
+        return word
+    first = 'a' if _VOWELS.match(word) else word[0]
+    return (first + _VOWELS.sub('', word[1:])).upper()
+
+
+def edit_distance(first, second, max_distance):
+    """The number of letters to insert, delete or change to turn one word into the other.
+
+    Stops counting after max_distance, any more is returned as max_distance + 1.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(second) + 1))
+    for i, a in enumerate(first, 1):
+        current = [i]
+        for j, b in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def _deletions(word, max_edits):
+    "The word, and every word made by deleting up to max_edits letters from it."
+    words = {word}
+    for _ in range(max_edits):
+        words |= set(w[:i] + w[i + 1:] for w in words for i in range(len(w)))
+    return words
+
+
+def matcher_options():
+    "The AnswerMatcher arguments set with WORD_FINDING_ANSWER_MATCHING."
+    return getattr(settings, 'WORD_FINDING_ANSWER_MATCHING', {})
+
+
+class AnswerMatcher(object):
+    """Checks answers against a question's correct answers.
+
+    An answer is correct if any of the words in it are one of the correct answers, or the
+    singular or plural of one. Failing that, with max_edits, if a word of at least
+    min_fuzzy_length letters is that many edits from one of them, and with phonetic, if a word of
+    at least min_phonetic_length letters has the same phonetic_key as one.
+
+    For the edits, the words made by deleting up to max_edits letters from each answer are
+    worked out in advance. Any word within max_edits of an answer shares one of those with it,
+    so only the answers found by looking up the word's own deletions have to be compared with it.
+    """
+    def __init__(self, answers, max_edits=0, min_fuzzy_length=5, phonetic=False,
+                 min_phonetic_length=4):
+        self.answers = tuple(answers)
+        self.max_edits = max_edits
+        self.min_fuzzy_length = min_fuzzy_length
+        self.min_phonetic_length = min_phonetic_length
+        self._lookup = {}
+        self._deletions = {}
+        self._phonetic = {}
+        for answer in self.answers:
+            for key in _keys(answer):
+                self._lookup.setdefault(key, answer)
+                if max_edits and len(key) >= min_fuzzy_length:
+                    for deletion in _deletions(key, max_edits):
+                        self._deletions.setdefault(deletion, []).append((key, answer))
+                if phonetic and len(key) >= min_phonetic_length:
+                    self._phonetic.setdefault(phonetic_key(key), answer)
+
+    def match(self, text):
+        """Returns the correct answer given in the text, or None if there isn't one.
+
+        An exact match with any of the words said is preferred to a close one.
+        """
+        lookup = self._lookup
+        words = normalize(text)
+        for word in words:
+            for key in _keys(word):
+                answer = lookup.get(key)
+                if answer is not None:
+                    return answer
+        if self._deletions:
+            for word in words:
+                if len(word) >= self.min_fuzzy_length:
+                    answer = self._fuzzy_match(word)
+                    if answer is not None:
+                        return answer
+        if self._phonetic:
+            for word in words:
+                if len(word) >= self.min_phonetic_length:
+                    for key in _keys(word):
+                        answer = self._phonetic.get(phonetic_key(key))
+                        if answer is not None:
+                            return answer
+        return None
+
+    def _fuzzy_match(self, word):
+        for deletion in _deletions(word, self.max_edits):
+            for key, answer in self._deletions.get(deletion, ()):
+                if edit_distance(word, key, self.max_edits) <= self.max_edits:
+                    return answer
+        return None
+
+    def matches(self, text):
+        return self.match(text) is not None
+
+
+def match_many(answers_given, matchers):
+    """Matches lots of answers at once.
+
+    answers_given is an iterable of (question pk, text) pairs, and matchers a mapping from
+    question pk to AnswerMatcher, such as Catalogue.matchers. Returns a list with the matched
+    correct answer, or None, for each pair.
+    """
+    return [matchers[question_pk].match(text) for question_pk, text in answers_given]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0008_auto_20171221_1528'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answergiven',
+            name='is_correct',
+            field=models.NullBooleanField(db_index=True),
+        ),
+        migrations.AddField(
+            model_name='answergiven',
+            name='matched_answer',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+from ._in_progress_index import create_in_progress_index, drop_in_progress_index
+
+
+def complete_duplicate_states(apps, schema_editor):
+    "Only keeps the most recent state in progress for each user, so the index can be created."
+    ExerciseState = apps.get_model('word_finding', 'ExerciseState')
+    duplicated = ExerciseState.objects.filter(completed=False).values('user').annotate(
+        num_states=Count('pk'), latest=Max('pk')).filter(num_states__gt=1)
+    for duplicate in duplicated:
+        ExerciseState.objects.filter(
+            user=duplicate['user'], completed=False,
+        ).exclude(
+            pk=duplicate['latest'],
+        ).update(completed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0009_answergiven_is_correct'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answergiven',
+            index=models.Index(fields=['exercise_state', 'question'], name='word_findin_exercis_753947_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exercisestate',
+            index=models.Index(fields=['user', 'completed'], name='word_findin_user_id_c447bb_idx'),
+        ),
+        migrations.RunPython(complete_duplicate_states, migrations.RunPython.noop),
+        migrations.RunPython(create_in_progress_index, drop_in_progress_index),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from ._in_progress_index import recreate_in_progress_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0010_turn_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisestate',
+            name='last_question',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='word_finding.Question'),
+        ),
+        migrations.RunPython(recreate_in_progress_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0011_exercisestate_last_question'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exercisestate',
+            index=models.Index(fields=['user', 'exercise'], name='word_findin_user_id_df9f81_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0013_exercisestate_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExerciseProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('last_started', models.PositiveIntegerField(blank=True, null=True)),
+                ('last_completed', models.PositiveIntegerField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('correct', models.PositiveIntegerField(default=0)),
+                ('current_streak', models.PositiveIntegerField(default=0)),
+                ('best_streak', models.PositiveIntegerField(default=0)),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='word_finding.Exercise')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='word_finding.User')),
+            ],
+            options={
+                'verbose_name_plural': 'exercise progress',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='exerciseprogress',
+            unique_together=set([('user', 'exercise')]),
+        ),
+    ]
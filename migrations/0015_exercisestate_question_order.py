@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from ._in_progress_index import recreate_in_progress_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0014_exerciseprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisestate',
+            name='question_order',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(recreate_in_progress_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from ._in_progress_index import recreate_in_progress_index
+
+
+def set_question_positions(apps, schema_editor):
+    "Sets how far through their question order the exercises in progress are."
+    ExerciseState = apps.get_model('word_finding', 'ExerciseState')
+    states = ExerciseState.objects.filter(completed=False).exclude(question_order='')
+    for pk, question_order, last_question in states.values_list(
+            'pk', 'question_order', 'last_question'):
+        order = [int(question_pk) for question_pk in question_order.split(',')]
+        if last_question is None:
+            position = 0
+        elif last_question in order:
+            position = order.index(last_question) + 1
+        else:
+            # Deleted, so it isn't known
+            continue
+        ExerciseState.objects.filter(pk=pk).update(question_position=position)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('word_finding', '0015_exercisestate_question_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exercisestate',
+            name='question_position',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(recreate_in_progress_index, migrations.RunPython.noop),
+        migrations.RunPython(set_question_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+"""The partial unique index which only lets each user have one exercise in progress.
+
+It is added by 0010. Django doesn't know about it, so when SQLite copies the exercisestate table
+to add a column the index is lost, and the migrations which add columns to it recreate it.
+"""
+from __future__ import unicode_literals
+
+
+IN_PROGRESS_INDEX = 'word_finding_exercisestate_one_in_progress'
+
+# Only PostgreSQL and SQLite have partial indexes
+IN_PROGRESS_CONDITION = {
+    'postgresql': 'NOT completed',
+    'sqlite': 'completed = 0',
+}
+
+
+def create_in_progress_index(apps, schema_editor):
+    condition = IN_PROGRESS_CONDITION.get(schema_editor.connection.vendor)
+    if condition is None:
+        return
+    schema_editor.execute(
+        'CREATE UNIQUE INDEX {} ON word_finding_exercisestate (user_id) WHERE {}'.format(
+            IN_PROGRESS_INDEX, condition))
+
+
+def drop_in_progress_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in IN_PROGRESS_CONDITION:
+        return
+    # SQLite may already have lost it, when a later migration was unapplied
+    schema_editor.execute('DROP INDEX IF EXISTS {}'.format(IN_PROGRESS_INDEX))
+
+
+def recreate_in_progress_index(apps, schema_editor):
+    "SQLite copies the table to add a column, which loses the index."
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS {} ON word_finding_exercisestate (user_id) '
+        'WHERE {}'.format(IN_PROGRESS_INDEX, IN_PROGRESS_CONDITION['sqlite']))
@@ -2,9 +2,26 @@ import re
 
 from django.db import models
 
+from apps.word_finding.matching import AnswerMatcher, matcher_options
+
 # from .cue import PhoneticCue
 
 
+# What a (lower case) answer mustn't match, and what to tell the user if it does
+ANSWER_CHECKS = (
+    (re.compile(r'[^a-z, ]'), 'Answers must not include any special characters'),
+    (re.compile(r',[^ ]'), (
+        'To include multiple correct answers ensure that the answers are sparated by '
+        'commas, with a space after each comma.')),
+    (re.compile(r'[^,]+ '), 'Answers must not contain spaces.'),
+)
+
+
+def answer_errors(answer):
+    "The problems with an answer, as messages for the user. The answer should be lower case."
+    return [message for pattern, message in ANSWER_CHECKS if pattern.search(answer)]
+
+
 class Exercise(models.Model):
     name = models.CharField(max_length=32, unique=True)
     enabled = models.BooleanField(default=True)
@@ -31,16 +48,9 @@ class Question(models.Model):
     def save(self, *args, **kwargs):
         self.answer = self.answer.lower()
 
-        if re.search(r'[^a-z, ]', self.answer):
-            raise Exception('Answers must not include any special characters')
-
-        if re.search(r',[^ ]', self.answer):
-            raise Exception((
-                'To include multiple correct answers ensure that the answers are sparated by '
-                'commas, with a space after each comma.'))
-
-        if re.search(r'[^,]+ ', self.answer):
-            raise Exception('Answers must not contain spaces.')
+        errors = answer_errors(self.answer)
+        if errors:
+            raise Exception(errors[0])
 
         super(Question, self).save(*args, **kwargs)
 
@@ -48,6 +58,10 @@ class Question(models.Model):
     def answers(self):
         return self.answer.split(', ')
 
+    @property
+    def matcher(self):
+        return AnswerMatcher(self.answers, **matcher_options())
+
     def model_answer(self, answer=None):
         if not answer:
             answer = self.answers[0]
@@ -1,15 +1,40 @@
-from django.db import models
+import collections
+import functools
+import itertools
 
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Greatest
+
+from apps.word_finding.catalogue import get_catalogue, get_exercise, get_question
 from apps.word_finding.exceptions import (
     NoExerciseInProgress, NoQuestionsRemaining, NoExercisesAvailable, MaxQuestionRetriesReached,
+    StaleExerciseState,
 )
 
-from .exercise import Exercise, Question
+from apps.word_finding.scheduling import QuestionHistory, choose_exercise, order_questions
+
+
+_NOT_LOADED = object()
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_question_order(question_order):
+    """The pks in an ExerciseState's question_order.
+
+    Kept, so the order of a user's exercise is only split once for all their turns.
+    """
+    return tuple(int(pk) for pk in question_order.split(','))
 
 
 class User(models.Model):
     user_id = models.CharField(max_length=128, unique=True)
 
+    # The exercise state in progress, None if there isn't one. See _get_current_exercise_state.
+    _exercise_state = _NOT_LOADED
+
+    # Saves the answers given, see sessions.SessionStore. If None they are saved straight away.
+    answer_writer = None
+
     def __str__(self):
         return self.user_id
 
@@ -17,87 +42,213 @@ class User(models.Model):
         return ExerciseState.objects.filter(user=self, completed=False)
 
     def _get_current_exercise_state(self):
-        try:
-            return self._filter_current_exercise_state().get()
-        except ExerciseState.DoesNotExist:
+        """Returns the state in progress, with its exercise and current question.
+
+        The state is only read from the database once for each User instance, after that the
+        methods which change it keep it up to date. The exercise and question come from the
+        catalogue.
+        """
+        if self._exercise_state is _NOT_LOADED:
+            # There should only be one, but if not the latest is the one in progress
+            state = self._filter_current_exercise_state().order_by('-pk').first()
+            if state is not None:
+                state.attach_catalogued()
+            self._exercise_state = state
+        if self._exercise_state is None:
             raise NoExerciseInProgress
+        return self._exercise_state
 
     @property
     def exercise_in_progress(self):
-        return self._filter_current_exercise_state().exists()
+        try:
+            self._get_current_exercise_state()
+        except NoExerciseInProgress:
+            return False
+        return True
 
     def start_new_exercise(self):
+        """Starts the exercise chosen by the scheduling policy, and returns it.
+
+        Looks at the user's progress in each exercise with one query, the exercises come from the
+        catalogue.
+        """
         if self.exercise_in_progress:
             raise Exception("Can't start new exercise, exercise in progress.")
 
-        exercises = Exercise.objects.exclude(enabled=False)
+        exercises = get_catalogue().enabled_exercises
         if not exercises:
             raise NoExercisesAvailable
 
-        exercises_completed = ExerciseState.objects.filter(user=self)
-        new_exercises = exercises.exclude(pk__in=exercises_completed)
-        if new_exercises:
-            exercise = new_exercises.first()  # todo: make it random
-        else:  # they've already done them all once
-            exercise = exercises.first()  # todo: make it random
-
-        ExerciseState.objects.create(
+        progress = dict(ExerciseProgress.objects.filter(
             user=self,
-            exercise=exercise,
-        )
+        ).values_list('exercise', 'last_started'))
+        last_started = {pk: state_pk for pk, state_pk in progress.items() if state_pk is not None}
+        catalogued = choose_exercise(exercises, last_started)
+        exercise = catalogued.exercise
+
+        # Different each time the user starts the exercise
+        seed = '{}:{}:{}'.format(self.pk, exercise.pk, last_started.get(exercise.pk))
+        question_order = order_questions(
+            catalogued.question_pks, seed, lambda: self._question_history(exercise.pk))
+        if tuple(question_order) == catalogued.question_pks:
+            question_order = ()
+
+        try:
+            self._exercise_state = ExerciseState.objects.create(
+                user=self,
+                exercise=exercise,
+                question_order=','.join(str(pk) for pk in question_order),
+                question_position=0 if question_order else None,
+            )
+        except IntegrityError:
+            # Only one exercise can be in progress (see turn.py), another turn has just started one
+            raise StaleExerciseState
+        ExerciseProgress.record_started(self._exercise_state, exists=exercise.pk in progress)
+        self._exercise_state._attempts = 0
+        self._exercise_state._remaining = set(q.pk for q in get_exercise(exercise.pk).questions)
         return exercise
 
+    def _question_history(self, exercise_pk, num_states=8):
+        """What the user did the last time they were asked each of the exercise's questions, by
+        the question's pk, see scheduling.QuestionHistory.
+
+        Only looks at the last num_states times they did the exercise, so the time it takes
+        doesn't grow with their history.
+        """
+        states = list(ExerciseState.objects.filter(
+            user=self,
+            exercise_id=exercise_pk,
+        ).order_by('-pk').values_list('pk', flat=True)[:num_states])
+        answers = AnswerGiven.objects.filter(
+            exercise_state__in=states,
+        ).order_by('exercise_state', 'question', 'pk').values_list(
+            'exercise_state', 'question', 'is_correct', 'answer')
+
+        matchers = None
+        history = {}
+        for (state_pk, question_pk), question_answers in itertools.groupby(
+                answers, key=lambda a: a[:2]):
+            _, _, is_correct, answer = next(question_answers)
+            if is_correct is None:
+                matchers = matchers or get_catalogue().matchers
+                is_correct = matchers[question_pk].matches(answer)
+            before = history.get(question_pk)
+            if not is_correct:
+                streak = 0
+            elif before is not None and before.right:
+                streak = before.streak + 1
+            else:
+                streak = 1
+            history[question_pk] = QuestionHistory(state_pk, bool(is_correct), streak)
+        return history
+
     def check_answer(self, answer):
         state = self._get_current_exercise_state()
         if state.current_question is None:
             raise Exception("Can't check answer, there is no current question.")
-        answer_given = AnswerGiven.objects.create(
+        answer_given = AnswerGiven(
             exercise_state=state,
             question=state.current_question,
             answer=answer,
         )
-        return answer_given.correct()
+        answer_given.mark()
+        if self.answer_writer is None:
+            answer_given.save()
+            ExerciseProgress.record_answers(
+                [answer_given], {state.pk: (self.pk, state.exercise_id)})
+        else:
+            self.answer_writer.write(answer_given)
+        if state._attempts is not None:
+            state._attempts += 1
+        return answer_given.is_correct
 
     def retry_question(self, max_attempts=3):
         state = self._get_current_exercise_state()
-        if state.attempts_at_current_question() >= max_attempts:
+        if state.attempts_at_current_question(self.answer_writer) >= max_attempts:
             raise MaxQuestionRetriesReached
+        # Nothing has changed, but saving checks the state wasn't out of date
+        state.save_fields()
         return state.current_question.question
 
+    def get_current_exercise_id(self):
+        return self._get_current_exercise_state().exercise_id
+
+    def get_position(self, count_attempts=False):
+        """Where the user is up to: the pks of the state in progress and its current question, and
+        the number of answers given to it (None if they haven't been counted). With
+        count_attempts they are counted if they haven't been, and there is a current question.
+
+        None if there isn't an exercise in progress.
+        """
+        try:
+            state = self._get_current_exercise_state()
+        except NoExerciseInProgress:
+            return None
+        if count_attempts and state.current_question_id is not None:
+            state.attempts_at_current_question(self.answer_writer)
+        return state.pk, state.current_question_id, state._attempts
+
     def get_current_question(self):
         return self._get_current_exercise_state().current_question.question
 
-    def reset_current_question(self):
-        self._filter_current_exercise_state().update(current_question=None)
+    def reset_current_question(self, save=True):
+        """Clears the current question.
+
+        If save is False the change is saved by the following get_next_question or
+        complete_exercise, so the turn only updates the state once.
+        """
+        state = self._get_current_exercise_state()
+        state.current_question = None
+        state._attempts = 0
+        if save:
+            state.save_fields('current_question')
+
+    def get_question_speech(self):
+        "What we say about the current question, see responses.QuestionSpeech."
+        return get_question(self._get_current_exercise_state().current_question_id).speech
 
     def get_model_answer(self, answer=None):
-        return self._get_current_exercise_state().current_question.model_answer(answer)
+        """The model answer for the current question, as responses.Speech.
+
+        If the answer given is correct the model answer uses it (without any extra words the user
+        said), otherwise it uses the first correct answer.
+        """
+        question = get_question(self._get_current_exercise_state().current_question_id)
+        if answer:
+            answer = question.matcher.match(answer)
+        return question.speech.model_answer_for(answer)
 
     def get_next_question(self):
         state = self._get_current_exercise_state()
         if state.current_question:
             raise Exception("Can't get next question, there already is a current question.")
 
-        previous_answers = AnswerGiven.objects.filter(exercise_state=state)
-        questions_answered = (a.question.pk for a in previous_answers)
-        question = Question.objects.filter(
-            exercise=state.exercise
-        ).exclude(
-            pk__in=questions_answered
-        ).first()
-
+        fields = ['current_question', 'last_question']
+        position = state.next_position()
+        if position is not None:
+            question = get_question(parse_question_order(state.question_order)[position]).question
+            state.question_position = position + 1
+            fields.append('question_position')
+        else:
+            question = state.next_question()
         if not question:
             raise NoQuestionsRemaining
 
         state.current_question = question
-        state.save()
+        state.last_question = question
+        state._attempts = 0
+        if state._remaining is not None:
+            state._remaining.discard(question.pk)
+        state.save_fields(*fields)
         return question.question
 
     def complete_exercise(self):
-        num_updated = self._filter_current_exercise_state().update(completed=True)
-        if num_updated != 1:
-            raise Exception(
-                "There were multiple exercises not completed for user {}".format(self))
+        state = self._get_current_exercise_state()
+        state.completed = True
+        state.current_question = None
+        state.save_fields('completed', 'current_question')
+        ExerciseProgress.record_completed(state)
+        self._exercise_state = None
 
 
 class ExerciseState(models.Model):
@@ -109,7 +260,34 @@ class ExerciseState(models.Model):
     user = models.ForeignKey('User', on_delete=models.CASCADE)
     exercise = models.ForeignKey('Exercise', on_delete=models.CASCADE)
     current_question = models.ForeignKey('Question', on_delete=models.CASCADE, null=True)
+    # The most recent question asked, all the questions before it have been answered
+    last_question = models.ForeignKey(
+        'Question', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # The pks of the questions in the order they are asked, separated by commas, or empty for the
+    # catalogue's order. Chosen when the exercise is started, see scheduling.order_questions.
+    question_order = models.TextField(blank=True, default='')
+    # How many of the questions in question_order have been asked (or deleted before they were
+    # reached), so the next one can be found without looking through the order. None if it isn't
+    # known, for states from before it was kept.
+    question_position = models.PositiveIntegerField(null=True, blank=True)
     completed = models.BooleanField(default=False)
+    # Incremented by each save_fields, so a turn can tell if the state changed since it was loaded
+    version = models.PositiveIntegerField(default=0)
+
+    # How many answers have been given to the current question, None until it has been counted
+    _attempts = None
+    # The pks of the questions not asked yet, None if they follow from last_question
+    _remaining = None
+    # The question_order with the exercise's questions now, see question_pks
+    _question_pks = None
+
+    class Meta:
+        # There is also a partial unique index on user for the states which aren't completed,
+        # see migration 0010. Django 1.11 can't express that here.
+        indexes = [
+            models.Index(fields=['user', 'completed']),
+            models.Index(fields=['user', 'exercise']),
+        ]
 
     def __str__(self):
         result = "{}: {}".format(self.user, self.exercise)
@@ -117,33 +295,339 @@ class ExerciseState(models.Model):
             result += " (COMPLETED)"
         return result
 
-    def attempts_at_current_question(self):
-        return AnswerGiven.objects.filter(
-            exercise_state=self,
-            question=self.current_question,
-        ).count()
+    def attach_catalogued(self):
+        "Sets the exercise and current question from the catalogue, rather than the database."
+        self.exercise = get_exercise(self.exercise_id).exercise
+        if self.current_question_id is not None:
+            self.current_question = get_question(self.current_question_id).question
+
+    def save_fields(self, *fields):
+        """Saves the given fields, as long as the state hasn't changed since it was loaded.
+
+        Raises StaleExerciseState if it has, e.g. when it was loaded from an old conversation
+        token or another turn for the same user saved it first.
+        """
+        values = {}
+        for name in fields:
+            attname = self._meta.get_field(name).attname
+            values[attname] = getattr(self, attname)
+        num_updated = ExerciseState.objects.filter(
+            pk=self.pk,
+            version=self.version,
+        ).update(version=models.F('version') + 1, **values)
+        if num_updated != 1:
+            raise StaleExerciseState
+        self.version += 1
+
+    def question_pks(self):
+        """The pks of the exercise's questions, in the order they are asked.
+
+        Questions deleted since the exercise started are left out, and those added since are
+        asked last.
+        """
+        if self._question_pks is None:
+            exercise = get_exercise(self.exercise_id)
+            if not self.question_order:
+                self._question_pks = exercise.question_pks
+            else:
+                current = exercise.question_index
+                order = [pk for pk in parse_question_order(self.question_order) if pk in current]
+                listed = set(order)
+                order.extend(pk for pk in exercise.question_pks if pk not in listed)
+                self._question_pks = tuple(order)
+        return self._question_pks
+
+    def next_position(self):
+        """The index in question_order of the next question to ask, from question_position,
+        skipping any deleted since the exercise started.
+
+        None if there is no question_order or question_position, or the questions in it have all
+        been asked (those added since the exercise started are asked after them, see
+        next_question).
+        """
+        if not self.question_order or self.question_position is None:
+            return None
+        order = parse_question_order(self.question_order)
+        current = get_exercise(self.exercise_id).question_index
+        for position in range(self.question_position, len(order)):
+            if order[position] in current:
+                return position
+        return None
+
+    def next_question(self):
+        """Returns the first question which hasn't been asked, or None if there isn't one.
+
+        Questions are asked in the order of question_pks, so that is the question after the last
+        one asked, or the first of the remaining questions if they are known. Otherwise (the last
+        question was deleted) it is found with a single query for the questions with answers.
+        """
+        if self._remaining is None and self.last_question_id is not None and (
+                not self.question_order):
+            question = get_exercise(self.exercise_id).question_after(self.last_question_id)
+            return question.question if question else None
+
+        remaining = self.remaining_question_pks()
+        if remaining is None:
+            answered = set(AnswerGiven.objects.filter(
+                exercise_state=self,
+            ).values_list('question', flat=True))
+            remaining = set(self.question_pks()) - answered
+        for pk in self.question_pks():
+            if pk in remaining:
+                return get_question(pk).question
+        return None
+
+    def remaining_question_pks(self):
+        "The pks of the questions not asked yet, or None if they can't be known without a query."
+        if self._remaining is not None:
+            return set(self._remaining)
+        position = self.next_position()
+        if position is not None:
+            exercise = get_exercise(self.exercise_id)
+            order = parse_question_order(self.question_order)
+            # With any questions added since the exercise started
+            return set(exercise.question_pks) - set(order[:position])
+        if self.last_question_id is None:
+            return None
+        order = self.question_pks()
+        if not self.question_order:
+            return set(pk for pk in order if pk > self.last_question_id)
+        try:
+            return set(order[order.index(self.last_question_id) + 1:])
+        except ValueError:
+            return None
+
+    def attempts_at_current_question(self, answer_writer=None):
+        """The number of answers given to the current question.
+
+        Counted once, after that check_answer keeps it up to date. The answers the answer_writer
+        hasn't saved yet are counted too.
+        """
+        if self._attempts is None:
+            answers = AnswerGiven.objects.filter(
+                exercise_state=self,
+                question=self.current_question,
+            )
+            if answer_writer is None:
+                self._attempts = answers.count()
+            else:
+                saved, unsaved = answer_writer.with_unsaved(
+                    self.pk, self.current_question_id, answers.count)
+                self._attempts = saved + len(unsaved)
+        return self._attempts
+
+
+class ExerciseProgress(models.Model):
+    """A summary of what a user has done in an exercise.
+
+    Kept up to date as the user takes turns (see record_started, record_completed and
+    record_answers), so it doesn't have to be worked out from their history. The rebuild_progress
+    command works it out from the history again.
+    """
+    user = models.ForeignKey('User', on_delete=models.CASCADE)
+    exercise = models.ForeignKey('Exercise', on_delete=models.CASCADE)
+    started = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    # The pks of the most recent states started and completed, state pks increase so they say
+    # which exercises were done least recently
+    last_started = models.PositiveIntegerField(null=True, blank=True)
+    last_completed = models.PositiveIntegerField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    # The number of correct answers in a row, up to the last answer, and the most there have been
+    current_streak = models.PositiveIntegerField(default=0)
+    best_streak = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'exercise'),)
+        verbose_name_plural = 'exercise progress'
+
+    def __str__(self):
+        return "{}: {}".format(self.user, self.exercise)
+
+    @classmethod
+    def record_started(cls, state, exists=True):
+        "exists says if the user has any progress in the exercise yet, if not it is added."
+        cls._update_or_create(
+            state.user_id, state.exercise_id,
+            dict(started=models.F('started') + 1, last_started=state.pk),
+            dict(started=1, last_started=state.pk),
+            exists=exists,
+        )
+
+    @classmethod
+    def record_completed(cls, state):
+        cls._update_or_create(
+            state.user_id, state.exercise_id,
+            dict(completed=models.F('completed') + 1, last_completed=state.pk),
+            dict(started=1, last_started=state.pk, completed=1, last_completed=state.pk),
+        )
+
+    @classmethod
+    def record_answers(cls, answers, states=None):
+        """Adds the answers given, in the order they were given, with one query for each user and
+        exercise.
+
+        states maps the pk of each answer's state to the pks of its user and exercise, if it isn't
+        given they are looked up with another query.
+        """
+        if states is None:
+            states = {
+                pk: (user_pk, exercise_pk)
+                for pk, user_pk, exercise_pk in ExerciseState.objects.filter(
+                    pk__in=set(a.exercise_state_id for a in answers),
+                ).values_list('pk', 'user', 'exercise')
+            }
+        correct_by_progress = collections.OrderedDict()
+        for answer in answers:
+            key = states[answer.exercise_state_id]
+            correct_by_progress.setdefault(key, []).append(bool(answer.is_correct))
+
+        for (user_pk, exercise_pk), correct in correct_by_progress.items():
+            leading, trailing, best = streaks(correct)
+            num_correct = sum(correct)
+            updates = collections.OrderedDict((
+                ('attempts', models.F('attempts') + len(correct)),
+                ('correct', models.F('correct') + num_correct),
+                # Before current_streak, as MySQL uses the values already updated
+                ('best_streak', Greatest(
+                    models.F('best_streak'),
+                    models.F('current_streak') + leading,
+                    models.Value(best),
+                    output_field=models.PositiveIntegerField(),
+                )),
+                ('current_streak', (
+                    models.F('current_streak') + leading if leading == len(correct) else trailing
+                )),
+            ))
+            cls._update_or_create(user_pk, exercise_pk, updates, dict(
+                attempts=len(correct),
+                correct=num_correct,
+                current_streak=trailing,
+                best_streak=best,
+            ))
+
+    @classmethod
+    def rebuild(cls, users):
+        """Works out the progress of the users, a User queryset, from their history again.
+
+        Their progress is replaced with what it should be, returns how many rows there are now.
+        Answers which haven't been marked (see the backfill_answer_correctness command) are marked
+        with the catalogue.
+        """
+        progress = {}
+        for user_pk, exercise_pk, started, completed, last_started, last_completed in (
+                ExerciseState.objects.filter(
+                    user__in=users,
+                ).values(
+                    'user', 'exercise',
+                ).annotate(
+                    started=models.Count('pk'),
+                    num_completed=models.Count(models.Case(models.When(completed=True, then=1))),
+                    latest=models.Max('pk'),
+                    latest_completed=models.Max(
+                        models.Case(models.When(completed=True, then=models.F('pk')))),
+                ).values_list(
+                    'user', 'exercise', 'started', 'num_completed', 'latest', 'latest_completed',
+                )):
+            progress[(user_pk, exercise_pk)] = cls(
+                user_id=user_pk,
+                exercise_id=exercise_pk,
+                started=started,
+                completed=completed,
+                last_started=last_started,
+                last_completed=last_completed,
+            )
+
+        matchers = get_catalogue().matchers
+        answers = AnswerGiven.objects.filter(
+            exercise_state__user__in=users,
+        ).order_by(
+            'exercise_state__user', 'exercise_state__exercise', 'pk',
+        ).values_list(
+            'exercise_state__user', 'exercise_state__exercise', 'question', 'answer', 'is_correct',
+        ).iterator()
+        for key, key_answers in itertools.groupby(answers, key=lambda a: a[:2]):
+            correct = [
+                matchers[question_pk].matches(answer) if is_correct is None else is_correct
+                for _, _, question_pk, answer, is_correct in key_answers
+            ]
+            leading, trailing, best = streaks(correct)
+            exercise_progress = progress[key]
+            exercise_progress.attempts = len(correct)
+            exercise_progress.correct = sum(correct)
+            exercise_progress.current_streak = trailing
+            exercise_progress.best_streak = best
+
+        with transaction.atomic():
+            cls.objects.filter(user__in=users).delete()
+            cls.objects.bulk_create(progress.values())
+        return len(progress)
+
+    @classmethod
+    def _update_or_create(cls, user_pk, exercise_pk, updates, defaults, exists=True):
+        """Updates the progress, or if there isn't any (it hasn't been rebuilt since the user
+        started) adds it with the defaults.
+
+        If exists is False it is added without trying to update it first. If another turn adds it
+        at the same time it is updated instead.
+        """
+        progress = cls.objects.filter(user_id=user_pk, exercise_id=exercise_pk)
+        if exists and progress.update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_pk, exercise_id=exercise_pk, **defaults)
+        except IntegrityError:
+            progress.update(**updates)
+
+
+def streaks(correct):
+    """The number of correct answers in a row at the start and at the end of a list of whether each
+    answer was correct, and the most there are anywhere in it."""
+    leading = 0
+    while leading < len(correct) and correct[leading]:
+        leading += 1
+    best = run = 0
+    for is_correct in correct:
+        run = run + 1 if is_correct else 0
+        best = max(best, run)
+    return leading, run, best
 
 
 class AnswerGiven(models.Model):
     exercise_state = models.ForeignKey('ExerciseState', on_delete=models.CASCADE)
     question = models.ForeignKey('Question', on_delete=models.CASCADE)
     answer = models.CharField(max_length=32)
+    # Set by mark() when the answer is given. Answers from before these were stored have
+    # is_correct set to None until the backfill_answer_correctness command is run.
+    is_correct = models.NullBooleanField(db_index=True)
+    matched_answer = models.CharField(max_length=32, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['exercise_state', 'question']),
+        ]
+
+    def mark(self, matcher=None):
+        """Sets is_correct and matched_answer, without saving.
+
+        Uses the question's matcher from the catalogue, unless one is given.
+        """
+        if matcher is None:
+            matcher = get_question(self.question_id).matcher
+        matched = matcher.match(self.answer)
+        self.is_correct = matched is not None
+        self.matched_answer = matched or ''
 
     def correct(self):
         """Checks if the answer given is one of the correct answers.
-        An answer counts as correct if any of the words in it are a correct answer.
-        """
-        # Would be more efficient if answers were objects, then we wouldn't have to do a
-        # string comparison here.
-        # Alternatively, this bool could be part of the model, but that doesn't feel right.
-        correct_answers = list(
-            a.lower()
-            for a in Question.objects.get(pk=self.question.pk).answers
-        )
-
-        return any(
-            (word in correct_answers)
-            for word in self.answer.lower().split(' '))
+        An answer counts as correct if any of the words in it are a correct answer, see
+        AnswerMatcher.
+        """
+        if self.is_correct is not None:
+            return self.is_correct
+        return get_question(self.question_id).matcher.matches(self.answer)
 
 
 # class CueGiven(models.Model):
@@ -0,0 +1,114 @@
+"""Remembering the responses to recent requests, for when Google delivers a request again.
+
+Google sends a request again if the webhook is slow to respond. Taking the turn again would give
+the answer twice (using up one of the user's attempts) and do all the work twice, so views.index
+keeps each response for a short time and sends it again for a request it has already seen. A
+retried delivery is the same request byte for byte, so requests are identified by a hash of their
+body, which has the user, the conversation, its token and what the user said.
+
+The cache is set with WORD_FINDING_REPLAY_CACHE, in the same way as the session store:
+
+    WORD_FINDING_REPLAY_CACHE = {
+        'BACKEND': 'apps.word_finding.replay.RedisReplayCache',
+        'OPTIONS': {'url': 'redis://localhost:6379/0', 'timeout': 60},
+    }
+
+There is no cache by default. A request delivered again while the first delivery is still being
+taken isn't in the cache yet, those are recognised by take_turn instead (see turn.py).
+"""
+import collections
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+# The kind of turn measured when a response is sent again, see instrumentation.py
+REPLAYED = 'replayed'
+
+
+def request_key(body):
+    "Identifies a request by its body."
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+
+class LocMemReplayCache(object):
+    """Keeps the responses to the last max_entries requests in memory, for timeout seconds.
+
+    Each process has its own cache, so a request delivered again to another process isn't found.
+    """
+    def __init__(self, max_entries=10000, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            content, expires = self._responses.get(key, (None, None))
+            if expires is not None and expires < time.time():
+                del self._responses[key]
+                return None
+            return content
+
+    def set(self, key, content):
+        with self._lock:
+            self._responses[key] = (content, time.time() + self.timeout)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+
+class RedisReplayCache(object):
+    """Keeps the responses in Redis, shared by all the processes.
+
+    Takes either a url, which needs the redis package, or a client with get and set methods like
+    redis.StrictRedis.
+    """
+    def __init__(self, url=None, client=None, prefix='word_finding:replay:', timeout=60):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured("RedisReplayCache needs the redis package")
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, content):
+        self.client.set(self.prefix + key, content, ex=self.timeout)
+
+
+_cache = None
+_loaded = False
+
+
+def get_replay_cache():
+    "The cache set with WORD_FINDING_REPLAY_CACHE, or None if there isn't one."
+    global _cache, _loaded
+    if not _loaded:
+        config = getattr(settings, 'WORD_FINDING_REPLAY_CACHE', None)
+        if config:
+            _cache = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        else:
+            _cache = None
+        _loaded = True
+    return _cache
+
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    global _loaded
+    if setting == 'WORD_FINDING_REPLAY_CACHE':
+        _loaded = False
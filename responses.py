@@ -0,0 +1,170 @@
+"""What we say to the user, worked out in advance as plain text and as SSML.
+
+Everything said is Speech: the plain text, and the same thing in SSML (without the <speak>
+element, which is only added around the whole response, see Speech.join). The fixed phrases are
+made here, and each question's prompts and model answers are made by QuestionSpeech when the
+catalogue is loaded. A turn then only has to pick the pieces and join them, the only thing worked
+out during a turn is what the user said, when it is repeated back to them.
+
+The SSML is checked with validate_ssml as it is made, so it isn't checked on every turn. The
+views send it instead of the plain text if WORD_FINDING_SSML is True. Characters XML doesn't
+allow are left out of it, and a question whose SSML still isn't valid is said without any markup
+(see catalogue.py).
+"""
+import random
+import re
+from collections import namedtuple
+from xml.etree import ElementTree
+from xml.sax import saxutils
+
+
+# The SSML elements we use, and Actions understands
+SSML_ELEMENTS = frozenset(('speak', 'emphasis', 'break', 'prosody', 'say-as', 'p', 's', 'sub'))
+
+# How a question's BLANK is said, and how the answer is said in a model answer
+BLANK_SSML = '<emphasis level="strong">blank</emphasis>'
+ANSWER_SSML = '<emphasis level="moderate">{}</emphasis>'
+
+
+# Characters XML doesn't allow even when escaped, such as the vertical tabs pasted in from Word
+ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+
+class SSMLError(ValueError):
+    pass
+
+
+def escape(text):
+    "Escapes text to go in SSML, leaving out any characters XML doesn't allow."
+    return saxutils.escape(ILLEGAL_XML_CHARS.sub('', text))
+
+
+def validate_ssml(ssml):
+    """Checks the SSML is well formed and only uses SSML_ELEMENTS, and returns it.
+
+    Raises SSMLError if not.
+    """
+    try:
+        root = ElementTree.fromstring('<speak>{}</speak>'.format(ssml))
+    except ElementTree.ParseError as e:
+        raise SSMLError("{}: {}".format(e, ssml))
+    for element in root.iter():
+        if element.tag not in SSML_ELEMENTS:
+            raise SSMLError("<{}> isn't allowed: {}".format(element.tag, ssml))
+    return ssml
+
+
+class Speech(namedtuple('Speech', ('text', 'ssml'))):
+    __slots__ = ()
+
+    @classmethod
+    def plain(cls, text):
+        "Says the text as it is."
+        return cls(text, escape(text))
+
+    @classmethod
+    def join(cls, parts):
+        "Says each of the parts in turn, the SSML in a <speak> element."
+        return cls(
+            ' '.join(p.text for p in parts),
+            '<speak>{}</speak>'.format(' '.join(p.ssml for p in parts)))
+
+
+def phrase(text, ssml=None):
+    "A fixed phrase, the SSML is checked now rather than each time it is said."
+    if ssml is None:
+        return Speech.plain(text)
+    return Speech(text, validate_ssml(ssml))
+
+
+class Template(object):
+    """A phrase with something else said in it, where the format string has {}."""
+    def __init__(self, text, ssml=None):
+        self.text = text
+        self.ssml = escape(text) if ssml is None else ssml
+        validate_ssml(self.ssml.format(''))
+
+    def render(self, value):
+        return Speech(self.text.format(value), self.ssml.format(escape(value)))
+
+
+class Choice(object):
+    "Says one of the phrases, at random."
+    def __init__(self, *phrases):
+        self.phrases = phrases
+
+    def render(self):
+        return random.choice(self.phrases)
+
+
+WELCOME = phrase(
+    "Welcome. You have been having trouble finding your words. "
+    "These exercises will give you a chance to practice your word finding.")
+WELCOME_BACK = phrase("Welcome back. Let's start a new exercise.")
+LETS_GO = phrase("Alright, let's go!")
+GOODBYE = phrase('Goodbye')
+CORRECT = Choice(phrase("That's right,"), phrase("Correct,"))
+INCORRECT = Template("I'm sorry, {} is incorrect.")
+MOVE_ON = phrase("Let's move on.")
+EXERCISE_FINISHED = phrase(
+    "Exercise finished. Well done!", '<emphasis level="moderate">Exercise finished.</emphasis> '
+    'Well done!')
+ANOTHER_EXERCISE = phrase("Would you like to try another exercise?")
+FIRST_QUESTION = phrase("This is the first question:")
+NEXT_QUESTION = phrase("The next question is:", 'The next question is: <break time="300ms"/>')
+TRY_AGAIN = phrase("Please try again.")
+
+
+class QuestionSpeech(object):
+    """A question's prompt, its prompt to try again, and its model answers.
+
+    A model answer is the question's response (or the question) with BLANK replaced by the
+    answer, or with the answer after it if there's no BLANK. The response is split at BLANK once,
+    so an answer only has to be put in the gaps, and the model answer for each of the question's
+    answers is made in advance.
+
+    If plain is True nothing is emphasised, for a question whose SSML can't be made.
+    """
+    def __init__(self, question, plain=False):
+        self._plain = plain
+        if plain:
+            self.prompt = Speech.plain(question.question)
+        else:
+            self.prompt = phrase(
+                question.question,
+                escape(question.question).replace('BLANK', BLANK_SSML))
+        self.retry_prompt = Speech(
+            ' '.join((TRY_AGAIN.text, self.prompt.text)),
+            ' '.join((TRY_AGAIN.ssml, self.prompt.ssml)))
+
+        response = question.response if question.response else question.question
+        if 'BLANK' in response:
+            self._parts = response.split('BLANK')
+        else:
+            self._parts = [response + ' ', '']
+        self._escaped_parts = [escape(part) for part in self._parts]
+        self._model_answers = {
+            answer: self._render(answer, validate=True) for answer in question.answers}
+        self.model_answer = self._model_answers[question.answers[0]]
+
+    def _render(self, answer, validate=False):
+        if self._plain:
+            return Speech.plain(answer.join(self._parts))
+        ssml = ANSWER_SSML.format(escape(answer)).join(self._escaped_parts)
+        if validate:
+            validate_ssml(ssml)
+        return Speech(answer.join(self._parts), ssml)
+
+    def model_answer_for(self, answer=None):
+        "The model answer using the given answer, or the first correct answer."
+        if not answer:
+            return self.model_answer
+        speech = self._model_answers.get(answer)
+        if speech is None:
+            speech = self._render(answer)
+        return speech
+
+
+def sentence(speech):
+    "The speech as a sentence, with a full stop."
+    return Speech(speech.text + '.', speech.ssml + '.')
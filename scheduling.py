@@ -0,0 +1,104 @@
+"""Choosing what the user should do next.
+
+The policy used to choose the next exercise is set with WORD_FINDING_EXERCISE_POLICY, one of the
+keys of EXERCISE_POLICIES.
+
+The order the questions in an exercise are asked in is chosen when the exercise is started, by
+the policy set with WORD_FINDING_QUESTION_POLICY, one of the keys of QUESTION_POLICIES. The order
+is kept with the exercise state, so each turn only has to step to the next question in it.
+"""
+import collections
+import random
+
+from django.conf import settings
+
+
+def least_recent(exercises, last_started):
+    """Chooses an exercise the user has never done, or else the one done least recently.
+
+    exercises are the catalogued exercises to choose from, and last_started maps the pk of each
+    exercise the user has started to the pk of the most recent state for it. State pks increase,
+    so they say which exercise was done least recently.
+    """
+    never_started = [e for e in exercises if e.pk not in last_started]
+    if never_started:
+        return random.choice(never_started)
+    return min(exercises, key=lambda e: last_started[e.pk])
+
+
+def weighted_random(exercises, last_started):
+    """Chooses at random, the longer since the user did an exercise the more likely it is.
+
+    Exercises which have never been done are the most likely. See least_recent for the arguments.
+    """
+    by_recency = sorted(exercises, key=lambda e: last_started.get(e.pk, 0), reverse=True)
+    weights = range(1, len(by_recency) + 1)
+    return random.choices(by_recency, weights=weights)[0]
+
+
+EXERCISE_POLICIES = {
+    'least_recent': least_recent,
+    'random': weighted_random,
+}
+
+
+def choose_exercise(exercises, last_started):
+    policy = getattr(settings, 'WORD_FINDING_EXERCISE_POLICY', 'least_recent')
+    return EXERCISE_POLICIES[policy](exercises, last_started)
+
+
+# What a user did the last time they were asked a question: the pk of the state it was asked in,
+# whether the first answer was correct, and the number of times in a row it has been
+QuestionHistory = collections.namedtuple('QuestionHistory', ('last_asked', 'right', 'streak'))
+
+
+def sequential(question_pks, seed, history):
+    """Asks the questions in the catalogue's order.
+
+    question_pks are the pks of the exercise's questions in the catalogue's order. seed is
+    different each time a user starts an exercise, and history is a function returning the
+    QuestionHistory of each question the user has been asked, by pk.
+    """
+    return list(question_pks)
+
+
+def seeded_random(question_pks, seed, history):
+    """Asks the questions in a random order, the same order for the same seed.
+
+    See sequential for the arguments.
+    """
+    order = list(question_pks)
+    random.Random(seed).shuffle(order)
+    return order
+
+
+def spaced_repetition(question_pks, seed, history):
+    """Asks the questions the user got wrong last time first, then those they haven't been asked,
+    then those they have got right the fewest times in a row.
+
+    Questions got wrong, or got right as many times, are asked in the order they were last
+    asked, and after that in the catalogue's order. See sequential for the arguments.
+    """
+    history = history()
+
+    def priority(i):
+        pk = question_pks[i]
+        if pk not in history:
+            return (1, 0, i)
+        asked = history[pk]
+        return (1 + asked.streak if asked.right else 0, asked.last_asked, i)
+
+    return [question_pks[i] for i in sorted(range(len(question_pks)), key=priority)]
+
+
+QUESTION_POLICIES = {
+    'sequential': sequential,
+    'random': seeded_random,
+    'spaced': spaced_repetition,
+}
+
+
+def order_questions(question_pks, seed, history):
+    "The pks of the questions in the order to ask them, see sequential for the arguments."
+    policy = getattr(settings, 'WORD_FINDING_QUESTION_POLICY', 'sequential')
+    return QUESTION_POLICIES[policy](question_pks, seed, history)
@@ -0,0 +1,658 @@
+"""Where the state of each user's conversation is kept between turns.
+
+The database is always the record of what each user has done, but the state needed for a turn
+(the user, their exercise in progress, its current question and how many attempts they have had at
+it) can also be kept in a faster store, so that a turn doesn't need to read from the database.
+
+The store is set with WORD_FINDING_SESSION_STORE, in the same way as Django's CACHES:
+
+    WORD_FINDING_SESSION_STORE = {
+        'BACKEND': 'apps.word_finding.sessions.RedisSessionStore',
+        'OPTIONS': {'url': 'redis://localhost:6379/0', 'write_behind': True},
+    }
+
+The default is DatabaseSessionStore. With write_behind the answers given are saved in batches in
+the background, rather than during the turn, see WriteBehindAnswerWriter. Its flush_interval,
+batch_size and spool can be set in the OPTIONS too.
+
+The session is also sent to Actions as the conversation_token, signed so that it can't be changed,
+and whatever the store has is only used if a turn doesn't come with a token that can be trusted.
+Every turn saves the exercise state with a check on its version (see ExerciseState.save_fields),
+so if a token or stored session is out of date the turn is taken again with the state from the
+database.
+"""
+import atexit
+import collections
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.core.signals import setting_changed
+from django.db import DataError, IntegrityError, close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .catalogue import get_exercise
+from .models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+
+
+logger = logging.getLogger(__name__)
+
+# Changed whenever the values in a token change, so tokens from before are ignored
+TOKEN_VERSION = 3
+
+
+class Session(object):
+    """What we need to know about a user to take a turn, without asking the database.
+
+    remaining is a bitmap of the questions not asked yet (see CataloguedExercise.to_bitmap), and
+    revision is the exercise's revision when it was made, so the bitmap can be trusted.
+    question_order and question_position are the state's, the order the questions are asked in
+    and how far through it the user is.
+    """
+    __slots__ = (
+        'user_pk', 'state_pk', 'exercise_id', 'current_question_id', 'last_question_id',
+        'attempts', 'version', 'revision', 'remaining', 'question_order', 'question_position',
+    )
+
+    def __init__(self, user_pk, state_pk=None, exercise_id=None, current_question_id=None,
+                 last_question_id=None, attempts=None, version=0, revision=None,
+                 remaining=None, question_order='', question_position=None):
+        self.user_pk = user_pk
+        self.state_pk = state_pk
+        self.exercise_id = exercise_id
+        self.current_question_id = current_question_id
+        self.last_question_id = last_question_id
+        self.attempts = attempts
+        self.version = version
+        self.revision = revision
+        self.remaining = remaining
+        self.question_order = question_order
+        self.question_position = question_position
+
+    @classmethod
+    def from_user(cls, user):
+        state = user._exercise_state
+        if state is None:
+            return cls(user.pk)
+        exercise = get_exercise(state.exercise_id)
+        remaining = state.remaining_question_pks()
+        return cls(
+            user_pk=user.pk,
+            state_pk=state.pk,
+            exercise_id=state.exercise_id,
+            current_question_id=state.current_question_id,
+            last_question_id=state.last_question_id,
+            attempts=state._attempts,
+            version=state.version,
+            revision=exercise.revision,
+            remaining=None if remaining is None else exercise.to_bitmap(remaining),
+            question_order=state.question_order,
+            question_position=state.question_position,
+        )
+
+    def to_user(self, user_id):
+        """Returns the user, or None if the exercise or its questions have changed since."""
+        user = User(pk=self.user_pk, user_id=user_id)
+        if self.state_pk is None:
+            user._exercise_state = None
+            return user
+
+        state = ExerciseState(
+            pk=self.state_pk,
+            user=user,
+            exercise_id=self.exercise_id,
+            current_question_id=self.current_question_id,
+            last_question_id=self.last_question_id,
+            completed=False,
+            version=self.version,
+            question_order=self.question_order,
+            question_position=self.question_position,
+        )
+        try:
+            exercise = get_exercise(self.exercise_id)
+            state.attach_catalogued()
+        except ObjectDoesNotExist:
+            return None
+        if exercise.revision != self.revision:
+            return None
+        state._attempts = self.attempts
+        if self.remaining is not None:
+            state._remaining = exercise.from_bitmap(self.remaining)
+        user._exercise_state = state
+        return user
+
+    def _values(self):
+        return [getattr(self, s) for s in self.__slots__]
+
+    def to_json(self):
+        return json.dumps(self._values())
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(*json.loads(value))
+
+    def to_token(self, user_id):
+        "A signed conversation token, which can only be used for the same user."
+        return signing.dumps(
+            [TOKEN_VERSION] + self._values(), salt=_token_salt(user_id), compress=True)
+
+    @classmethod
+    def from_token(cls, user_id, token):
+        """The session in a token made by to_token, or None if it can't be used.
+
+        That is if it was made for another user or by another TOKEN_VERSION, or has been changed.
+        """
+        if not token:
+            return None
+        try:
+            values = signing.loads(token, salt=_token_salt(user_id))
+        except signing.BadSignature:
+            return None
+        if not isinstance(values, list) or values[:1] != [TOKEN_VERSION]:
+            return None
+        return cls(*values[1:])
+
+
+def _token_salt(user_id):
+    return 'apps.word_finding.sessions.token:{}'.format(user_id)
+
+
+def _load_from_database(user_id):
+    state = ExerciseState.objects.select_related('user').filter(
+        user__user_id=user_id,
+        completed=False,
+    ).order_by('-pk').first()
+    if state is not None:
+        user = state.user
+        state.attach_catalogued()
+        user._exercise_state = state
+        return user, False
+
+    user, created = User.objects.get_or_create(user_id=user_id)
+    user._exercise_state = None
+    return user, created
+
+
+class ImmediateAnswerWriter(object):
+    def write(self, answer_given):
+        answer_given.save()
+        state = answer_given.exercise_state
+        ExerciseProgress.record_answers(
+            [answer_given], {state.pk: (state.user_id, state.exercise_id)})
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def flush(self):
+        return 0
+
+    def with_unsaved(self, exercise_state_id, question_id, saved):
+        "Returns what saved() returns, and the answers to the question not saved yet."
+        return saved(), []
+
+
+class WriteBehindAnswerWriter(object):
+    """Keeps the answers given, and saves them with bulk_create every flush_interval seconds, or
+    sooner once there are batch_size of them.
+
+    The answers are saved by a background thread. If flush_interval is None there isn't one,
+    and they are only saved when flush() is called. The answers written during a turn are only
+    kept once the turn calls commit(), rollback() forgets them.
+
+    With a spool the answers are also appended to a file when they are committed, so they aren't
+    lost if the process stops before saving them. Every process (and every writer) has its own
+    file, the spool path with a unique suffix, and holds a lock on it for as long as it runs.
+    When a writer is created it takes over the files of writers which have stopped, whose locks
+    are free, and saves their answers with its own. An answer is only removed from a file once
+    it has been saved, so if a process stops while saving, the answers being saved may be saved
+    twice.
+
+    If the database won't take a batch (it raises DataError or IntegrityError, not because it
+    can't be reached) the answers are saved one at a time, and any which can't be are logged and
+    left out, so they don't hold up the rest. With a spool they are kept in its .rejected file.
+    """
+    def __init__(self, flush_interval=1.0, batch_size=500, spool=None):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.spool = spool
+        self._pending = []
+        # The answers being saved, if saving them fails they are saved first next time
+        self._flushing = []
+        # Whether the answers in _flushing are being saved right now
+        self._in_flight = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Turns append to the spool file at the same time, but not while flush() moves it aside
+        self._appending = 0
+        self._rotating = False
+        self._spool_changed = threading.Condition()
+        self._wake = threading.Event()
+        self._thread = None
+        self._turn = threading.local()
+        if spool is not None:
+            self._path = '{}.{}-{}'.format(spool, os.getpid(), uuid.uuid4().hex[:8])
+            self._path_lock = _take_over_spools(spool, self._path)
+            self._flushing = _recover_spool(self._flushing_spool)
+            self._pending = _recover_spool(self._path)
+            if (self._flushing or self._pending) and self.flush_interval is not None:
+                self._start()
+
+    @property
+    def _flushing_spool(self):
+        return self._path + '.flushing'
+
+    def write(self, answer_given):
+        if not hasattr(self._turn, 'answers'):
+            self._turn.answers = []
+        self._turn.answers.append(answer_given)
+
+    def commit(self):
+        answers = getattr(self._turn, 'answers', [])
+        self._turn.answers = []
+        if not answers:
+            return
+        if self.spool is None:
+            with self._lock:
+                self._pending.extend(answers)
+                full = len(self._pending) >= self.batch_size
+        else:
+            with self._spool_changed:
+                while self._rotating:
+                    self._spool_changed.wait()
+                self._appending += 1
+            try:
+                _append_to_spool(self._path, answers)
+                # Before the file can be moved aside, so the answers in it are always pending
+                with self._lock:
+                    self._pending.extend(answers)
+                    full = len(self._pending) >= self.batch_size
+            finally:
+                with self._spool_changed:
+                    self._appending -= 1
+                    self._spool_changed.notify_all()
+        if self.flush_interval is not None:
+            if self._thread is None:
+                self._start()
+            if full:
+                self._wake.set()
+
+    def rollback(self):
+        self._turn.answers = []
+
+    def flush(self):
+        "Saves all the answers written so far, returns how many there were."
+        with self._flush_lock:
+            if self.spool is not None:
+                with self._spool_changed:
+                    self._rotating = True
+                    while self._appending:
+                        self._spool_changed.wait()
+            try:
+                with self._lock:
+                    if not self._flushing:
+                        self._flushing, self._pending = self._pending, []
+                        if self.spool is not None and os.path.exists(self._path):
+                            # Answers committed from now on go in a new spool file
+                            os.replace(self._path, self._flushing_spool)
+                    flushing = self._flushing
+                    self._in_flight = bool(flushing)
+            finally:
+                if self.spool is not None:
+                    with self._spool_changed:
+                        self._rotating = False
+                        self._spool_changed.notify_all()
+            if not flushing:
+                return 0
+            try:
+                try:
+                    self._save(flushing)
+                except (DataError, IntegrityError):
+                    self._save_separately(flushing)
+            finally:
+                with self._lock:
+                    self._in_flight = False
+            with self._lock:
+                self._flushing = []
+            if self.spool is not None and os.path.exists(self._flushing_spool):
+                os.remove(self._flushing_spool)
+        return len(flushing)
+
+    def _save(self, answers):
+        with transaction.atomic():
+            AnswerGiven.objects.bulk_create(answers, batch_size=self.batch_size)
+            ExerciseProgress.record_answers(answers)
+
+    def _save_separately(self, answers):
+        "Saves the answers one at a time, leaving out those the database won't take."
+        for i, answer in enumerate(answers):
+            try:
+                self._save([answer])
+            except (DataError, IntegrityError):
+                logger.exception(
+                    "Couldn't save an answer, leaving it out: %s", _spool_line(answer))
+                if self.spool is not None:
+                    _append_to_spool(self.spool + '.rejected', [answer])
+            except Exception:
+                # Only the answers not saved yet are tried again
+                with self._lock:
+                    self._flushing = answers[i:]
+                raise
+
+    def with_unsaved(self, exercise_state_id, question_id, saved):
+        """Returns what saved() returns, and the answers to the question not saved yet.
+
+        saved should read the answers which have been saved. It isn't held up by answers being
+        saved, unless some of them are answers to the question (which it might or might not see),
+        then it waits for them to be saved. If answers to the question start being saved while it
+        is called, it is called again, so none are missed or counted twice.
+        """
+        def ours(answers):
+            return [
+                a for a in answers
+                if a.exercise_state_id == exercise_state_id and a.question_id == question_id
+            ]
+
+        while True:
+            with self._lock:
+                in_flight = ours(self._flushing) if self._in_flight else []
+                unsaved = (
+                    ([] if self._in_flight else ours(self._flushing)) + ours(self._pending))
+            if in_flight:
+                # Wait for them to be saved
+                with self._flush_lock:
+                    pass
+                continue
+            result = saved()
+            with self._lock:
+                still_unsaved = set(
+                    id(a) for a in ([] if self._in_flight else self._flushing) + self._pending)
+            if all(id(a) in still_unsaved for a in unsaved):
+                break
+        return result, [a.answer for a in unsaved + ours(getattr(self._turn, 'answers', []))]
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='word_finding answer writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Couldn't save answers, will try again")
+            finally:
+                close_old_connections()
+
+
+# The fields of the answers kept in spool files
+_SPOOL_FIELDS = ('exercise_state_id', 'question_id', 'answer', 'is_correct', 'matched_answer')
+
+
+def _spool_line(answer):
+    return json.dumps([getattr(answer, name) for name in _SPOOL_FIELDS])
+
+
+def _append_to_spool(path, answers):
+    "Adds the answers to the file, and makes sure they are on disk before returning."
+    with open(path, 'a') as f:
+        f.write(''.join(_spool_line(answer) + '\n' for answer in answers))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _take_over_spools(spool, path):
+    """Locks the spool file at path for this writer, and moves the answers in the files of
+    writers which have stopped into it. Returns the locked file, which must be kept open.
+
+    A writer's file is locked for as long as it runs (the lock goes when its process stops), so
+    files whose locks are free belong to writers which have stopped. Files from before each writer
+    had its own, at the spool path itself, are taken over too. Only one writer takes over files
+    at a time.
+    """
+    with open(spool + '.lock', 'a') as takeover_lock:
+        fcntl.flock(takeover_lock, fcntl.LOCK_EX)
+        path_lock = open(path + '.lock', 'a')
+        fcntl.flock(path_lock, fcntl.LOCK_EX)
+
+        stopped = [spool]
+        stopped_locks = []
+        try:
+            for lock_path in sorted(glob.glob(glob.escape(spool) + '.*.lock')):
+                other = lock_path[:-len('.lock')]
+                if other == path:
+                    continue
+                other_lock = open(lock_path, 'a')
+                try:
+                    fcntl.flock(other_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Its writer is still running
+                    other_lock.close()
+                    continue
+                stopped.append(other)
+                stopped_locks.append(other_lock)
+
+            flushing, pending = [], []
+            for other in stopped:
+                flushing.extend(_recover_spool(other + '.flushing'))
+                pending.extend(_recover_spool(other))
+            if flushing:
+                _append_to_spool(path + '.flushing', flushing)
+            if pending:
+                _append_to_spool(path, pending)
+            for other in stopped:
+                for name in (other + '.flushing', other):
+                    if os.path.exists(name):
+                        os.remove(name)
+            # Only once their answers are safe, while they are still locked
+            for other_lock in stopped_locks:
+                os.remove(other_lock.name)
+        finally:
+            for other_lock in stopped_locks:
+                other_lock.close()
+    return path_lock
+
+
+def _recover_spool(path):
+    """The answers in the file, which might not exist.
+
+    The last line is cut short if the process stopped while writing it. That answer is ignored,
+    and the line is ended so the answers added after it can be read.
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    answers = []
+    for line in lines:
+        try:
+            values = json.loads(line)
+        except ValueError:
+            logger.warning("Ignoring an answer which wasn't completely written to %s", path)
+            continue
+        answers.append(AnswerGiven(**dict(zip(_SPOOL_FIELDS, values))))
+    if lines and not lines[-1].endswith('\n'):
+        with open(path, 'a') as f:
+            f.write('\n')
+    return answers
+
+
+class SessionStore(object):
+    """Loads users ready for a turn, and saves their state after it."""
+    def __init__(self, write_behind=False, flush_interval=1.0, batch_size=500, spool=None):
+        if write_behind:
+            self.answer_writer = WriteBehindAnswerWriter(flush_interval, batch_size, spool)
+        else:
+            self.answer_writer = ImmediateAnswerWriter()
+
+    def load(self, user_id, conversation_token=None):
+        """Returns (user, created) like get_or_create, with the user's exercise state loaded.
+
+        The state comes from the conversation token if there is one which can be used, otherwise
+        from the store.
+        """
+        session = Session.from_token(user_id, conversation_token)
+        user = session.to_user(user_id) if session is not None else None
+        if user is not None:
+            return self._ready(user), False
+        return self._load(user_id)
+
+    def load_from_database(self, user_id):
+        "Like load, but ignores the token and anything stored, used when those are out of date."
+        self.discard(user_id)
+        user, created = _load_from_database(user_id)
+        return self._ready(user), created
+
+    def _load(self, user_id):
+        raise NotImplementedError
+
+    def save(self, user):
+        "Called after each turn, once the changes to the database have been committed."
+        pass
+
+    def discard(self, user_id):
+        "Forgets what we know about the user, if a turn fails."
+        pass
+
+    def _ready(self, user):
+        user.answer_writer = self.answer_writer
+        return user
+
+
+class DatabaseSessionStore(SessionStore):
+    """Loads the user and their exercise in progress with one query.
+
+    There is nothing to save, the models have already saved their changes.
+    """
+    def _load(self, user_id):
+        user, created = _load_from_database(user_id)
+        return self._ready(user), created
+
+
+class CachedSessionStore(SessionStore):
+    """Keeps a Session for each user, only using the database if it doesn't have one.
+
+    Subclasses say where the sessions are kept, by implementing _get, _set and _delete.
+    """
+    def _load(self, user_id):
+        value = self._get(user_id)
+        user = Session.from_json(value).to_user(user_id) if value is not None else None
+        if user is not None:
+            return self._ready(user), False
+        user, created = _load_from_database(user_id)
+        return self._ready(user), created
+
+    def save(self, user):
+        self._set(user.user_id, Session.from_user(user).to_json())
+
+    def discard(self, user_id):
+        self._delete(user_id)
+
+    def _get(self, user_id):
+        raise NotImplementedError
+
+    def _set(self, user_id, value):
+        raise NotImplementedError
+
+    def _delete(self, user_id):
+        raise NotImplementedError
+
+
+class LocMemSessionStore(CachedSessionStore):
+    """Keeps the most recently used max_entries sessions in memory.
+
+    Each process has its own sessions, so this is only suitable if all the turns for a user are
+    taken by the same process.
+    """
+    def __init__(self, max_entries=10000, **kwargs):
+        super(LocMemSessionStore, self).__init__(**kwargs)
+        self.max_entries = max_entries
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        with self._lock:
+            value = self._sessions.get(user_id)
+            if value is not None:
+                self._sessions.move_to_end(user_id)
+            return value
+
+    def _set(self, user_id, value):
+        with self._lock:
+            self._sessions[user_id] = value
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def _delete(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+
+class RedisSessionStore(CachedSessionStore):
+    """Keeps the sessions in Redis, shared by all the processes.
+
+    Takes either a url, which needs the redis package, or a client with get, set and delete
+    methods like redis.StrictRedis.
+    """
+    def __init__(self, url=None, client=None, prefix='word_finding:session:', timeout=3600,
+                 **kwargs):
+        super(RedisSessionStore, self).__init__(**kwargs)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured("RedisSessionStore needs the redis package")
+            client = redis.StrictRedis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _get(self, user_id):
+        value = self.client.get(self.prefix + user_id)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return value
+
+    def _set(self, user_id, value):
+        self.client.set(self.prefix + user_id, value, ex=self.timeout)
+
+    def _delete(self, user_id):
+        self.client.delete(self.prefix + user_id)
+
+
+_store = None
+
+
+def get_session_store():
+    global _store
+    if _store is None:
+        config = getattr(settings, 'WORD_FINDING_SESSION_STORE', {})
+        backend = config.get('BACKEND', 'apps.word_finding.sessions.DatabaseSessionStore')
+        _store = import_string(backend)(**config.get('OPTIONS', {}))
+    return _store
+
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    global _store
+    if setting == 'WORD_FINDING_SESSION_STORE':
+        _store = None
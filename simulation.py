@@ -0,0 +1,101 @@
+"""Having conversations with many users at once, without Google or HTTP.
+
+simulate_sessions takes what each user says, in order, and takes their turns the same way
+views.index does (see turn.py), so it says the same things. It is for checking new exercises
+with scripted answers, warming the session store, and as the engine of load tests.
+
+The users are taken batch_size at a time, each batch in one transaction. Their users and
+exercises in progress are loaded together with a few queries, and each user is then kept in
+memory for all their turns, rather than being loaded again for each one. Their answers are saved
+together at the end of the batch, with bulk_create.
+
+The turns aren't checked against turns taken at the same time by views.index, so it should only
+be used for users who aren't talking to the webhook. If a state has been changed by something else
+StaleExerciseState is raised and the batch is rolled back.
+"""
+import collections
+
+from django.db import transaction
+
+from .catalogue import get_catalogue
+from .models.user import User, ExerciseState
+from .sessions import WriteBehindAnswerWriter, get_session_store
+from .turn import _take_turn
+
+
+def simulate_sessions(scripts, batch_size=100):
+    """Takes the turns for each user, returns the TurnResults for each user by their user_id.
+
+    scripts maps each user's user_id to a list of what they say, in order, starting with the
+    turn which starts the conversation (what is said then isn't used, as with Actions). A turn's
+    conversation_token is the one the next turn is taken with, the session tokens views.index
+    sends while an exercise is in progress aren't made.
+
+    The session store is given the users' sessions once each batch is committed.
+    """
+    get_catalogue()
+    store = get_session_store()
+    user_ids = list(scripts)
+    results = collections.OrderedDict()
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        writer = WriteBehindAnswerWriter(flush_interval=None, batch_size=1000)
+        with transaction.atomic():
+            users = _load_users(batch)
+            for user_id in batch:
+                user, created = users[user_id]
+                user.answer_writer = writer
+                results[user_id] = _take_turns(user, created, scripts[user_id], writer)
+            writer.flush()
+            transaction.on_commit(_saver(store, [user for user, _ in users.values()]))
+    return results
+
+
+def _load_users(user_ids):
+    """Returns (user, created) like get_or_create for each user_id, with the user's exercise
+    state loaded, creating the users who don't exist yet."""
+    users = {}
+    # There should only be one for each user, but if not the latest is the one in progress
+    for state in ExerciseState.objects.select_related('user').filter(
+            user__user_id__in=user_ids,
+            completed=False,
+    ).order_by('pk'):
+        state.attach_catalogued()
+        state.user._exercise_state = state
+        users[state.user.user_id] = (state.user, False)
+
+    missing = [user_id for user_id in user_ids if user_id not in users]
+    if missing:
+        existing = set()
+        for user in User.objects.filter(user_id__in=missing):
+            user._exercise_state = None
+            users[user.user_id] = (user, False)
+            existing.add(user.user_id)
+        new = [user_id for user_id in missing if user_id not in existing]
+        if new:
+            User.objects.bulk_create(User(user_id=user_id) for user_id in new)
+            # bulk_create doesn't set the pks on every database
+            for user in User.objects.filter(user_id__in=new):
+                user._exercise_state = None
+                users[user.user_id] = (user, True)
+    return users
+
+
+def _take_turns(user, created, texts, writer):
+    results = []
+    conversation_token = None
+    for text in texts:
+        result = _take_turn(user, created, text, conversation_token)
+        writer.commit()
+        created = False
+        conversation_token = result.conversation_token
+        results.append(result)
+    return results
+
+
+def _saver(store, users):
+    def save():
+        for user in users:
+            user.answer_writer = store.answer_writer
+            store.save(user)
+    return save
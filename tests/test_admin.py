@@ -0,0 +1,111 @@
+import unittest
+
+import pytest
+
+from django.contrib import admin
+from django.contrib.auth.models import User as AuthUser
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.word_finding import catalogue
+from apps.word_finding.admin import EstimatedCountPaginator
+from apps.word_finding.models.exercise import Exercise
+from apps.word_finding.models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+from .factories import ExerciseFactory, QuestionFactory, ExerciseStateFactory, AnswerGivenFactory
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF='apps.word_finding.tests.urls')
+class TestChangelistQueries(TestCase):
+    """The number of queries for a page of a changelist doesn't depend on how many rows it
+    shows."""
+    def setUp(self):
+        self.superuser = AuthUser.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=self.exercise)
+
+    def _add_answers(self, n):
+        for _ in range(n):
+            state = ExerciseStateFactory(
+                exercise=self.exercise, current_question=self.question,
+                last_question=QuestionFactory(exercise=self.exercise))
+            AnswerGivenFactory(
+                exercise_state=state, question=QuestionFactory(exercise=ExerciseFactory()))
+        ExerciseProgress.rebuild(User.objects.all())
+
+    def _queries(self, model, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.superuser
+        with CaptureQueriesContext(connection) as queries:
+            response = admin.site._registry[model].changelist_view(request)
+            response.render()
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def _assert_constant(self, model, **params):
+        self._add_answers(1)
+        one_row = self._queries(model, **params)
+        self._add_answers(5)
+        self.assertEqual(self._queries(model, **params), one_row)
+
+    def test_answers(self):
+        self._assert_constant(AnswerGiven)
+
+    def test_answers_by_exercise(self):
+        self._assert_constant(AnswerGiven, o='-7')
+
+    def test_exercise_states(self):
+        self._assert_constant(ExerciseState)
+
+    def test_exercise_progress(self):
+        self._assert_constant(ExerciseProgress)
+
+    def test_search_for_user(self):
+        self._add_answers(2)
+        user = User.objects.first()
+        request = RequestFactory().get('/', {'q': user.user_id})
+        request.user = self.superuser
+        response = admin.site._registry[ExerciseState].changelist_view(request)
+        self.assertEqual(
+            list(response.context_data['cl'].result_list), list(user.exercisestate_set.all()))
+
+
+@pytest.mark.django_db
+@unittest.skipIf(numpy is None, "The analytics need numpy")
+@override_settings(ROOT_URLCONF='apps.word_finding.tests.urls')
+class TestAnswerAnalyticsView(TestCase):
+    def setUp(self):
+        self.addCleanup(catalogue.invalidate)
+        self.superuser = AuthUser.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.question = QuestionFactory(question='What do you wear on your BLANK?', answer='foot')
+        AnswerGivenFactory(question=self.question, answer='foot', is_correct=True)
+
+    def _get(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.superuser
+        return admin.site._registry[AnswerGiven].analytics_view(request).render()
+
+    def test_form(self):
+        response = self._get()
+        self.assertContains(response, 'name="min_answers"')
+        self.assertNotContains(response, 'Hardest questions')
+
+    def test_analytics(self):
+        response = self._get(exercise='', min_answers=1, min_exercises=2)
+        self.assertContains(response, 'What do you wear on your BLANK?')
+        self.assertContains(response, '<h2>1 answers</h2>')
+
+
+@pytest.mark.django_db
+class TestEstimatedCountPaginator(TestCase):
+    def test_counts_small_tables(self):
+        ExerciseFactory.create_batch(3)
+        paginator = EstimatedCountPaginator(Exercise.objects.order_by('pk'), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
@@ -0,0 +1,98 @@
+import unittest
+
+import pytest
+
+from django.test import TestCase
+
+from apps.word_finding import catalogue
+from apps.word_finding.analytics import analyse, QuestionStats, UserStats, RetryStats
+from .factories import (
+    AnswerGivenFactory, ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@pytest.mark.django_db
+@unittest.skipIf(numpy is None, "The analytics need numpy")
+class TestAnalyse(TestCase):
+    def setUp(self):
+        self.addCleanup(catalogue.invalidate)
+        self.exercise = ExerciseFactory()
+        self.q1 = QuestionFactory(exercise=self.exercise, answer='boot')
+        self.q2 = QuestionFactory(exercise=self.exercise, answer='shoe')
+        self.u1 = UserFactory()
+        self.u2 = UserFactory()
+        # u1 gets half right in their first exercise and all of them in their second
+        self._answer(self.u1, [(self.q1, 'sock'), (self.q1, 'sock'), (self.q1, 'boot'),
+                               (self.q2, 'shoe')])
+        self._answer(self.u1, [(self.q1, 'boot'), (self.q2, 'shoe')])
+        # The answer to q2 is from before is_correct was stored
+        self._answer(self.u2, [(self.q1, 'sock'), (self.q1, 'sock'), (self.q1, 'sock'),
+                               (self.q2, 'shoe', None)])
+
+    def _answer(self, user, answers, exercise=None):
+        state = ExerciseStateFactory(
+            user=user, exercise=exercise or self.exercise, current_question=None,
+            completed=True)
+        for answer in answers:
+            question, text = answer[:2]
+            is_correct = answer[2] if len(answer) > 2 else text in question.answers
+            AnswerGivenFactory(
+                exercise_state=state, question=question, answer=text, is_correct=is_correct)
+
+    def _check(self, analytics):
+        self.assertEqual(analytics.num_answers, 10)
+        self.assertEqual(analytics.questions(), [
+            QuestionStats(self.q1.pk, 7, 2, 2 / 7, 1 / 3, 7 / 3),
+            QuestionStats(self.q2.pk, 3, 3, 1.0, 1.0, 1.0),
+        ])
+        self.assertEqual(analytics.users(), [
+            UserStats(self.u1.pk, 2, 6, 4, 4 / 6, 0.5),
+            UserStats(self.u2.pk, 1, 4, 1, 0.25, None),
+        ])
+        self.assertEqual(analytics.retries(), [
+            RetryStats(1, 4, 4),
+            RetryStats(3, 2, 1),
+        ])
+
+    def test_analyse(self):
+        self._check(analyse())
+
+    def test_in_chunks(self):
+        self._check(analyse(chunk_size=1))
+
+    def test_one_exercise(self):
+        other = ExerciseFactory()
+        self._answer(self.u1, [(QuestionFactory(exercise=other, answer='hat'), 'hat')], other)
+        self._check(analyse(self.exercise))
+        self.assertEqual(analyse().num_answers, 11)
+
+    def test_minimums(self):
+        analytics = analyse()
+        self.assertEqual([q.question_id for q in analytics.questions(4)], [self.q1.pk])
+        self.assertEqual([u.user_pk for u in analytics.users(2)], [self.u1.pk])
+
+    def test_improvement(self):
+        u3 = UserFactory()
+        self._answer(u3, [(self.q1, 'boot')])
+        self._answer(u3, [(self.q1, 'sock'), (self.q1, 'boot')])
+        most, least = analyse().improvement(limit=1)
+        self.assertEqual([u.user_pk for u in most], [self.u1.pk])
+        self.assertEqual([(u.user_pk, u.trend) for u in least], [(u3.pk, -0.5)])
+
+    def test_max_attempts(self):
+        self.assertEqual(analyse(max_attempts=2).retries(), [
+            RetryStats(1, 4, 4),
+            RetryStats(2, 2, 1),
+        ])
+
+    def test_no_answers(self):
+        analytics = analyse(ExerciseFactory())
+        self.assertEqual(analytics.num_answers, 0)
+        self.assertEqual(analytics.questions(), [])
+        self.assertEqual(analytics.users(), [])
+        self.assertEqual(analytics.retries(), [])
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+import pytest
+
+from django.test import TransactionTestCase, override_settings
+
+from apps.word_finding import catalogue, warmup
+from apps.word_finding.asgi import WebhookApplication, _request as _http_request
+from apps.word_finding.models.user import User
+from .factories import QuestionFactory
+
+
+def _call(application, scope, messages):
+    "Runs the application for one connection, returns the messages it sent."
+    messages = list(messages)
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.get_event_loop().run_until_complete(application(scope, receive, send))
+    return sent
+
+
+def _request(body, chunk_size=None):
+    chunk_size = chunk_size or len(body) or 1
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    return [
+        {'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+
+@pytest.mark.django_db
+class TestWebhookApplication(TransactionTestCase):
+    def setUp(self):
+        self.application = WebhookApplication(max_threads=1)
+        self.addCleanup(lambda: self.application.executor.shutdown())
+        self.addCleanup(catalogue.invalidate)
+
+    def test_turn(self):
+        QuestionFactory(question="What's a pea?")
+        body = json.dumps({
+            'user': {'user_id': 'user'},
+            'conversation': {'conversation_id': '1'},
+            'inputs': [{'raw_inputs': [{'query': ''}]}],
+        }).encode('utf-8')
+        start, response = _call(
+            self.application, {'type': 'http', 'method': 'POST', 'path': '/'}, _request(body, 10))
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'Content-Type', b'application/json'), start['headers'])
+        self.assertIn("What's a pea?", response['body'].decode('utf-8'))
+        self.assertTrue(User.objects.filter(user_id='user').exists())
+
+    def test_not_json(self):
+        start, response = _call(
+            self.application, {'type': 'http', 'method': 'GET', 'path': '/'}, _request(b''))
+        self.assertEqual(start['status'], 200)
+        self.assertIn(b'Hello world', response['body'])
+
+    def test_routed(self):
+        with mock.patch.object(warmup, '_ready', threading.Event()):
+            warmup._ready.set()
+            start, response = _call(
+                self.application, {'type': 'http', 'method': 'GET', 'path': '/ready'},
+                _request(b''))
+        self.assertEqual((start['status'], response['body']), (200, b'Ready'))
+
+        for path in ('/metrics', '/missing'):
+            start, _ = _call(
+                self.application, {'type': 'http', 'method': 'GET', 'path': path},
+                _request(b''))
+            self.assertEqual(start['status'], 404)
+
+    @override_settings(ALLOWED_HOSTS=['example.com'])
+    def test_request(self):
+        request = _http_request({
+            'type': 'http', 'method': 'GET', 'path': '/ready', 'query_string': b'a=1&b=2',
+            'server': ('example.com', 8000), 'client': ('10.0.0.1', 1234),
+            'headers': [
+                (b'content-type', b'application/json'), (b'x-forwarded-for', b'10.0.0.2'),
+                (b'accept', b'text/plain'), (b'accept', b'*/*'),
+            ],
+        }, b'{}')
+        self.assertEqual(request.path, '/ready')
+        self.assertEqual(request.GET.dict(), {'a': '1', 'b': '2'})
+        self.assertEqual(request.get_host(), 'example.com:8000')
+        self.assertEqual(request.META['REMOTE_ADDR'], '10.0.0.1')
+        self.assertEqual(request.META['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(request.META['CONTENT_LENGTH'], '2')
+        self.assertEqual(request.META['HTTP_X_FORWARDED_FOR'], '10.0.0.2')
+        self.assertEqual(request.META['HTTP_ACCEPT'], 'text/plain,*/*')
+        self.assertEqual(request.body, b'{}')
+
+    def test_lifespan(self):
+        sent = _call(self.application, {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'},
+            {'type': 'lifespan.shutdown'},
+        ])
+        self.assertEqual(
+            [m['type'] for m in sent],
+            ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+    def test_lifespan_warm_up_fails(self):
+        with mock.patch.object(warmup, '_ready', threading.Event()), \
+                mock.patch.object(warmup, 'warm_up', side_effect=ValueError):
+            with self.assertLogs('apps.word_finding.warmup', 'ERROR'):
+                sent = _call(self.application, {'type': 'lifespan'}, [
+                    {'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'},
+                ])
+            self.assertFalse(warmup.is_ready())
+        self.assertEqual(
+            [m['type'] for m in sent],
+            ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
@@ -0,0 +1,112 @@
+from unittest import mock
+
+import pytest
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from apps.word_finding import catalogue, responses
+from apps.word_finding.models.exercise import Question
+from .factories import ExerciseFactory, QuestionFactory
+
+
+@pytest.mark.django_db
+class TestCatalogue(TestCase):
+    def setUp(self):
+        catalogue.invalidate()
+
+    def test_questions_in_order(self):
+        exercise = ExerciseFactory()
+        first = QuestionFactory(exercise=exercise)
+        second = QuestionFactory(exercise=exercise)
+        QuestionFactory()
+        questions = catalogue.get_exercise(exercise.pk).questions
+        self.assertEqual([q.question for q in questions], [first, second])
+
+    def test_question_after(self):
+        exercise = ExerciseFactory()
+        first = QuestionFactory(exercise=exercise)
+        second = QuestionFactory(exercise=exercise)
+        catalogued = catalogue.get_exercise(exercise.pk)
+        self.assertEqual(catalogued.question_after(first.pk).question, second)
+        self.assertIsNone(catalogued.question_after(second.pk))
+        self.assertEqual(catalogued.question_after(0).question, first)
+
+    def test_only_enabled_exercises(self):
+        enabled = ExerciseFactory()
+        ExerciseFactory(enabled=False)
+        self.assertEqual(
+            [e.exercise for e in catalogue.get_catalogue().enabled_exercises], [enabled])
+
+    def test_answers_split(self):
+        question = catalogue.get_question(QuestionFactory(answer='good, correct').pk)
+        self.assertEqual(question.answers, ('good', 'correct'))
+        self.assertTrue(question.matcher.matches('correct'))
+
+    def test_model_answer(self):
+        question = catalogue.get_question(QuestionFactory(
+            response='A BLANK can be used to drive around', answer='car, bus').pk)
+        self.assertEqual(question.model_answer(), 'A car can be used to drive around')
+        self.assertEqual(question.model_answer('bus'), 'A bus can be used to drive around')
+
+    def test_illegal_characters(self):
+        question = QuestionFactory(question='Drive a\x0b BLANK', answer='car')
+        self.assertEqual(
+            catalogue.get_question(question.pk).speech.prompt.ssml,
+            'Drive a <emphasis level="strong">blank</emphasis>')
+
+    def test_question_without_ssml(self):
+        "A question whose SSML can't be made is said without it, rather than stopping every turn."
+        good = QuestionFactory(question='Drive a BLANK', answer='car')
+        bad = QuestionFactory(question='Ride a BLANK', response='Ride a BLANK', answer='bike')
+        validate_ssml = responses.validate_ssml
+
+        def validate(ssml):
+            if 'Ride' in ssml:
+                raise responses.SSMLError('bad')
+            return validate_ssml(ssml)
+
+        with mock.patch.object(responses, 'validate_ssml', side_effect=validate), \
+                self.assertLogs('apps.word_finding.catalogue', 'WARNING'):
+            catalogue.get_catalogue()
+        self.assertEqual(catalogue.get_question(bad.pk).speech.prompt.ssml, 'Ride a BLANK')
+        self.assertEqual(
+            catalogue.get_question(bad.pk).speech.model_answer, ('Ride a bike', 'Ride a bike'))
+        self.assertIn('<emphasis', catalogue.get_question(good.pk).speech.prompt.ssml)
+
+    def test_doesnt_query_once_built(self):
+        question = QuestionFactory()
+        catalogue.get_catalogue()
+        with self.assertNumQueries(0):
+            catalogue.get_question(question.pk)
+            catalogue.get_exercise(question.exercise_id)
+
+    def test_invalidated_on_save(self):
+        question = QuestionFactory(answer='old')
+        catalogue.get_catalogue()
+        question.answer = 'new'
+        question.save()
+        self.assertEqual(catalogue.get_question(question.pk).answers, ('new', ))
+
+    def test_invalidated_on_delete(self):
+        exercise = ExerciseFactory()
+        question = QuestionFactory(exercise=exercise)
+        catalogue.get_catalogue()
+        question.delete()
+        self.assertEqual(catalogue.get_exercise(exercise.pk).questions, ())
+
+    def test_rebuilds_for_unknown_question(self):
+        catalogue.get_catalogue()
+        question = Question.objects.bulk_create([
+            Question(exercise=ExerciseFactory(), question='q', answer='a')])[0]
+        question = Question.objects.get(question='q')
+        self.assertEqual(catalogue.get_question(question.pk).question, question)
+
+    def test_rebuilds_when_version_changes(self):
+        exercise = ExerciseFactory(name='old')
+        with self.settings(WORD_FINDING_CATALOGUE_CHECK_INTERVAL=0):
+            catalogue.get_catalogue()
+            # As if another process had changed it
+            type(exercise).objects.filter(pk=exercise.pk).update(name='new')
+            cache.set(catalogue.VERSION_CACHE_KEY, 'another version')
+            self.assertEqual(catalogue.get_exercise(exercise.pk).exercise.name, 'new')
@@ -0,0 +1,417 @@
+import asyncio
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+import unittest
+from io import StringIO
+from unittest import mock
+
+import pytest
+
+from django.core.management import CommandError, call_command
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+
+from apps.word_finding import catalogue, simulation
+from apps.word_finding.management.commands.load_test_webhook import _post
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import User, ExerciseProgress, AnswerGiven
+from .factories import (
+    AnswerGivenFactory, ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _call_command(*args, **kwargs):
+    out = StringIO()
+    call_command(*args, stdout=out, **kwargs)
+    return out.getvalue()
+
+
+@pytest.mark.django_db
+class TestBackfillAnswerCorrectness(TestCase):
+    def setUp(self):
+        self.question = QuestionFactory(answer='boot, shoe')
+
+    def test_marks_answers(self):
+        right = AnswerGivenFactory(question=self.question, answer='boots')
+        wrong = AnswerGivenFactory(question=self.question, answer='sock')
+        _call_command('backfill_answer_correctness')
+        right.refresh_from_db()
+        wrong.refresh_from_db()
+        self.assertTrue(right.is_correct)
+        self.assertEqual(right.matched_answer, 'boot')
+        self.assertFalse(wrong.is_correct)
+        self.assertEqual(wrong.matched_answer, '')
+
+    def test_in_batches(self):
+        for _ in range(5):
+            AnswerGivenFactory(question=self.question, answer='shoe')
+        out = _call_command('backfill_answer_correctness', batch_size=2)
+        self.assertIn('2/5 answers marked', out)
+        self.assertIn('4/5 answers marked', out)
+        self.assertIn('5/5 answers marked', out)
+        self.assertFalse(AnswerGiven.objects.filter(is_correct__isnull=True).exists())
+
+    def test_only_unmarked_answers(self):
+        marked = AnswerGivenFactory(
+            question=self.question, answer='shoe', is_correct=False, matched_answer='')
+        AnswerGivenFactory(question=self.question, answer='shoe')
+        out = _call_command('backfill_answer_correctness')
+        self.assertIn('1 answers to mark', out)
+        marked.refresh_from_db()
+        self.assertFalse(marked.is_correct)
+
+    def test_recompute(self):
+        marked = AnswerGivenFactory(
+            question=self.question, answer='shoe', is_correct=False, matched_answer='')
+        _call_command('backfill_answer_correctness', recompute=True)
+        marked.refresh_from_db()
+        self.assertTrue(marked.is_correct)
+
+    def test_start_after(self):
+        first = AnswerGivenFactory(question=self.question, answer='shoe')
+        second = AnswerGivenFactory(question=self.question, answer='shoe')
+        _call_command('backfill_answer_correctness', start_after=first.pk)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(first.is_correct)
+        self.assertTrue(second.is_correct)
+
+
+@pytest.mark.django_db
+class TestRebuildProgress(TestCase):
+    def test_rebuild(self):
+        users = [UserFactory() for _ in range(3)]
+        for user in users:
+            ExerciseStateFactory(user=user, current_question=None, completed=True)
+        ExerciseProgress.objects.create(user=users[0], exercise=Exercise.objects.first())
+
+        out = _call_command('rebuild_progress', batch_size=2)
+        self.assertIn('2/3 users rebuilt', out)
+        self.assertIn('Rebuilt the progress of 3 users, in 3 exercises between them', out)
+        self.assertEqual(
+            list(ExerciseProgress.objects.order_by('user').values_list('user', 'completed')),
+            [(user.pk, 1) for user in users])
+
+    def test_some_users(self):
+        users = [UserFactory() for _ in range(2)]
+        for user in users:
+            ExerciseStateFactory(user=user, current_question=None, completed=True)
+        out = _call_command('rebuild_progress', users[1].user_id)
+        self.assertIn('1 users to rebuild', out)
+        self.assertEqual(ExerciseProgress.objects.get().user, users[1])
+
+
+@pytest.mark.django_db
+@unittest.skipIf(numpy is None, "The analytics need numpy")
+class TestAnswerAnalytics(TestCase):
+    def setUp(self):
+        self.addCleanup(catalogue.invalidate)
+        self.question = QuestionFactory(question='What do you wear on your BLANK?', answer='foot')
+        self.user = UserFactory(user_id='improving')
+        for answers in (['hand', 'foot'], ['foot']):
+            state = ExerciseStateFactory(
+                user=self.user, exercise=self.question.exercise, current_question=None,
+                completed=True)
+            for answer in answers:
+                AnswerGivenFactory(
+                    exercise_state=state, question=self.question, answer=answer,
+                    is_correct=answer == 'foot')
+
+    def test_report(self):
+        out = _call_command('answer_analytics', min_answers=1, min_exercises=2)
+        self.assertIn('3 answers', out)
+        self.assertRegex(out, r'3 +66.7% +50.0% +1.50  What do you wear on your BLANK\?')
+        self.assertRegex(out, r'2 +3 +66.7% +\+0.500  improving')
+        self.assertRegex(out, r'\n +2 +1 +100.0%\n')
+
+    def test_missing_exercise(self):
+        with self.assertRaisesRegex(CommandError, 'There is no exercise called Missing'):
+            _call_command('answer_analytics', exercise='Missing')
+
+
+@pytest.mark.django_db
+class TestExplainTurnQueries(TestCase):
+    def test_explains_and_rolls_back(self):
+        out = _call_command(
+            'explain_turn_queries', answers=100, exercises=2, questions=5, repeat=1)
+        self.assertIn('Added 5 users, 20 states and 100 answers', out)
+        self.assertIn('incorrect answer: SELECT word_finding_exercisestate', out)
+        self.assertIn('incorrect answer: INSERT word_finding_answergiven', out)
+        self.assertIn('correct answer: UPDATE word_finding_exercisestate', out)
+        self.assertIn('Rolled back', out)
+        self.assertFalse(AnswerGiven.objects.exists())
+
+
+@pytest.mark.django_db
+class TestCompareWebhookConcurrency(TransactionTestCase):
+    def test_compares_and_cleans_up(self):
+        self.addCleanup(catalogue.invalidate)
+        exercise = ExerciseFactory()
+        user = UserFactory()
+        answered = []
+        mark = AnswerGiven.mark
+
+        def record(answer, *args):
+            answered.append(answer.exercise_state.exercise_id)
+            return mark(answer, *args)
+
+        with mock.patch.object(AnswerGiven, 'mark', autospec=True, side_effect=record):
+            out = _call_command(
+                'compare_webhook_concurrency', conversations=3, turns=2, workers=1,
+                client_delay=0)
+        self.assertIn('sync: 6 turns', out)
+        self.assertIn('async: 6 turns', out)
+        self.assertIn(' 0 errors', out)
+        # Every turn answered a question in its own exercise
+        self.assertEqual(len(answered), 12)
+        self.assertEqual(len(set(answered)), 1)
+        self.assertNotIn(exercise.pk, answered)
+        self.assertEqual(list(User.objects.all()), [user])
+        self.assertEqual(list(Exercise.objects.all()), [exercise])
+
+
+@pytest.mark.django_db
+class TestImportAndExportQuestions(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'questions.jsonl')
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+
+    def test_export_and_import(self):
+        QuestionFactory(exercise__name='Food', question='What is a BLANK?', answer='pea')
+        QuestionFactory(exercise__name='Drink', question='Some BLANK', answer='tea')
+        _call_command('export_questions', self.path, exercises=['Food'])
+        Exercise.objects.all().delete()
+
+        out = _call_command('import_questions', self.path)
+        self.assertIn('1 questions added, 0 updated and 0 unchanged', out)
+        self.assertEqual(Question.objects.get().exercise.name, 'Food')
+
+    def test_export_to_stdout(self):
+        QuestionFactory(
+            exercise__name='Food', question='What is a BLANK?', response='', answer='pea')
+        out = _call_command('export_questions')
+        self.assertEqual(
+            out, 'exercise,question,response,answer\r\nFood,What is a BLANK?,,pea\r\n')
+
+    def test_import_errors(self):
+        with open(self.path, 'w') as f:
+            f.write('{"exercise": "Food", "question": "What is a BLANK?", "answer": "pea!"}\n')
+        with self.assertRaisesRegex(CommandError, 'Line 1: Answers must not include'):
+            _call_command('import_questions', self.path)
+
+
+@pytest.mark.django_db
+class TestSimulateSessions(TestCase):
+    def setUp(self):
+        QuestionFactory(question='A BLANK', answer='right')
+        self.addCleanup(catalogue.invalidate)
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'scripts.json')
+        self.output = os.path.join(directory, 'said.json')
+        self.addCleanup(os.rmdir, directory)
+        for path in (self.path, self.output):
+            self.addCleanup(lambda path=path: os.path.exists(path) and os.remove(path))
+        with open(self.path, 'w') as f:
+            json.dump({'first': ['', 'right'], 'second': ['', 'wrong']}, f)
+
+    def test_simulate(self):
+        out = _call_command('simulate_sessions', self.path, output=self.output)
+        self.assertIn('4 turns for 2 users', out)
+        with open(self.output) as f:
+            said = json.load(f)
+        self.assertEqual(list(said), ['first', 'second'])
+        self.assertEqual([t['kind'] for t in said['second']], ['welcome', 'incorrect'])
+        self.assertEqual(
+            said['second'][1]['text'], "I'm sorry, wrong is incorrect. Please try again. A BLANK")
+        self.assertEqual(AnswerGiven.objects.count(), 2)
+
+    def test_dry_run(self):
+        out = _call_command('simulate_sessions', self.path, dry_run=True)
+        self.assertIn('dry run, nothing was saved', out)
+        self.assertFalse(User.objects.exists())
+
+    def test_not_scripts(self):
+        with open(self.path, 'w') as f:
+            json.dump(['', 'right'], f)
+        with self.assertRaisesRegex(CommandError, 'should map user_ids'):
+            _call_command('simulate_sessions', self.path)
+
+
+@pytest.mark.django_db
+class TestSimulateSessionsCommitted(TransactionTestCase):
+    def setUp(self):
+        QuestionFactory(answer='right')
+        self.addCleanup(catalogue.invalidate)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        with open(self.path, 'w') as f:
+            json.dump({'first': [''], 'second': ['']}, f)
+
+    def test_earlier_batches_kept(self):
+        take_turns = simulation._take_turns
+
+        def fail_second(user, *args):
+            if user.user_id == 'second':
+                raise ValueError
+            return take_turns(user, *args)
+
+        with mock.patch.object(simulation, '_take_turns', side_effect=fail_second):
+            with self.assertRaises(ValueError):
+                _call_command('simulate_sessions', self.path, batch_size=1)
+        self.assertEqual(list(User.objects.values_list('user_id', flat=True)), ['first'])
+
+
+class TestMeasureStartup(TestCase):
+    def _measured(self, command, **kwargs):
+        timings = dict(setup=0.2, warm_up=0, first_turn=0.03, second_turn=0.005)
+        if '--warm-up' in command:
+            timings.update(warm_up=0.02, first_turn=0.01)
+        return json.dumps(dict(
+            started=0, first_response=time.time() + 0.3, timings=dict(timings, **{'import': 0.01}),
+            modules=400, unneeded_modules=['numpy'] if '--warm-up' in command else [],
+        )).encode('utf-8')
+
+    def test_measure(self):
+        with mock.patch.object(subprocess, 'check_output', side_effect=self._measured) as run:
+            out = _call_command('measure_startup', runs=2)
+        self.assertEqual(run.call_count, 4)
+        self.assertEqual(
+            run.call_args[0][0][1:], ['-m', 'apps.word_finding.coldstart', '--warm-up'])
+        self.assertRegex(out, r'cold +200\.0 +10\.0 +0\.0 +30\.0 +5\.0 +3\d\d\.\d +400')
+        self.assertIn("warmed imported modules the webhook doesn't need: numpy", out)
+        self.assertNotIn('cold imported', out)
+
+    def test_compare(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        with mock.patch.object(subprocess, 'check_output', side_effect=self._measured):
+            _call_command('measure_startup', runs=1, save=path)
+            out = _call_command('measure_startup', runs=1, compare=path, threshold=50)
+            self.assertIn('No slower to start', out)
+
+            with open(path) as f:
+                results = json.load(f)
+            results['cold']['first_turn'] = 0.01
+            with open(path, 'w') as f:
+                json.dump(results, f)
+            with self.assertRaisesRegex(CommandError, 'cold first turn rose from 10.0ms'):
+                _call_command('measure_startup', runs=1, compare=path)
+
+
+@pytest.mark.django_db
+class TestBenchmarkTurns(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'results.json')
+        self.addCleanup(os.rmdir, directory)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+        self.addCleanup(catalogue.invalidate)
+
+    def _benchmark(self, **kwargs):
+        return _call_command(
+            'benchmark_turns', exercises=2, questions=3, users=3, history=1, turns=8, **kwargs)
+
+    def test_reports_and_cleans_up(self):
+        out = self._benchmark(save=self.path)
+        self.assertIn('24 turns on', out)
+        self.assertIn('returning', out)
+        self.assertIn('finished', out)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Exercise.objects.exists())
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_compare(self):
+        self._benchmark(save=self.path)
+        out = self._benchmark(compare=self.path, threshold=1000)
+        self.assertIn('No worse', out)
+
+        with open(self.path) as f:
+            results = json.load(f)
+        results['kinds']['returning']['queries'] -= 1
+        with open(self.path, 'w') as f:
+            json.dump(results, f)
+        with self.assertRaisesRegex(CommandError, 'returning queries per turn rose'):
+            self._benchmark(compare=self.path, threshold=1000)
+
+
+@pytest.mark.django_db
+@override_settings(ROOT_URLCONF='apps.word_finding.urls')
+class TestLoadTestWebhook(LiveServerTestCase):
+    def test_conversations(self):
+        self.addCleanup(catalogue.invalidate)
+        exercise = ExerciseFactory()
+        for i in range(3):
+            QuestionFactory(exercise=exercise, question='question {}'.format(i), answer='right')
+        out = _call_command(
+            'load_test_webhook', self.live_server_url + '/', conversations=4, turns=6,
+            concurrency=1, correct_rate=0.5, seed=1)
+        self.assertIn('24 requests', out)
+        self.assertIn('0 errors', out)
+        self.assertIn('No users have more than one exercise in progress', out)
+        sent, saved = re.search(r'(\d+) answers sent, (\d+) saved', out).groups()
+        self.assertEqual(sent, saved)
+        self.assertEqual(User.objects.count(), 4)
+
+    @override_settings(WORD_FINDING_SSML=True)
+    def test_ssml(self):
+        self.addCleanup(catalogue.invalidate)
+        exercise = ExerciseFactory()
+        QuestionFactory(exercise=exercise, question='A BLANK & a pea', answer='right')
+        QuestionFactory(exercise=exercise, question='Another BLANK', answer='bean')
+        out = _call_command(
+            'load_test_webhook', self.live_server_url + '/', conversations=2, turns=3,
+            concurrency=1, correct_rate=1)
+        self.assertIn('0 errors', out)
+        self.assertEqual(AnswerGiven.objects.count(), 4)
+        self.assertTrue(all(AnswerGiven.objects.values_list('is_correct', flat=True)))
+
+    def test_errors(self):
+        out = _call_command(
+            'load_test_webhook', self.live_server_url + '/missing', conversations=2, turns=2)
+        self.assertIn('4 errors (100.00%): 4 HTTP 404', out)
+
+
+class TestPost(unittest.TestCase):
+    def _post_to(self, response):
+        "Posts to a server which sends the response, returns what _post returns."
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def respond(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(response)
+            await writer.drain()
+            writer.close()
+
+        async def post():
+            server = await asyncio.start_server(respond, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                return await _post('http://127.0.0.1:{}/'.format(port), b'{}')
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        return loop.run_until_complete(post())
+
+    def test_content_length(self):
+        self.assertEqual(
+            self._post_to(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'), (200, b'{}'))
+
+    def test_chunked(self):
+        self.assertEqual(self._post_to(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5\r\n{"a":\r\na;ext=1\r\n "chunked"\r\n1\r\n}\r\n0\r\n\r\n'
+        ), (200, b'{"a": "chunked"}'))
@@ -0,0 +1,117 @@
+import io
+
+import pytest
+
+from django.test import TestCase
+
+from apps.word_finding import catalogue
+from apps.word_finding.content import (
+    ImportErrors, export_rows, import_questions, read_rows, render_rows,
+)
+from apps.word_finding.models.exercise import Exercise, Question
+from .factories import ExerciseFactory, QuestionFactory
+
+
+CSV = (
+    'exercise,question,response,answer\n'
+    'Food,What is a BLANK?,,Pea\n'
+    'Food,"Say ""BLANK""",A BLANK,"bean, beans"\n'
+)
+
+
+def _import(text, format='csv', **kwargs):
+    return import_questions(read_rows(io.StringIO(text), format), **kwargs)
+
+
+@pytest.mark.django_db
+class TestImportQuestions(TestCase):
+    def test_csv(self):
+        result = _import(CSV)
+        self.assertEqual(result, (2, 0, 0))
+        exercise = Exercise.objects.get(name='Food')
+        self.assertEqual(
+            list(exercise.question_set.order_by('pk').values_list('question', 'answer')),
+            [('What is a BLANK?', 'pea'), ('Say "BLANK"', 'bean, beans')])
+
+    def test_jsonl(self):
+        result = _import(
+            '{"exercise": "Food", "question": "What is a BLANK?", "answer": "pea"}\n\n',
+            format='jsonl')
+        self.assertEqual(result, (1, 0, 0))
+        self.assertEqual(Question.objects.get().response, '')
+
+    def test_updates_existing_questions(self):
+        question = QuestionFactory(
+            exercise=ExerciseFactory(name='Food'), question='What is a BLANK?', answer='bean')
+        result = _import(CSV)
+        self.assertEqual(result, (1, 1, 0))
+        question.refresh_from_db()
+        self.assertEqual(question.answer, 'pea')
+        self.assertEqual(_import(CSV), (0, 0, 2))
+
+    def test_reports_every_error(self):
+        text = (
+            'exercise,question,response,answer\n'
+            'Food,What is a BLANK?,,pea\n'
+            'Food,,,pea\n'
+            'Food,What is a BLANK?,,peas\n'
+            'Food,A BLANK?,,green pea\n'
+        )
+        with self.assertRaises(ImportErrors) as cm:
+            _import(text, batch_size=2)
+        self.assertEqual(cm.exception.errors, [
+            (3, 'The question is missing'),
+            (4, 'The same question as line 2'),
+            (5, 'Answers must not contain spaces.'),
+        ])
+        self.assertFalse(Question.objects.exists())
+        self.assertFalse(Exercise.objects.exists())
+
+    def test_bad_json(self):
+        with self.assertRaises(ImportErrors) as cm:
+            _import('not json\n[]\n', format='jsonl')
+        self.assertEqual(
+            cm.exception.errors, [(1, 'Not valid JSON'), (2, 'Not a JSON object')])
+
+    def test_dry_run(self):
+        self.assertEqual(_import(CSV, dry_run=True), (2, 0, 0))
+        self.assertFalse(Question.objects.exists())
+
+    def test_in_batches(self):
+        with self.assertNumQueries(11):
+            _import(
+                'exercise,question,response,answer\n' +
+                ''.join('Food,question {},,pea\n'.format(i) for i in range(10)),
+                batch_size=4)
+        self.assertEqual(Question.objects.count(), 10)
+
+    def test_updated_in_batches(self):
+        exercise = ExerciseFactory(name='Food')
+        for i in range(10):
+            QuestionFactory(exercise=exercise, question='question {}'.format(i), answer='bean')
+        text = 'exercise,question,response,answer\n' + ''.join(
+            'Food,question {},A BLANK {},pea\n'.format(i, i) for i in range(10))
+        # The savepoint and exercise, then the questions there are and one UPDATE for each batch
+        with self.assertNumQueries(7):
+            self.assertEqual(_import(text, batch_size=5), (0, 10, 0))
+        self.assertEqual(
+            list(Question.objects.order_by('pk').values_list('response', 'answer')),
+            [('A BLANK {}'.format(i), 'pea') for i in range(10)])
+
+    def test_catalogue_changed(self):
+        catalogue.get_catalogue()
+        _import(CSV)
+        self.assertEqual(len(catalogue.get_catalogue().questions), 2)
+
+
+@pytest.mark.django_db
+class TestExportQuestions(TestCase):
+    def test_round_trip(self):
+        for format in ('csv', 'jsonl'):
+            _import(CSV)
+            text = ''.join(render_rows(export_rows(), format))
+            Exercise.objects.all().delete()
+            self.assertEqual(_import(text, format), (2, 0, 0))
+            self.assertEqual(
+                [row['question'] for row in export_rows()], ['What is a BLANK?', 'Say "BLANK"'])
+            Exercise.objects.all().delete()
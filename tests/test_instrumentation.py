@@ -0,0 +1,116 @@
+import logging
+
+import pytest
+
+from django.http import Http404
+from django.test import TestCase, override_settings
+
+from libs.google_actions.tests.mocks import MockRequest
+
+from apps.word_finding import catalogue
+from apps.word_finding.instrumentation import HistogramSink, LoggingSink, TurnMetrics, get_sinks
+from apps.word_finding.models.user import User, ExerciseProgress
+from apps.word_finding.views import index, metrics, TOKEN_DO_ANOTHER_EXERCISE
+from .factories import ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory
+
+
+def _metrics(kind='correct', total=0.02, queries=4):
+    return TurnMetrics(
+        kind=kind, user_id='user', exercise_id=1, total=total, parse=0.001, turn=0.015,
+        respond=0.002, queries=queries, query_time=0.01)
+
+
+class TestHistogramSink(TestCase):
+    def test_buckets(self):
+        sink = HistogramSink(buckets=(0.01, 0.1))
+        for total in (0.005, 0.05, 0.06, 1):
+            sink.send(_metrics(total=total))
+        snapshot = sink.snapshot()['correct']
+        self.assertEqual(snapshot['count'], 4)
+        self.assertEqual(snapshot['buckets'], [1, 2, 1])
+        self.assertEqual(snapshot['queries'], 16)
+
+    def test_prometheus_text(self):
+        sink = HistogramSink(buckets=(0.01, 0.1))
+        sink.send(_metrics(total=0.05))
+        sink.send(_metrics(kind='welcome', total=0.5, queries=10))
+        text = sink.prometheus_text()
+        self.assertIn('word_finding_turn_seconds_bucket{kind="correct",le="0.01"} 0', text)
+        self.assertIn('word_finding_turn_seconds_bucket{kind="correct",le="0.1"} 1', text)
+        self.assertIn('word_finding_turn_seconds_bucket{kind="correct",le="+Inf"} 1', text)
+        self.assertIn('word_finding_turn_seconds_count{kind="welcome"} 1', text)
+        self.assertIn('word_finding_turn_queries_total{kind="welcome"} 10', text)
+
+    def test_reset(self):
+        sink = HistogramSink()
+        sink.send(_metrics())
+        sink.reset()
+        self.assertEqual(sink.snapshot(), {})
+
+
+class TestLoggingSink(TestCase):
+    def test_logs_turn(self):
+        with self.assertLogs('apps.word_finding.metrics', logging.INFO) as logs:
+            LoggingSink().send(_metrics())
+        self.assertIn('correct turn for user user, exercise 1: 20.0ms', logs.output[0])
+        self.assertIn('4 queries in 10.0ms', logs.output[0])
+
+    def test_only_slow_turns(self):
+        sink = LoggingSink(slow_turn=0.1, level=logging.WARNING)
+        with self.assertLogs('apps.word_finding.metrics', logging.WARNING) as logs:
+            sink.send(_metrics(total=0.05))
+            sink.send(_metrics(total=0.5))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('500.0ms', logs.output[0])
+
+
+@pytest.mark.django_db
+@override_settings(WORD_FINDING_METRICS_SINKS=[
+    {'BACKEND': 'apps.word_finding.instrumentation.HistogramSink'},
+])
+class TestMeasuredTurns(TestCase):
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=self.exercise, answer='right')
+        ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=self.exercise,
+            current_question=self.question,
+            last_question=self.question,
+            completed=False,
+        )
+        ExerciseProgress.rebuild(User.objects.all())
+        catalogue.get_catalogue()
+        self.sink = get_sinks()[0]
+        self.sink.reset()
+
+    def test_kinds(self):
+        index(MockRequest(text='wrong', user_id='user'))
+        index(MockRequest(text='right', user_id='user'))
+        index(MockRequest(text='no', user_id='user', conversation_token=TOKEN_DO_ANOTHER_EXERCISE))
+        index(MockRequest(text='', user_id='new user'))
+        self.assertEqual(
+            sorted(self.sink.snapshot()), ['finished', 'goodbye', 'incorrect', 'welcome'])
+
+    def test_counts_queries(self):
+        with self.assertNumQueries(7):
+            index(MockRequest(text='wrong', user_id='user'))
+        incorrect = self.sink.snapshot()['incorrect']
+        self.assertEqual(incorrect['queries'], 7)
+        self.assertGreater(incorrect['total'], incorrect['turn'])
+        self.assertGreaterEqual(incorrect['turn'], incorrect['query_time'])
+
+    def test_not_json_not_measured(self):
+        index(MockRequest(body='NOT JSON'))
+        self.assertEqual(self.sink.snapshot(), {})
+
+    def test_metrics_view(self):
+        index(MockRequest(text='wrong', user_id='user'))
+        response = metrics(None)
+        self.assertIn(b'word_finding_turn_seconds_count{kind="incorrect"} 1', response.content)
+
+
+class TestNoSinks(TestCase):
+    def test_metrics_view(self):
+        with self.assertRaises(Http404):
+            metrics(None)
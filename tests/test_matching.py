@@ -0,0 +1,111 @@
+from unittest import TestCase
+
+from apps.word_finding.matching import (
+    AnswerMatcher, normalize, match_many, phonetic_key, edit_distance,
+)
+
+
+class TestNormalize(TestCase):
+    def test_lower_case(self):
+        self.assertEqual(normalize('Green'), ['green'])
+
+    def test_removes_punctuation(self):
+        self.assertEqual(normalize("green! it's green."), ['green', 'it', 's', 'green'])
+
+    def test_removes_articles(self):
+        self.assertEqual(normalize('the boot'), ['boot'])
+        self.assertEqual(normalize('an apple'), ['apple'])
+
+
+class TestAnswerMatcher(TestCase):
+    def test_match(self):
+        matcher = AnswerMatcher(['good', 'correct'])
+        self.assertEqual(matcher.match('correct'), 'correct')
+        self.assertEqual(matcher.match('it is good'), 'good')
+        self.assertIsNone(matcher.match('wrong'))
+        self.assertIsNone(matcher.match(''))
+
+    def test_matches(self):
+        matcher = AnswerMatcher(['cat'])
+        self.assertTrue(matcher.matches('A cat.'))
+        self.assertFalse(matcher.matches('a dog'))
+
+    def test_plurals(self):
+        self.assertTrue(AnswerMatcher(['boot']).matches('boots'))
+        self.assertTrue(AnswerMatcher(['boots']).matches('boot'))
+        self.assertTrue(AnswerMatcher(['bus']).matches('buses'))
+        self.assertTrue(AnswerMatcher(['house']).matches('houses'))
+        self.assertTrue(AnswerMatcher(['church']).matches('churches'))
+        self.assertTrue(AnswerMatcher(['baby']).matches('babies'))
+        self.assertTrue(AnswerMatcher(['glass']).matches('glasses'))
+
+    def test_doesnt_match_part_of_word(self):
+        self.assertFalse(AnswerMatcher(['glass']).matches('glas'))
+        self.assertFalse(AnswerMatcher(['cat']).matches('catch'))
+
+    def test_match_many(self):
+        matchers = {1: AnswerMatcher(['one']), 2: AnswerMatcher(['two', 'deux'])}
+        self.assertEqual(
+            match_many([(1, 'one'), (2, 'one'), (2, 'deux'), (1, 'ones')], matchers),
+            ['one', None, 'deux', 'one'])
+
+
+class TestPhoneticKey(TestCase):
+    def test_homophones(self):
+        for first, second in (
+                ('flour', 'flower'), ('pair', 'pear'), ('knight', 'night'), ('write', 'right'),
+                ('which', 'witch'), ('phone', 'fone'), ('elephant', 'elefant')):
+            self.assertEqual(phonetic_key(first), phonetic_key(second))
+
+    def test_different_sounds(self):
+        self.assertNotEqual(phonetic_key('house'), phonetic_key('horse'))
+        self.assertNotEqual(phonetic_key('cat'), phonetic_key('dog'))
+
+    def test_key(self):
+        self.assertEqual(phonetic_key('thumb'), '0M')
+        self.assertEqual(phonetic_key('apple'), 'APL')
+        self.assertEqual(phonetic_key(''), '')
+
+
+class TestEditDistance(TestCase):
+    def test_distance(self):
+        self.assertEqual(edit_distance('kitten', 'sitting', 5), 3)
+        self.assertEqual(edit_distance('boot', 'boot', 1), 0)
+        self.assertEqual(edit_distance('boot', 'boat', 1), 1)
+        self.assertEqual(edit_distance('', 'ab', 2), 2)
+
+    def test_stops_after_max_distance(self):
+        self.assertEqual(edit_distance('kitten', 'sitting', 1), 2)
+        self.assertEqual(edit_distance('a', 'abcd', 1), 2)
+
+
+class TestCloseMatches(TestCase):
+    def test_off_by_default(self):
+        matcher = AnswerMatcher(['flower', 'elephant'])
+        self.assertIsNone(matcher.match('flour'))
+        self.assertIsNone(matcher.match('elephent'))
+
+    def test_edits(self):
+        matcher = AnswerMatcher(['elephant'], max_edits=1)
+        self.assertEqual(matcher.match('an elephent'), 'elephant')
+        self.assertEqual(matcher.match('elepant'), 'elephant')
+        self.assertEqual(matcher.match('elephants'), 'elephant')
+        self.assertIsNone(matcher.match('elepent'))
+        self.assertEqual(AnswerMatcher(['elephant'], max_edits=2).match('elepent'), 'elephant')
+
+    def test_edits_only_long_words(self):
+        matcher = AnswerMatcher(['house', 'cat'], max_edits=1, min_fuzzy_length=6)
+        self.assertIsNone(matcher.match('horse'))
+        self.assertIsNone(matcher.match('car'))
+
+    def test_phonetic(self):
+        matcher = AnswerMatcher(['flower', 'pear'], phonetic=True)
+        self.assertEqual(matcher.match('flour'), 'flower')
+        self.assertEqual(matcher.match('flours'), 'flower')
+        self.assertEqual(matcher.match('pair'), 'pear')
+        matcher = AnswerMatcher(['pear'], phonetic=True, min_phonetic_length=5)
+        self.assertIsNone(matcher.match('pair'))
+
+    def test_exact_match_preferred(self):
+        matcher = AnswerMatcher(['boat', 'coat'], max_edits=1, min_fuzzy_length=4)
+        self.assertEqual(matcher.match('boot coat'), 'coat')
@@ -1,11 +1,18 @@
 import pytest
 
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 
-from apps.word_finding.models.exercise import Question
-from apps.word_finding.models.user import ExerciseState
+from apps.word_finding import catalogue
+from apps.word_finding.models.exercise import Exercise, Question
+from apps.word_finding.models.user import (
+    User, ExerciseState, ExerciseProgress, AnswerGiven, streaks,
+)
+from apps.word_finding.scheduling import QuestionHistory
+from apps.word_finding.turn import take_turn
 from apps.word_finding.exceptions import (
     NoExerciseInProgress, NoExercisesAvailable, NoQuestionsRemaining, MaxQuestionRetriesReached,
+    StaleExerciseState,
 )
 from .factories import (
     UserFactory, AnswerGivenFactory, QuestionFactory, ExerciseFactory, ExerciseStateFactory,
@@ -69,13 +76,33 @@ class TestAnswerGivenModel(TestCase):
             answer='a dog'
         ).correct())
 
-    @pytest.mark.skip("Not sure the best way to implement this")
+    def test_correct_uses_stored_value(self):
+        answer = AnswerGivenFactory(
+            question=QuestionFactory(answer='boot'), answer='boot', is_correct=False)
+        self.assertFalse(answer.correct())
+
+    def test_mark(self):
+        answer = AnswerGivenFactory(question=QuestionFactory(answer='boot, shoe'), answer='shoes')
+        answer.mark()
+        self.assertTrue(answer.is_correct)
+        self.assertEqual(answer.matched_answer, 'shoe')
+
     def test_correct_extra_letters(self):
         self.assertTrue(AnswerGivenFactory(
             question=QuestionFactory(answer='boot'),
             answer='boots'
         ).correct())
 
+    def test_mark_close_answers(self):
+        self.addCleanup(catalogue.invalidate)
+        answer = AnswerGivenFactory(question=QuestionFactory(answer='flower'), answer='flour')
+        answer.mark()
+        self.assertFalse(answer.is_correct)
+        with self.settings(WORD_FINDING_ANSWER_MATCHING={'phonetic': True}):
+            answer.mark()
+        self.assertTrue(answer.is_correct)
+        self.assertEqual(answer.matched_answer, 'flower')
+
 
 @pytest.mark.django_db
 class TestUserModel(TestCase):
@@ -88,11 +115,75 @@ class TestUserModel(TestCase):
         self.assertIsNone(exercise_state.current_question)
         self.assertFalse(exercise_state.completed)
 
+    def test_start_new_exercise_started_by_another_turn(self):
+        exercise = ExerciseFactory()
+        user = UserFactory()
+        self.assertFalse(user.exercise_in_progress)
+        ExerciseStateFactory(user=user, exercise=exercise, completed=False)
+        with self.assertRaises(StaleExerciseState), transaction.atomic():
+            user.start_new_exercise()
+
     def test_start_new_exercise_doesnt_get_disabled_exercise(self):
         ExerciseFactory(enabled=False)
         with self.assertRaises(NoExercisesAvailable):
             UserFactory().start_new_exercise()
 
+    def test_start_new_exercise_never_started(self):
+        user = UserFactory()
+        done = ExerciseFactory()
+        not_done = ExerciseFactory()
+        ExerciseStateFactory(user=user, exercise=done, current_question=None, completed=True)
+        ExerciseProgress.rebuild(User.objects.all())
+        self.assertEqual(user.start_new_exercise(), not_done)
+
+    def test_start_new_exercise_compares_exercises_not_states(self):
+        "The state for the exercise done has the same pk as the exercise not done."
+        user = UserFactory()
+        not_done = ExerciseFactory()
+        done = ExerciseFactory()
+        state = ExerciseStateFactory(
+            user=user, exercise=done, current_question=None, completed=True)
+        ExerciseState.objects.filter(pk=state.pk).update(id=not_done.pk)
+        ExerciseProgress.rebuild(User.objects.all())
+        self.assertEqual(user.start_new_exercise(), not_done)
+
+    def test_start_new_exercise_least_recent(self):
+        user = UserFactory()
+        first = ExerciseFactory()
+        second = ExerciseFactory()
+        ExerciseStateFactory(user=user, exercise=second, current_question=None, completed=True)
+        ExerciseStateFactory(user=user, exercise=first, current_question=None, completed=True)
+        ExerciseStateFactory(user=user, exercise=second, current_question=None, completed=True)
+        ExerciseProgress.rebuild(User.objects.all())
+        self.assertEqual(user.start_new_exercise(), first)
+
+    def test_start_new_exercise_random(self):
+        user = UserFactory()
+        exercises = [ExerciseFactory() for _ in range(3)]
+        ExerciseFactory(enabled=False)
+        with self.settings(WORD_FINDING_EXERCISE_POLICY='random'):
+            self.assertIn(user.start_new_exercise(), exercises)
+
+    def test_start_new_exercise_long_history(self):
+        Exercise.objects.bulk_create(
+            Exercise(name='exercise {}'.format(i)) for i in range(2000))
+        exercises = list(Exercise.objects.order_by('pk'))
+        catalogue.invalidate()
+        catalogue.get_catalogue()
+        users = [UserFactory() for _ in range(3)]
+        # Each user has done every exercise but one, some of them many times
+        ExerciseState.objects.bulk_create(
+            ExerciseState(user=user, exercise=exercise, completed=True)
+            for repeat in range(3)
+            for i, user in enumerate(users)
+            for exercise in exercises[:i] + exercises[i + 1:]
+        )
+        ExerciseProgress.rebuild(User.objects.all())
+        # Including the savepoint the progress in the new exercise is added in
+        for i, user in enumerate(users):
+            with self.assertNumQueries(6):
+                self.assertEqual(user.start_new_exercise(), exercises[i])
+
     def test_get_next_question_raises_if_no_exercise_in_progress(self):
         with self.assertRaises(NoExerciseInProgress):
             UserFactory().get_next_question()
@@ -121,6 +212,136 @@ class TestUserModel(TestCase):
         result = user.get_next_question()
         self.assertEqual(result, remaining_question.question)
 
+    def test_get_next_question_after_last_question(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        last_question = QuestionFactory(exercise=exercise)
+        next_question = QuestionFactory(exercise=exercise)
+        ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, last_question=last_question)
+        user._get_current_exercise_state()
+        with self.assertNumQueries(1):  # Just saving the state
+            result = user.get_next_question()
+        self.assertEqual(result, next_question.question)
+        self.assertEqual(ExerciseState.objects.get().last_question, next_question)
+
+    def test_get_next_question_after_last_question_deleted(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        completed_question = QuestionFactory(exercise=exercise)
+        last_question = QuestionFactory(exercise=exercise)
+        remaining_question = QuestionFactory(exercise=exercise)
+        exercise_state = ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, last_question=last_question)
+        AnswerGivenFactory(exercise_state=exercise_state, question=completed_question)
+        last_question.delete()
+        result = user.get_next_question()
+        self.assertEqual(result, remaining_question.question)
+
+    def test_questions_asked_in_order_chosen(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        questions = [QuestionFactory(exercise=exercise) for _ in range(5)]
+        with self.settings(WORD_FINDING_QUESTION_POLICY='random'):
+            user.start_new_exercise()
+        state = ExerciseState.objects.get()
+        order = [int(pk) for pk in state.question_order.split(',')]
+        self.assertEqual(sorted(order), [q.pk for q in questions])
+
+        asked = []
+        for _ in questions:
+            # From the database each time
+            user = User.objects.get(pk=user.pk)
+            asked.append(Question.objects.get(question=user.get_next_question()).pk)
+            user.reset_current_question()
+        self.assertEqual(asked, order)
+        self.assertEqual(ExerciseState.objects.get().question_position, len(order))
+
+    def test_get_next_question_from_position(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        first, second, third = [QuestionFactory(exercise=exercise) for _ in range(3)]
+        state = ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, last_question=third,
+            question_order='{},{},{}'.format(third.pk, second.pk, first.pk), question_position=1)
+        second.delete()
+        added = QuestionFactory(exercise=exercise)
+        catalogue.get_catalogue()
+        user = User.objects.get(pk=user.pk)
+        user._get_current_exercise_state()
+        # Only saving the state
+        with self.assertNumQueries(1):
+            self.assertEqual(user.get_next_question(), first.question)
+        state.refresh_from_db()
+        self.assertEqual(state.question_position, 3)
+        user.reset_current_question()
+        self.assertEqual(user.get_next_question(), added.question)
+        user.reset_current_question()
+        with self.assertRaises(NoQuestionsRemaining):
+            user.get_next_question()
+
+    def test_get_next_question_in_order_after_questions_changed(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        first, second, third = [QuestionFactory(exercise=exercise) for _ in range(3)]
+        ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, last_question=third,
+            question_order='{},{},{}'.format(third.pk, second.pk, first.pk))
+        second.delete()
+        added = QuestionFactory(exercise=exercise)
+        self.assertEqual(user.get_next_question(), first.question)
+        user.reset_current_question()
+        self.assertEqual(user.get_next_question(), added.question)
+
+    def test_get_next_question_in_order_after_last_question_deleted(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        first, second, third = [QuestionFactory(exercise=exercise) for _ in range(3)]
+        exercise_state = ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, last_question=second,
+            question_order='{},{},{}'.format(third.pk, second.pk, first.pk))
+        AnswerGivenFactory(exercise_state=exercise_state, question=third)
+        second.delete()
+        self.assertEqual(user.get_next_question(), first.question)
+
+    def test_spaced_repetition(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        right, wrong, new = [QuestionFactory(exercise=exercise) for _ in range(3)]
+        state = ExerciseStateFactory(
+            exercise=exercise, user=user, current_question=None, completed=True)
+        AnswerGivenFactory(exercise_state=state, question=right, answer=right.answer)
+        AnswerGivenFactory(exercise_state=state, question=wrong, answer='wrong')
+        AnswerGivenFactory(exercise_state=state, question=wrong, answer=wrong.answer)
+        with self.settings(WORD_FINDING_QUESTION_POLICY='spaced'):
+            user.start_new_exercise()
+        self.assertEqual(
+            ExerciseState.objects.get(completed=False).question_order,
+            '{},{},{}'.format(wrong.pk, new.pk, right.pk))
+
+    def test_question_history(self):
+        user = UserFactory()
+        exercise = ExerciseFactory()
+        question = QuestionFactory(exercise=exercise, answer='boot')
+        states = [
+            ExerciseStateFactory(
+                exercise=exercise, user=user, current_question=None, completed=True)
+            for _ in range(4)
+        ]
+        for state, answer, is_correct in zip(
+                states, ('boot', 'sock', 'boot', 'boot'), (True, False, None, True)):
+            AnswerGivenFactory(
+                exercise_state=state, question=question, answer=answer, is_correct=is_correct)
+        catalogue.get_catalogue()
+        with self.assertNumQueries(2):
+            history = user._question_history(exercise.pk)
+        self.assertEqual(history, {question.pk: QuestionHistory(states[3].pk, True, 2)})
+        self.assertEqual(
+            user._question_history(exercise.pk, num_states=1),
+            {question.pk: QuestionHistory(states[3].pk, True, 1)})
+        self.assertEqual(
+            user._question_history(ExerciseFactory().pk), {})
+
     def test_retry_question_raises_if_max_attempts_reached(self):
         user = UserFactory()
         exercise = ExerciseFactory()
@@ -143,6 +364,9 @@ class TestUserModel(TestCase):
             user=user, exercise=exercise, current_question=question, completed=False)
         result = user.check_answer('correct')
         self.assertTrue(result)
+        answer = AnswerGiven.objects.get()
+        self.assertTrue(answer.is_correct)
+        self.assertEqual(answer.matched_answer, 'correct')
 
     def test_check_answer_incorrect(self):
         user = UserFactory()
@@ -152,3 +376,115 @@ class TestUserModel(TestCase):
             user=user, exercise=exercise, current_question=question, completed=False)
         result = user.check_answer('wrong')
         self.assertFalse(result)
+        self.assertFalse(AnswerGiven.objects.get().is_correct)
+
+
+@pytest.mark.django_db
+class TestExerciseStateModel(TestCase):
+    def test_only_one_in_progress(self):
+        user = UserFactory()
+        ExerciseStateFactory(user=user, completed=True)
+        ExerciseStateFactory(user=user, completed=True)
+        ExerciseStateFactory(user=user, completed=False)
+        with self.assertRaises(IntegrityError):
+            ExerciseStateFactory(user=user, completed=False)
+
+
+class TestStreaks(TestCase):
+    def test_streaks(self):
+        self.assertEqual(streaks([]), (0, 0, 0))
+        self.assertEqual(streaks([True, True]), (2, 2, 2))
+        self.assertEqual(streaks([True, False, True, True, True, False]), (1, 0, 3))
+        self.assertEqual(streaks([False, True]), (0, 1, 1))
+
+
+@pytest.mark.django_db
+class TestExerciseProgressModel(TestCase):
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        self.questions = [
+            QuestionFactory(exercise=self.exercise, answer='right') for _ in range(3)]
+        self.user = UserFactory(user_id='user')
+        self.addCleanup(catalogue.invalidate)
+
+    def _progress(self):
+        return list(ExerciseProgress.objects.order_by('exercise').values(
+            'user', 'exercise', 'started', 'completed', 'last_started', 'last_completed',
+            'attempts', 'correct', 'current_streak', 'best_streak'))
+
+    def test_kept_up_to_date_by_turns(self):
+        token = None
+        for text in ('', 'right', 'wrong', 'wrong', 'wrong', 'right', 'yes', 'right', 'right'):
+            token = take_turn('user', text, token).conversation_token
+
+        progress = ExerciseProgress.objects.get()
+        states = ExerciseState.objects.order_by('pk')
+        self.assertEqual(progress.started, 2)
+        self.assertEqual(progress.completed, 1)
+        self.assertEqual(progress.last_started, states.last().pk)
+        self.assertEqual(progress.last_completed, states.first().pk)
+        self.assertEqual(progress.attempts, 7)
+        self.assertEqual(progress.correct, 4)
+        self.assertEqual(progress.current_streak, 3)
+        self.assertEqual(progress.best_streak, 3)
+
+        kept = self._progress()
+        self.assertEqual(ExerciseProgress.rebuild(User.objects.all()), 1)
+        self.assertEqual(self._progress(), kept)
+
+    def test_answers_recorded_together(self):
+        state = ExerciseStateFactory(
+            user=self.user, exercise=self.exercise, current_question=None, completed=False)
+        ExerciseProgress.objects.create(
+            user=self.user, exercise=self.exercise, attempts=5, correct=3, current_streak=2,
+            best_streak=3)
+        answers = [
+            AnswerGiven(exercise_state=state, question=self.questions[0], is_correct=correct)
+            for correct in (True, False, True, True)
+        ]
+        with self.assertNumQueries(2):
+            ExerciseProgress.record_answers(answers)
+        progress = ExerciseProgress.objects.get()
+        self.assertEqual((progress.attempts, progress.correct), (9, 6))
+        self.assertEqual((progress.current_streak, progress.best_streak), (2, 3))
+
+        ExerciseProgress.record_answers(answers[2:], {state.pk: (self.user.pk, self.exercise.pk)})
+        progress.refresh_from_db()
+        self.assertEqual((progress.current_streak, progress.best_streak), (4, 4))
+
+    def test_added_if_missing(self):
+        state = ExerciseStateFactory(
+            user=self.user, exercise=self.exercise, current_question=None, completed=False)
+        ExerciseProgress.record_answers([
+            AnswerGiven(exercise_state=state, question=self.questions[0], is_correct=False)])
+        ExerciseProgress.record_completed(state)
+        progress = ExerciseProgress.objects.get()
+        self.assertEqual((progress.attempts, progress.completed), (1, 1))
+
+    def test_added_by_another_turn(self):
+        state = ExerciseStateFactory(
+            user=self.user, exercise=self.exercise, current_question=None, completed=False)
+        # Another turn adds the progress after this one found there wasn't any
+        ExerciseProgress.objects.create(
+            user=self.user, exercise=self.exercise, started=1, last_started=state.pk - 1)
+        with transaction.atomic():
+            ExerciseProgress.record_started(state, exists=False)
+        progress = ExerciseProgress.objects.get()
+        self.assertEqual((progress.started, progress.last_started), (2, state.pk))
+
+    def test_rebuild_marks_answers_not_marked(self):
+        state = ExerciseStateFactory(
+            user=self.user, exercise=self.exercise, current_question=None, completed=True)
+        AnswerGivenFactory(
+            exercise_state=state, question=self.questions[0], answer='right', is_correct=None)
+        AnswerGivenFactory(
+            exercise_state=state, question=self.questions[1], answer='wrong', is_correct=None)
+        other_user = UserFactory()
+        ExerciseStateFactory(user=other_user, current_question=None, completed=True)
+
+        self.assertEqual(ExerciseProgress.rebuild(User.objects.filter(pk=self.user.pk)), 1)
+        progress = ExerciseProgress.objects.get()
+        self.assertEqual((progress.started, progress.completed), (1, 1))
+        self.assertEqual((progress.last_started, progress.last_completed), (state.pk, state.pk))
+        self.assertEqual((progress.attempts, progress.correct), (2, 1))
+        self.assertEqual((progress.current_streak, progress.best_streak), (0, 1))
@@ -0,0 +1,92 @@
+import pytest
+
+from django.test import TestCase, override_settings
+
+from libs.google_actions.tests.mocks import MockRequest
+
+from apps.word_finding import catalogue
+from apps.word_finding.instrumentation import get_sinks
+from apps.word_finding.models.user import AnswerGiven
+from apps.word_finding.replay import (
+    LocMemReplayCache, RedisReplayCache, REPLAYED, get_replay_cache, request_key,
+)
+from apps.word_finding.views import index
+from .factories import ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory
+from .test_sessions import FakeRedis
+
+
+class TestLocMemReplayCache(TestCase):
+    def test_get_and_set(self):
+        cache = LocMemReplayCache()
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', b'content')
+        self.assertEqual(cache.get('key'), b'content')
+
+    def test_least_recently_set_forgotten(self):
+        cache = LocMemReplayCache(max_entries=2)
+        for key in ('first', 'second', 'third'):
+            cache.set(key, key.encode('utf-8'))
+        self.assertIsNone(cache.get('first'))
+        self.assertEqual(cache.get('third'), b'third')
+
+    def test_timeout(self):
+        cache = LocMemReplayCache(timeout=-1)
+        cache.set('key', b'content')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache._responses), 0)
+
+
+class TestRedisReplayCache(TestCase):
+    def test_get_and_set(self):
+        client = FakeRedis()
+        cache = RedisReplayCache(client=client, timeout=30)
+        cache.set('key', b'content')
+        self.assertEqual(cache.get('key'), b'content')
+        self.assertIn('word_finding:replay:key', client.values)
+
+
+class TestRequestKey(TestCase):
+    def test_same_for_bytes_and_text(self):
+        self.assertEqual(request_key(b'{"a": 1}'), request_key('{"a": 1}'))
+
+    def test_different_requests(self):
+        self.assertNotEqual(request_key(b'{"a": 1}'), request_key(b'{"a": 2}'))
+
+
+@pytest.mark.django_db
+@override_settings(
+    WORD_FINDING_REPLAY_CACHE={'BACKEND': 'apps.word_finding.replay.LocMemReplayCache'},
+    WORD_FINDING_METRICS_SINKS=[{'BACKEND': 'apps.word_finding.instrumentation.RecordingSink'}],
+)
+class TestReplayedRequests(TestCase):
+    def setUp(self):
+        exercise = ExerciseFactory()
+        question = QuestionFactory(exercise=exercise, answer='right')
+        QuestionFactory(exercise=exercise)
+        ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=exercise,
+            current_question=question,
+            completed=False,
+        )
+        self.addCleanup(catalogue.invalidate)
+        catalogue.get_catalogue()
+
+    def test_same_response_without_taking_turn(self):
+        first = index(MockRequest(text='wrong', user_id='user'))
+        with self.assertNumQueries(0):
+            second = index(MockRequest(text='wrong', user_id='user'))
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], 'application/json')
+        self.assertEqual(AnswerGiven.objects.count(), 1)
+        self.assertEqual([m.kind for m in get_sinks()[0].turns][-1], REPLAYED)
+
+    def test_different_request_takes_turn(self):
+        index(MockRequest(text='wrong', user_id='user'))
+        index(MockRequest(text='also wrong', user_id='user'))
+        self.assertEqual(AnswerGiven.objects.count(), 2)
+
+    def test_no_cache(self):
+        with self.settings(WORD_FINDING_REPLAY_CACHE=None):
+            self.assertIsNone(get_replay_cache())
+        self.assertIsInstance(get_replay_cache(), LocMemReplayCache)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+
+from apps.word_finding.models.exercise import Question
+from apps.word_finding.responses import (
+    QuestionSpeech, SSMLError, Speech, Template, phrase, sentence, validate_ssml,
+)
+
+
+class TestValidateSSML(TestCase):
+    def test_valid(self):
+        ssml = 'A <emphasis level="strong">blank</emphasis> <break time="1s"/>'
+        self.assertEqual(validate_ssml(ssml), ssml)
+
+    def test_not_well_formed(self):
+        with self.assertRaises(SSMLError):
+            validate_ssml('fish & chips')
+        with self.assertRaises(SSMLError):
+            validate_ssml('<emphasis>blank')
+
+    def test_unknown_element(self):
+        with self.assertRaisesRegex(SSMLError, "<script> isn't allowed"):
+            validate_ssml('<script>alert()</script>')
+
+    def test_phrase_checked(self):
+        with self.assertRaises(SSMLError):
+            phrase('Hello', '<emphasis>Hello')
+
+
+class TestSpeech(TestCase):
+    def test_plain_is_escaped(self):
+        self.assertEqual(Speech.plain('fish & chips'), ('fish & chips', 'fish &amp; chips'))
+
+    def test_join(self):
+        self.assertEqual(
+            Speech.join([Speech.plain('Hello.'), Speech('Bye.', '<s>Bye.</s>')]),
+            ('Hello. Bye.', '<speak>Hello. <s>Bye.</s></speak>'))
+
+    def test_sentence(self):
+        self.assertEqual(sentence(Speech('A car', 'A <s>car</s>')), ('A car.', 'A <s>car</s>.'))
+
+    def test_template_escapes_value(self):
+        self.assertEqual(
+            Template("I'm sorry, {} is incorrect.").render('<b> & {}'),
+            ("I'm sorry, <b> & {} is incorrect.", "I'm sorry, &lt;b&gt; &amp; {} is incorrect."))
+
+
+class TestQuestionSpeech(TestCase):
+    def _speech(self, **kwargs):
+        return QuestionSpeech(Question(**kwargs))
+
+    def test_prompt(self):
+        speech = self._speech(question='Fish & BLANK', answer='chips')
+        self.assertEqual(speech.prompt, (
+            'Fish & BLANK', 'Fish &amp; <emphasis level="strong">blank</emphasis>'))
+        self.assertEqual(speech.retry_prompt.text, 'Please try again. Fish & BLANK')
+
+    def test_model_answer(self):
+        speech = self._speech(
+            question='Drive a BLANK', response='A BLANK can be driven', answer='car, bus')
+        self.assertEqual(speech.model_answer, (
+            'A car can be driven', 'A <emphasis level="moderate">car</emphasis> can be driven'))
+        self.assertEqual(speech.model_answer_for('bus').text, 'A bus can be driven')
+        self.assertIs(speech.model_answer_for('bus'), speech.model_answer_for('bus'))
+        self.assertEqual(speech.model_answer_for(None).text, 'A car can be driven')
+
+    def test_illegal_characters_left_out(self):
+        speech = self._speech(question='Drive a\x0b BLANK', answer='car')
+        self.assertEqual(speech.prompt, (
+            'Drive a\x0b BLANK', 'Drive a <emphasis level="strong">blank</emphasis>'))
+        self.assertEqual(speech.model_answer.ssml, (
+            'Drive a <emphasis level="moderate">car</emphasis>'))
+
+    def test_plain(self):
+        speech = QuestionSpeech(Question(question='Fish & BLANK', answer='chips'), plain=True)
+        self.assertEqual(speech.prompt, ('Fish & BLANK', 'Fish &amp; BLANK'))
+        self.assertEqual(speech.model_answer, ('Fish & chips', 'Fish &amp; chips'))
+        self.assertEqual(speech.model_answer_for('peas'), ('Fish & peas', 'Fish &amp; peas'))
+
+    def test_model_answer_without_blank(self):
+        speech = self._speech(question='The colour of a pea is', answer='green')
+        self.assertEqual(speech.model_answer.text, 'The colour of a pea is green')
+
+    def test_model_answer_matches_question(self):
+        for response in ('', 'A BLANK, a BLANK', 'A BLANK.'):
+            question = Question(question='What BLANK?', response=response, answer='car, bus')
+            for answer in (None, 'bus', 'van'):
+                self.assertEqual(
+                    QuestionSpeech(question).model_answer_for(answer).text,
+                    question.model_answer(answer))
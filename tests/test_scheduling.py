@@ -0,0 +1,62 @@
+import random
+from collections import Counter, namedtuple
+from unittest import TestCase
+
+from apps.word_finding.scheduling import (
+    QuestionHistory, least_recent, weighted_random, sequential, seeded_random, spaced_repetition,
+)
+
+
+Exercise = namedtuple('Exercise', ('pk', ))
+
+
+class TestLeastRecent(TestCase):
+    def test_never_started(self):
+        exercises = [Exercise(pk) for pk in range(1, 5)]
+        last_started = {1: 10, 2: 11, 4: 12}
+        self.assertEqual(least_recent(exercises, last_started).pk, 3)
+
+    def test_least_recent(self):
+        exercises = [Exercise(pk) for pk in range(1, 4)]
+        last_started = {1: 30, 2: 10, 3: 20}
+        self.assertEqual(least_recent(exercises, last_started).pk, 2)
+
+
+class TestWeightedRandom(TestCase):
+    def test_prefers_least_recent(self):
+        random.seed(0)
+        exercises = [Exercise(pk) for pk in range(1, 4)]
+        last_started = {1: 30, 2: 10}
+        chosen = Counter(weighted_random(exercises, last_started).pk for _ in range(3000))
+        self.assertGreater(chosen[3], chosen[2])
+        self.assertGreater(chosen[2], chosen[1])
+        self.assertGreater(chosen[1], 0)
+
+
+class TestQuestionPolicies(TestCase):
+    def _no_history(self):
+        raise AssertionError("The history isn't needed")
+
+    def test_sequential(self):
+        self.assertEqual(sequential((3, 1, 2), 'seed', self._no_history), [3, 1, 2])
+
+    def test_seeded_random(self):
+        pks = tuple(range(20))
+        order = seeded_random(pks, 'seed', self._no_history)
+        self.assertEqual(sorted(order), list(pks))
+        self.assertNotEqual(order, list(pks))
+        self.assertEqual(seeded_random(pks, 'seed', self._no_history), order)
+        self.assertNotEqual(seeded_random(pks, 'another seed', self._no_history), order)
+
+    def test_spaced_repetition(self):
+        history = {
+            1: QuestionHistory(last_asked=20, right=True, streak=1),
+            2: QuestionHistory(last_asked=20, right=False, streak=0),
+            3: QuestionHistory(last_asked=10, right=True, streak=3),
+            5: QuestionHistory(last_asked=10, right=False, streak=0),
+            6: QuestionHistory(last_asked=10, right=True, streak=1),
+        }
+        self.assertEqual(
+            spaced_repetition((1, 2, 3, 4, 5, 6, 7), 'seed', lambda: history),
+            # Wrong, not asked, right once, right three times in a row
+            [5, 2, 4, 7, 6, 1, 3])
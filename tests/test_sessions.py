@@ -0,0 +1,426 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from django.core import signing
+from django.db import DataError, DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from libs.google_actions.tests.mocks import MockRequest
+
+from apps.word_finding import catalogue
+from apps.word_finding.models.user import User, ExerciseProgress, AnswerGiven
+from apps.word_finding.sessions import (
+    Session, LocMemSessionStore, RedisSessionStore, WriteBehindAnswerWriter, get_session_store,
+    TOKEN_VERSION,
+)
+from apps.word_finding.views import index
+from .factories import (
+    ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory, AnswerGivenFactory,
+)
+
+
+class FakeRedis(object):
+    "Enough of redis.StrictRedis for RedisSessionStore and RedisReplayCache."
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ex=None):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        self.values[key] = (value, time.time() + ex if ex else None)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestSession(TestCase):
+    def assertSessionsEqual(self, first, second):
+        self.assertEqual(
+            [getattr(first, s) for s in Session.__slots__],
+            [getattr(second, s) for s in Session.__slots__])
+
+    def test_json(self):
+        session = Session(1, 2, 3, 4, 5, 6, 7, 8, 9, '10,11')
+        self.assertSessionsEqual(Session.from_json(session.to_json()), session)
+
+    def test_token(self):
+        session = Session(1, 2, 3, 4, 5, 6, 7, 8, 9, '10,11')
+        self.assertSessionsEqual(Session.from_token('user', session.to_token('user')), session)
+
+    def test_token_for_another_user(self):
+        token = Session(1, 2, 3, 4, 5, 6, 7, 8, 9, '10,11').to_token('user')
+        self.assertIsNone(Session.from_token('another user', token))
+
+    def test_token_changed(self):
+        token = Session(1, 2, 3, 4, 5, 6, 7, 8, 9, '10,11').to_token('user')
+        self.assertIsNone(Session.from_token('user', token[:-1]))
+        self.assertIsNone(Session.from_token('user', 'x' + token))
+        self.assertIsNone(Session.from_token('user', None))
+
+    def test_token_from_another_version(self):
+        token = signing.dumps(
+            [TOKEN_VERSION + 1, 1, 2, 3, 4, 5, 6, 7, 8, 9, '10,11'],
+            salt='apps.word_finding.sessions.token:user', compress=True)
+        self.assertIsNone(Session.from_token('user', token))
+
+
+class TestLocMemSessionStore(TestCase):
+    def test_least_recently_used_forgotten(self):
+        store = LocMemSessionStore(max_entries=2)
+        store._set('one', '1')
+        store._set('two', '2')
+        store._get('one')
+        store._set('three', '3')
+        self.assertEqual(store._get('one'), '1')
+        self.assertIsNone(store._get('two'))
+        self.assertEqual(store._get('three'), '3')
+
+    def test_delete(self):
+        store = LocMemSessionStore()
+        store._set('one', '1')
+        store._delete('one')
+        self.assertIsNone(store._get('one'))
+
+
+class TestRedisSessionStore(TestCase):
+    def test_get_and_set(self):
+        client = FakeRedis()
+        store = RedisSessionStore(client=client, prefix='prefix:')
+        store._set('user', 'value')
+        self.assertIn('prefix:user', client.values)
+        self.assertEqual(store._get('user'), 'value')
+        store._delete('user')
+        self.assertIsNone(store._get('user'))
+
+    def test_timeout(self):
+        store = RedisSessionStore(client=FakeRedis(), timeout=-1)
+        store._set('user', 'value')
+        self.assertIsNone(store._get('user'))
+
+
+class SessionStoreTests(object):
+    """Tests for each of the stores which keep sessions, mixed in with the settings for them."""
+    def store_settings(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        settings = self.settings(WORD_FINDING_SESSION_STORE=self.store_settings())
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=self.exercise, answer='right')
+        self.next_question = QuestionFactory(exercise=self.exercise, question='next question')
+        self.state = ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=self.exercise,
+            current_question=self.question,
+            last_question=self.question,
+            completed=False,
+        )
+        catalogue.get_catalogue()
+
+    def _turn(self, text):
+        with CaptureQueriesContext(connection) as queries:
+            self._response(text)
+        return [q['sql'] for q in queries.captured_queries]
+
+    def _response(self, text):
+        return index(MockRequest(text=text, user_id='user'))
+
+    def test_no_reads_once_loaded(self):
+        self._turn('wrong')
+        queries = self._turn('right')
+        self.assertFalse([q for q in queries if q.startswith('SELECT')])
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.next_question)
+
+    def test_counts_attempts(self):
+        self._turn('wrong')
+        self._turn('wrong')
+        queries = self._turn('wrong')
+        self.assertFalse([q for q in queries if 'COUNT' in q])
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.next_question)
+
+    def test_new_exercise(self):
+        self.state.delete()
+        self._turn('')
+        queries = self._turn('right')
+        self.assertFalse([q for q in queries if q.startswith('SELECT')])
+        self.assertEqual(AnswerGiven.objects.get().answer, 'right')
+
+    def test_discarded_if_turn_fails(self):
+        self._turn('wrong')
+        with mock.patch.object(User, 'check_answer', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                self._turn('right')
+        self.assertIsNone(get_session_store()._get('user'))
+
+    def test_question_deleted(self):
+        self._turn('wrong')
+        self.question.delete()
+        self.assertIn(b'Welcome back', self._response('right').content)
+
+    def test_question_order(self):
+        self.state.current_question = self.next_question
+        self.state.last_question = self.next_question
+        self.state.question_order = '{},{}'.format(self.next_question.pk, self.question.pk)
+        self.state.save()
+        self._turn('wrong')
+        queries = self._turn(self.next_question.answer)
+        self.assertFalse([q for q in queries if q.startswith('SELECT')])
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.question)
+
+    def test_changed_by_another_process(self):
+        self._turn('wrong')
+        self.state.refresh_from_db()
+        self.state.current_question = self.next_question
+        self.state.save_fields('current_question')
+        self._turn('wrong')
+        self.assertEqual(AnswerGiven.objects.filter(question=self.next_question).count(), 1)
+
+
+@pytest.mark.django_db
+class TestLocMemSessionStoreTurns(SessionStoreTests, TestCase):
+    def store_settings(self):
+        return {'BACKEND': 'apps.word_finding.sessions.LocMemSessionStore'}
+
+
+@pytest.mark.django_db
+class TestRedisSessionStoreTurns(SessionStoreTests, TestCase):
+    def store_settings(self):
+        return {
+            'BACKEND': 'apps.word_finding.sessions.RedisSessionStore',
+            'OPTIONS': {'client': FakeRedis()},
+        }
+
+
+@pytest.mark.django_db
+@override_settings(WORD_FINDING_SESSION_STORE={
+    'BACKEND': 'apps.word_finding.sessions.LocMemSessionStore',
+    'OPTIONS': {'write_behind': True, 'flush_interval': None},
+})
+class TestWriteBehind(TestCase):
+    def setUp(self):
+        exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=exercise, answer='right')
+        self.next_question = QuestionFactory(exercise=exercise)
+        self.state = ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=exercise,
+            current_question=self.question,
+            last_question=self.question,
+            completed=False,
+        )
+        self.addCleanup(catalogue.invalidate)
+
+    def _answer(self, text='wrong'):
+        answer = AnswerGiven(exercise_state=self.state, question=self.question, answer=text)
+        answer.mark()
+        return answer
+
+    def _spool(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return os.path.join(directory.name, 'answers.spool')
+
+    def test_answers_saved_when_flushed(self):
+        AnswerGivenFactory(exercise_state=self.state, question=self.question, answer='wrong')
+
+        index(MockRequest(text='right', user_id='user'))
+        self.assertEqual(AnswerGiven.objects.count(), 1)
+
+        self.assertEqual(get_session_store().answer_writer.flush(), 1)
+        answer = AnswerGiven.objects.get(answer='right')
+        self.assertTrue(answer.is_correct)
+        self.assertEqual(answer.exercise_state, self.state)
+        self.assertEqual(ExerciseProgress.objects.get().correct, 1)
+
+    @override_settings(WORD_FINDING_SESSION_STORE={
+        'BACKEND': 'apps.word_finding.sessions.DatabaseSessionStore',
+        'OPTIONS': {'write_behind': True, 'flush_interval': None},
+    })
+    def test_unsaved_answers_counted_as_attempts(self):
+        for _ in range(3):
+            index(MockRequest(text='wrong', user_id='user'))
+        self.assertFalse(AnswerGiven.objects.exists())
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.next_question)
+        self.assertEqual(get_session_store().answer_writer.flush(), 3)
+
+    def test_flushed_once_batch_is_full(self):
+        writer = WriteBehindAnswerWriter(flush_interval=60, batch_size=2)
+        flushed = threading.Event()
+        with mock.patch.object(writer, 'flush', side_effect=lambda: flushed.set()):
+            for _ in range(2):
+                writer.write(self._answer())
+                writer.commit()
+            self.assertTrue(flushed.wait(5))
+
+    def _stop(self, writer):
+        "As if the writer's process had stopped, without saving its answers."
+        writer._path_lock.close()
+
+    def test_spool_read_when_created(self):
+        spool = self._spool()
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        writer.write(self._answer('wrong'))
+        writer.write(self._answer('right'))
+        writer.commit()
+        writer.write(self._answer('rolled back'))
+        writer.rollback()
+        self._stop(writer)
+
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(
+            list(AnswerGiven.objects.order_by('pk').values_list('answer', 'is_correct')),
+            [('wrong', False), ('right', True)])
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(spool))),
+            sorted(os.path.basename(p) for p in (spool + '.lock', writer._path + '.lock')))
+        self._stop(writer)
+        self.assertEqual(WriteBehindAnswerWriter(flush_interval=None, spool=spool).flush(), 0)
+
+    def test_spool_cut_short(self):
+        spool = self._spool()
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        writer.write(self._answer())
+        writer.commit()
+        with open(writer._path, 'a') as f:
+            f.write('[1, 2, "cut')
+        self._stop(writer)
+
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        writer.write(self._answer('right'))
+        writer.commit()
+        self._stop(writer)
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        self.assertEqual(writer.flush(), 2)
+
+    def test_failed_flush_saved_next_time(self):
+        spool = self._spool()
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        writer.write(self._answer('first'))
+        writer.commit()
+        with mock.patch.object(AnswerGiven.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                writer.flush()
+        writer.write(self._answer('second'))
+        writer.commit()
+        self.assertEqual(
+            writer.with_unsaved(self.state.pk, self.question.pk, lambda: 0),
+            (0, ['first', 'second']))
+        self._stop(writer)
+
+        # The answers being saved when the process stopped are saved before the others
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(
+            list(AnswerGiven.objects.order_by('pk').values_list('answer', flat=True)),
+            ['first', 'second'])
+
+    def test_bad_answer_left_out(self):
+        spool = self._spool()
+        writer = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        for text in ('first', 'x' * 40, 'third'):
+            writer.write(self._answer(text))
+        writer.commit()
+        bulk_create = AnswerGiven.objects.bulk_create
+
+        def enforce_length(answers, **kwargs):
+            if any(len(a.answer) > 32 for a in answers):
+                raise DataError('value too long')
+            return bulk_create(answers, **kwargs)
+
+        with mock.patch.object(AnswerGiven.objects, 'bulk_create', side_effect=enforce_length), \
+                self.assertLogs('apps.word_finding.sessions', 'ERROR'):
+            self.assertEqual(writer.flush(), 3)
+        self.assertEqual(
+            list(AnswerGiven.objects.order_by('pk').values_list('answer', flat=True)),
+            ['first', 'third'])
+        self.assertEqual(ExerciseProgress.objects.get().attempts, 2)
+        with open(spool + '.rejected') as f:
+            self.assertIn('x' * 40, f.read())
+
+        # It doesn't hold up the answers after it
+        writer.write(self._answer('fourth'))
+        writer.commit()
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(AnswerGiven.objects.count(), 3)
+        self._stop(writer)
+
+    def test_spool_shared_by_writers(self):
+        spool = self._spool()
+        first = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        first.write(self._answer('first'))
+        first.commit()
+        second = WriteBehindAnswerWriter(flush_interval=None, spool=spool)
+        second.write(self._answer('second'))
+        second.commit()
+        first.write(self._answer('first again'))
+        first.commit()
+
+        # Each only saves its own answers, and leaves the other's file alone
+        self.assertEqual(second.flush(), 1)
+        self.assertEqual(
+            WriteBehindAnswerWriter(flush_interval=None, spool=spool).flush(), 0)
+        self.assertEqual(first.flush(), 2)
+        first.write(self._answer('unsaved'))
+        first.commit()
+        self.assertEqual(
+            list(AnswerGiven.objects.order_by('pk').values_list('answer', flat=True)),
+            ['second', 'first', 'first again'])
+
+        # Once a writer stops, the next one saves what it hadn't
+        self._stop(first)
+        self.assertEqual(second.flush(), 0)
+        self.assertEqual(
+            WriteBehindAnswerWriter(flush_interval=None, spool=spool).flush(), 1)
+        self.assertEqual(AnswerGiven.objects.filter(answer='unsaved').count(), 1)
+
+    def test_unsaved_not_held_up_by_other_answers(self):
+        other = AnswerGiven(
+            exercise_state=self.state, question=self.next_question, answer='other')
+        writer = WriteBehindAnswerWriter(flush_interval=None)
+        writer._flushing, writer._in_flight = [other], True
+        writer.write(self._answer())
+        writer.commit()
+        result = []
+        with writer._flush_lock:
+            counting = threading.Thread(target=lambda: result.append(writer.with_unsaved(
+                self.state.pk, self.question.pk, lambda: 0)))
+            counting.start()
+            counting.join(5)
+        self.assertEqual(result, [(0, ['wrong'])])
+
+    def test_unsaved_saved_while_counting(self):
+        writer = WriteBehindAnswerWriter(flush_interval=None)
+        writer.write(self._answer())
+        writer.commit()
+        saved = AnswerGiven.objects.filter(exercise_state=self.state, question=self.question)
+        calls = []
+
+        def count():
+            calls.append(None)
+            if len(calls) == 1:
+                writer.flush()
+            return saved.count()
+
+        self.assertEqual(writer.with_unsaved(self.state.pk, self.question.pk, count), (1, []))
+        self.assertEqual(len(calls), 2)
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.word_finding import catalogue
+from apps.word_finding.models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
+from apps.word_finding.sessions import get_session_store
+from apps.word_finding.simulation import simulate_sessions
+from apps.word_finding.turn import take_turn, CORRECT, INCORRECT, RETRIES_EXHAUSTED, WELCOME
+from .factories import ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory
+
+
+SCRIPT = ['', 'wrong', 'right', 'wrong', 'wrong', 'wrong', 'yes', 'right', 'no', '']
+
+
+@pytest.mark.django_db
+class TestSimulateSessions(TestCase):
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(
+            exercise=self.exercise, question='A BLANK', response='A BLANK!', answer='right')
+        self.next_question = QuestionFactory(
+            exercise=self.exercise, question='Another BLANK', answer='other')
+        self.addCleanup(catalogue.invalidate)
+
+    def test_same_as_take_turn(self):
+        random.seed(0)
+        expected = []
+        token = None
+        for text in SCRIPT:
+            result = take_turn('webhook', text, token)
+            token = result.conversation_token
+            expected.append((result.kind, result.text, result.ssml))
+
+        random.seed(0)
+        results = simulate_sessions({'simulated': SCRIPT})['simulated']
+        self.assertEqual([(r.kind, r.text, r.ssml) for r in results], expected)
+        self.assertEqual(
+            [r.kind for r in results][:6],
+            [WELCOME, INCORRECT, CORRECT, INCORRECT, INCORRECT, RETRIES_EXHAUSTED])
+        self.assertEqual(
+            list(AnswerGiven.objects.filter(exercise_state__user__user_id='simulated').order_by(
+                'pk').values_list('answer', 'is_correct')),
+            list(AnswerGiven.objects.filter(exercise_state__user__user_id='webhook').order_by(
+                'pk').values_list('answer', 'is_correct')))
+
+    def test_batches(self):
+        user = UserFactory(user_id='existing')
+        ExerciseStateFactory(
+            user=user, exercise=self.exercise, current_question=self.question, completed=False)
+        scripts = {'user-{}'.format(i): ['', 'right', 'wrong'] for i in range(5)}
+        scripts['existing'] = ['right', 'wrong']
+
+        results = simulate_sessions(scripts, batch_size=2)
+        self.assertEqual(list(results), list(scripts))
+        self.assertEqual([r.kind for r in results['user-0']], [WELCOME, CORRECT, INCORRECT])
+        self.assertEqual([r.kind for r in results['existing']], [CORRECT, INCORRECT])
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(AnswerGiven.objects.count(), 12)
+        self.assertEqual(ExerciseState.objects.filter(completed=False).count(), 6)
+        progress = ExerciseProgress.objects.get(user__user_id='user-3')
+        self.assertEqual((progress.attempts, progress.correct, progress.current_streak), (2, 1, 0))
+
+    def test_queries_per_batch(self):
+        simulate_sessions({'warm': ['']})
+
+        def queries(num_users):
+            scripts = {
+                'user-{}-{}'.format(num_users, i): ['', 'right'] for i in range(num_users)}
+            with CaptureQueriesContext(connection) as context:
+                simulate_sessions(scripts)
+            return len(context.captured_queries)
+
+        # The users are loaded, and their answers saved, together
+        one, two, four = queries(1), queries(2), queries(4)
+        self.assertEqual(four - two, 2 * (two - one))
+        self.assertLess(two - one, one)
+
+
+@pytest.mark.django_db
+class TestSimulatedSessionsStored(TransactionTestCase):
+    def setUp(self):
+        QuestionFactory(answer='right')
+        self.addCleanup(catalogue.invalidate)
+
+    @override_settings(WORD_FINDING_SESSION_STORE={
+        'BACKEND': 'apps.word_finding.sessions.LocMemSessionStore'})
+    def test_stored_once_committed(self):
+        store = get_session_store()
+        with transaction.atomic():
+            simulate_sessions({'user': ['', 'wrong']})
+            self.assertIsNone(store._get('user'))
+        user = store.load('user')[0]
+        self.assertEqual(user.get_position(), ExerciseState.objects.values_list(
+            'pk', 'current_question').get() + (1,))
@@ -0,0 +1,172 @@
+import contextlib
+import threading
+import types
+from unittest import mock
+
+import pytest
+
+from django.db import close_old_connections, connection, transaction
+from django.test import TestCase, TransactionTestCase
+
+from apps.word_finding import catalogue, turn
+from apps.word_finding.exceptions import StaleExerciseState
+from apps.word_finding.models.user import User, ExerciseState, AnswerGiven
+from apps.word_finding.turn import (
+    take_turn, TOKEN_DO_ANOTHER_EXERCISE, CORRECT, INCORRECT, DO_ANOTHER, REPEATED,
+)
+from .factories import ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory
+
+
+@pytest.mark.django_db
+class TestRetriedDelivery(TestCase):
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=self.exercise, answer='right')
+        self.next_question = QuestionFactory(exercise=self.exercise, question='next question')
+        self.user = UserFactory(user_id='user')
+        self.addCleanup(catalogue.invalidate)
+
+    def _start(self):
+        return take_turn('user', '').conversation_token
+
+    def test_incorrect_answer(self):
+        token = self._start()
+        self.assertEqual(take_turn('user', 'wrong', token).kind, INCORRECT)
+        result = take_turn('user', 'wrong', token)
+        self.assertEqual(result.kind, REPEATED)
+        self.assertEqual(result.text, self.question.question)
+        self.assertEqual(AnswerGiven.objects.count(), 1)
+
+    def test_correct_answer(self):
+        token = self._start()
+        self.assertEqual(take_turn('user', 'right', token).kind, CORRECT)
+        result = take_turn('user', 'right', token)
+        self.assertEqual(result.kind, REPEATED)
+        self.assertEqual(result.text, 'next question')
+        self.assertEqual(AnswerGiven.objects.count(), 1)
+        self.assertEqual(ExerciseState.objects.get().current_question, self.next_question)
+
+    def test_attempts_counted_when_loaded_from_database(self):
+        self._start()
+        take_turn('user', 'wrong')
+        take_turn_once = turn._take_turn
+        conflicts = [StaleExerciseState]
+
+        def conflict_first(*args):
+            if conflicts:
+                raise conflicts.pop()
+            return take_turn_once(*args)
+
+        # Without a token the state is loaded from the database, as after a store miss
+        with mock.patch.object(turn, '_take_turn', side_effect=conflict_first), \
+                mock.patch.object(turn, '_already_taken', wraps=turn._already_taken) as taken:
+            self.assertEqual(take_turn('user', 'wrong').kind, INCORRECT)
+        state = ExerciseState.objects.get()
+        self.assertEqual(taken.call_args[0][2], (state.pk, self.question.pk, 1))
+        self.assertEqual(AnswerGiven.objects.count(), 2)
+
+    def test_different_answer_is_checked(self):
+        token = self._start()
+        take_turn('user', 'wrong', token)
+        self.assertEqual(take_turn('user', 'right', token).kind, CORRECT)
+        self.assertEqual(AnswerGiven.objects.count(), 2)
+
+    def test_exercise_finished(self):
+        self.next_question.delete()
+        catalogue.invalidate()
+        token = self._start()
+        self.assertTrue(take_turn('user', 'right', token).exercise_finished)
+        result = take_turn('user', 'right', token)
+        self.assertEqual(result.kind, REPEATED)
+        self.assertEqual(result.conversation_token, TOKEN_DO_ANOTHER_EXERCISE)
+        self.assertFalse(result.exercise_finished)
+
+    def test_another_exercise(self):
+        ExerciseStateFactory(
+            user=self.user, exercise=self.exercise, current_question=None, completed=True)
+        self.assertEqual(take_turn('user', 'yes', TOKEN_DO_ANOTHER_EXERCISE).kind, DO_ANOTHER)
+        result = take_turn('user', 'yes', TOKEN_DO_ANOTHER_EXERCISE)
+        self.assertEqual(result.kind, REPEATED)
+        self.assertEqual(result.text, self.question.question)
+        self.assertEqual(ExerciseState.objects.filter(completed=False).count(), 1)
+
+
+@pytest.mark.django_db
+class TestConcurrentTurns(TransactionTestCase):
+    """Takes the same turn for a user from many threads at once, like Google retrying slow
+    requests.
+
+    SQLite only allows one writer at a time, and with the tests' in memory database the others
+    fail straight away rather than waiting. So with SQLite each turn's transaction waits for a lock
+    before it starts, as BEGIN IMMEDIATE would make it wait for the database. The turns still start
+    from the same state, from the token, so all but the first conflict and are taken again.
+    """
+    num_threads = 8
+
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        for i in range(3):
+            QuestionFactory(
+                exercise=self.exercise, question='question {}'.format(i), answer='right')
+        self.addCleanup(catalogue.invalidate)
+        if connection.vendor == 'sqlite':
+            patcher = mock.patch.object(
+                turn, 'transaction', types.SimpleNamespace(atomic=self._serialised_atomic))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    _writer_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _serialised_atomic(self):
+        with self._writer_lock, transaction.atomic():
+            yield
+
+    def _at_once(self, text, conversation_token=None):
+        "Takes the turn in each thread, checks none of them failed and returns the results."
+        barrier = threading.Barrier(self.num_threads)
+        results = []
+        errors = []
+
+        def turn():
+            try:
+                barrier.wait()
+                results.append(take_turn('user', text, conversation_token))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=turn) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_new_user(self):
+        self._at_once('')
+        self.assertEqual(User.objects.filter(user_id='user').count(), 1)
+        self.assertEqual(ExerciseState.objects.filter(completed=False).count(), 1)
+
+    def test_conversation(self):
+        ExerciseStateFactory(
+            user=UserFactory(user_id='user'), exercise=self.exercise, current_question=None,
+            completed=True)
+        token = TOKEN_DO_ANOTHER_EXERCISE
+        for text in ('yes', 'wrong', 'right', 'right', 'right', 'yes'):
+            with mock.patch.object(turn, '_retry_turn', wraps=turn._retry_turn) as retried:
+                results = self._at_once(text, token)
+            if token != TOKEN_DO_ANOTHER_EXERCISE:
+                # All but the first started from the state in the token, and were taken again
+                self.assertEqual(retried.call_count, self.num_threads - 1)
+            taken = [r for r in results if r.kind != REPEATED]
+            self.assertEqual(len(taken), 1)
+            self.assertEqual(len(set(r.text for r in results if r.kind == REPEATED)), 1)
+            self.assertLessEqual(ExerciseState.objects.filter(completed=False).count(), 1)
+            token = taken[0].conversation_token
+
+        self.assertEqual(
+            list(AnswerGiven.objects.order_by('pk').values_list('answer', flat=True)),
+            ['wrong', 'right', 'right', 'right'])
@@ -1,13 +1,18 @@
+import json
+
 import pytest
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.http import HttpResponse
 
 from libs.google_actions.tests.mocks import MockRequest
 from libs.google_actions.tests.utils import Utils as GoogleTestUtils
 
+from apps.word_finding import catalogue
 from apps.word_finding.views import index, TOKEN_DO_ANOTHER_EXERCISE
-from apps.word_finding.models.user import User, ExerciseState
+from apps.word_finding.models.user import User, ExerciseState, ExerciseProgress, AnswerGiven
 
 from .factories import (
     ExerciseFactory, QuestionFactory, UserFactory, ExerciseStateFactory, AnswerGivenFactory,
@@ -118,6 +123,53 @@ class TestViews(TestCase):
         self.assertNotIn(question.question, response)
         self.assertIn(next_question.question, response)
 
+    def test_model_answer_uses_correct_answer(self):
+        exercise = ExerciseFactory()
+        question = QuestionFactory(exercise=exercise, response='A BLANK', answer='boot, shoe')
+        ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=exercise,
+            current_question=question,
+            completed=False,
+        )
+        response = _make_request_and_return_text(text='er a shoe', user_id='user')
+        self.assertIn('A shoe.', response)
+
+    def test_ssml(self):
+        exercise = ExerciseFactory()
+        question = QuestionFactory(
+            exercise=exercise, question='Wear a BLANK', response='A BLANK', answer='boot')
+        ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=exercise,
+            current_question=question,
+            completed=False,
+        )
+        with self.settings(WORD_FINDING_SSML=True):
+            response = json.loads(index(
+                MockRequest(text='<sock>', user_id='user')).content.decode('utf-8'))
+        prompt = response['expected_inputs'][0]['input_prompt']['initial_prompts'][0]
+        self.assertNotIn('text_to_speech', prompt)
+        self.assertEqual(
+            prompt['ssml'],
+            "<speak>I'm sorry, &lt;sock&gt; is incorrect. Please try again. "
+            'Wear a <emphasis level="strong">blank</emphasis></speak>')
+
+    def test_model_answer_after_max_question_retries(self):
+        exercise = ExerciseFactory()
+        question = QuestionFactory(exercise=exercise, response='A BLANK', answer='boot')
+        state = ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=exercise,
+            current_question=question,
+            completed=False,
+        )
+        for _ in range(3):
+            AnswerGivenFactory(exercise_state=state, question=question)
+        response = _make_request_and_return_text(text='sock', user_id='user')
+        self.assertIn('A boot.', response)
+        self.assertNotIn('A sock.', response)
+
     def test_exercise_completion(self):
         exercise = ExerciseFactory()
         ExerciseStateFactory(
@@ -165,6 +217,139 @@ class TestViews(TestCase):
         self.assertTrue(GoogleTestUtils.google_response_is_tell(response))
 
 
+@pytest.mark.django_db
+class TestQueriesPerTurn(TestCase):
+    """Each kind of turn should use a fixed number of queries, however much history there is.
+
+    The counts include the savepoint queries for the turn's transaction. Without a token the
+    answers to the current question are counted when the state is loaded, so a retried delivery
+    can be recognised (see turn.py).
+    """
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        answered = [QuestionFactory(exercise=self.exercise) for _ in range(5)]
+        self.question = QuestionFactory(exercise=self.exercise, answer='right')
+        self.next_question = QuestionFactory(exercise=self.exercise)
+        self.state = ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=self.exercise,
+            current_question=self.question,
+            last_question=self.question,
+            completed=False,
+        )
+        for question in answered:
+            AnswerGivenFactory(exercise_state=self.state, question=question)
+        ExerciseProgress.rebuild(User.objects.all())
+        catalogue.get_catalogue()
+
+    def test_welcome(self):
+        with self.assertNumQueries(13):
+            _make_request_and_return_text(user_id='new user')
+
+    def test_correct(self):
+        with self.assertNumQueries(7):
+            _make_request_and_return_text(text='right', user_id='user')
+
+    def test_correct_with_token(self):
+        token = _make_request_and_return_token(text='wrong', user_id='user')
+        with self.assertNumQueries(5):
+            _make_request_and_return_text(text='right', user_id='user', conversation_token=token)
+
+    def test_incorrect(self):
+        with self.assertNumQueries(7):
+            _make_request_and_return_text(text='wrong', user_id='user')
+
+    def test_retries_exhausted(self):
+        for _ in range(2):
+            AnswerGivenFactory(exercise_state=self.state, question=self.question)
+        with self.assertNumQueries(7):
+            _make_request_and_return_text(text='wrong', user_id='user')
+
+    def test_exercise_finished(self):
+        self.next_question.delete()
+        catalogue.get_catalogue()
+        with self.assertNumQueries(8):
+            response = _make_request_and_return_text(text='right', user_id='user')
+        self.assertIn('finished', response)
+
+
+@pytest.mark.django_db
+class TestConversationToken(TestCase):
+    def setUp(self):
+        self.exercise = ExerciseFactory()
+        self.question = QuestionFactory(exercise=self.exercise, answer='right')
+        self.next_question = QuestionFactory(exercise=self.exercise, question='next question')
+        self.state = ExerciseStateFactory(
+            user=UserFactory(user_id='user'),
+            exercise=self.exercise,
+            current_question=self.question,
+            last_question=self.question,
+            completed=False,
+        )
+
+    def test_correct_answer_only_writes(self):
+        token = _make_request_and_return_token(text='wrong', user_id='user')
+        with CaptureQueriesContext(connection) as queries:
+            response = _make_request_and_return_text(
+                text='right', user_id='user', conversation_token=token)
+        self.assertIn('next question', response)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('SELECT')])
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.next_question)
+
+    def test_remaining_questions(self):
+        token = _make_request_and_return_token(text='right', user_id='user')
+        for _ in range(2):
+            token = _make_request_and_return_token(
+                text='wrong', user_id='user', conversation_token=token)
+        with CaptureQueriesContext(connection) as queries:
+            raw_response = index(MockRequest(
+                text='wrong', user_id='user', conversation_token=token))
+        self.assertIn('finished', GoogleTestUtils.get_text_from_google_response(raw_response))
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('SELECT')])
+        self.assertEqual(
+            TOKEN_DO_ANOTHER_EXERCISE,
+            GoogleTestUtils.get_conversation_token_from_google_response(raw_response))
+
+    def test_out_of_date_token(self):
+        old_token = _make_request_and_return_token(text='wrong', user_id='user')
+        _make_request_and_return_token(text='wrong', user_id='user', conversation_token=old_token)
+        # The old token thinks there has only been one attempt, the database knows better. The
+        # answer is different, or it would be a retried delivery of the last request.
+        response = _make_request_and_return_text(
+            text='also wrong', user_id='user', conversation_token=old_token)
+        self.assertIn('next question', response)
+        self.assertEqual(AnswerGiven.objects.count(), 3)
+
+    def test_tampered_token(self):
+        token = _make_request_and_return_token(text='wrong', user_id='user')
+        for bad_token in (token[:-1], token + 'x', 'not a token'):
+            response = _make_request_and_return_text(
+                text='right', user_id='user', conversation_token=bad_token)
+            self.assertIn('next question', response)
+            ExerciseState.objects.update(
+                current_question=self.question, last_question=self.question, version=0)
+
+    def test_token_for_another_user(self):
+        token = _make_request_and_return_token(text='wrong', user_id='user')
+        response = _make_request_and_return_text(
+            text='right', user_id='another user', conversation_token=token)
+        self.assertIn('Welcome', response)
+        self.state.refresh_from_db()
+        self.assertEqual(self.state.current_question, self.question)
+
+    def test_question_added(self):
+        token = _make_request_and_return_token(text='right', user_id='user')
+        QuestionFactory(exercise=self.exercise, question='new question')
+        response = _make_request_and_return_text(
+            text='wrong', user_id='user', conversation_token=token)
+        self.assertIn('incorrect', response)
+        token = _make_request_and_return_token(text='wrong', user_id='user')
+        response = _make_request_and_return_text(
+            text='wrong', user_id='user', conversation_token=token)
+        self.assertIn('new question', response)
+
+
 @pytest.mark.django_db
 class IntegrationTests(TestCase):
     def test_basic_full_conversation(self):
@@ -213,3 +398,9 @@ def _make_request_and_return_text(text=None, user_id=None, conversation_token=No
     response = index(
         MockRequest(text=text, user_id=user_id, conversation_token=conversation_token))
     return GoogleTestUtils.get_text_from_google_response(response)
+
+
+def _make_request_and_return_token(text=None, user_id=None, conversation_token=None):
+    response = index(
+        MockRequest(text=text, user_id=user_id, conversation_token=conversation_token))
+    return GoogleTestUtils.get_conversation_token_from_google_response(response)
@@ -0,0 +1,74 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from django.test import RequestFactory, TestCase
+
+from apps.word_finding import catalogue, warmup, wsgi
+from apps.word_finding.views import ready
+from .factories import QuestionFactory
+
+
+@pytest.mark.django_db
+class TestWarmUp(TestCase):
+    def setUp(self):
+        QuestionFactory(question='What is a BLANK?', answer='pea')
+        self.addCleanup(catalogue.invalidate)
+        patcher = mock.patch.object(warmup, '_ready', threading.Event())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warm_up(self):
+        catalogue.invalidate()
+        self.assertFalse(warmup.is_ready())
+        warmup.warm_up()
+        self.assertTrue(warmup.is_ready())
+        with self.assertNumQueries(0):
+            catalogue.get_catalogue()
+
+    def test_start_warm_up(self):
+        with mock.patch.object(warmup, 'warm_up', side_effect=warmup._ready.set) as warm_up:
+            warmup.start_warm_up()
+            self.assertTrue(warmup.wait(5))
+            warmup.start_warm_up()
+        self.assertEqual(warm_up.call_count, 1)
+
+    def test_failed_warm_up_tried_again(self):
+        failed = threading.Event()
+
+        def fail():
+            failed.set()
+            raise ValueError
+
+        with mock.patch.object(warmup, 'warm_up', side_effect=fail):
+            with self.assertLogs('apps.word_finding.warmup', 'ERROR'):
+                warmup.start_warm_up()
+                failed.wait(5)
+                warmup._thread.join(5)
+        self.assertFalse(warmup.is_ready())
+        with mock.patch.object(warmup, 'warm_up', side_effect=warmup._ready.set):
+            warmup.start_warm_up()
+            self.assertTrue(warmup.wait(5))
+
+    def test_ready_view(self):
+        request = RequestFactory().get('/ready')
+        with mock.patch('apps.word_finding.views.start_warm_up') as start_warm_up:
+            response = ready(request)
+        self.assertEqual(response.status_code, 503)
+        start_warm_up.assert_called_once_with()
+
+        warmup.warm_up()
+        response = ready(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'Ready')
+
+
+class TestWSGIApplication(TestCase):
+    def test_warms_up(self):
+        with mock.patch.object(warmup, 'start_warm_up') as start_warm_up:
+            wsgi.get_application()
+            self.assertFalse(start_warm_up.called)
+            with self.settings(WORD_FINDING_WARM_UP=True):
+                wsgi.get_application()
+        start_warm_up.assert_called_once_with()
@@ -0,0 +1,8 @@
+from django.conf.urls import url
+from django.contrib import admin
+
+
+# For the tests which need the admin's URLs
+urlpatterns = [
+    url(r'^admin/', admin.site.urls),
+]
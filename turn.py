@@ -0,0 +1,254 @@
+"""A single turn of the conversation.
+
+A turn takes what the user said and returns what we should say back. It knows nothing about the
+Actions request and response format, that is left to the views.
+
+All the database work for a turn happens in one transaction, and the user's in progress exercise
+state is only loaded once, by the session store (see sessions.py). While an exercise is in progress
+the state goes back to Actions as the conversation token, so usually it isn't loaded at all.
+
+Turns for the same user can overlap, when Google retries a slow request or the user says something
+before the last turn finished. Each change to the state checks its version (see
+ExerciseState.save_fields), so the second turn to save fails with StaleExerciseState. It is then
+taken again, with the user's row locked so the retries take turns, from the state in the database.
+If the first turn was for the same request (it had the same answer to the same question), the
+second one is a retried delivery and only repeats where the conversation is up to, without giving
+the answer again.
+
+On PostgreSQL and SQLite the database also only allows one exercise in progress for each user, with
+the partial unique index added by migration 0010, so two turns which both start an exercise fail
+the same way. Other databases, such as MySQL, don't have partial indexes, so there both can be
+started. The user then carries on with the latest one, and the other is left in progress.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+
+from . import responses as say
+from .exceptions import NoQuestionsRemaining, MaxQuestionRetriesReached, StaleExerciseState
+from .models.user import User, AnswerGiven
+from .responses import Speech
+from .sessions import Session, get_session_store
+
+
+TOKEN_DO_ANOTHER_EXERCISE = 'DO_ANOTHER_EXERCISE'
+
+# The different kinds of turn
+WELCOME = 'welcome'
+RETURNING = 'returning'
+DO_ANOTHER = 'do_another'
+GOODBYE = 'goodbye'
+CORRECT = 'correct'
+INCORRECT = 'incorrect'
+RETRIES_EXHAUSTED = 'retries_exhausted'
+REPEATED = 'repeated'
+
+# How many times a turn is taken again after another turn for the same user changed the state
+MAX_CONFLICT_RETRIES = 3
+
+
+TurnResult = namedtuple('TurnResult', (
+    'kind',
+    'text',
+    # The same as text, in SSML
+    'ssml',
+    'conversation_token',
+    'expect_user_response',
+    'exercise_finished',
+    'exercise_id',
+))
+
+
+def take_turn(user_id, text, conversation_token=None):
+    store = get_session_store()
+    try:
+        try:
+            with transaction.atomic():
+                user, created = store.load(user_id, conversation_token)
+                # Counted now, so a retried delivery can be recognised if the state conflicts
+                loaded = user.get_position(count_attempts=True)
+                result = _take_turn(user, created, text, conversation_token)
+        except StaleExerciseState:
+            user, result = _retry_turn(store, user_id, text, conversation_token, loaded)
+    except Exception:
+        store.answer_writer.rollback()
+        store.discard(user_id)
+        raise
+    store.answer_writer.commit()
+    store.save(user)
+
+    if result.conversation_token is None and user.exercise_in_progress:
+        result = result._replace(conversation_token=Session.from_user(user).to_token(user_id))
+    return result
+
+
+def _retry_turn(store, user_id, text, conversation_token, loaded):
+    """Takes the turn again from the database, after another turn changed the state first.
+
+    Returns the user and the result.
+    """
+    for retry in range(MAX_CONFLICT_RETRIES):
+        store.answer_writer.rollback()
+        try:
+            with transaction.atomic():
+                # Turns which lock the user wait for each other, rather than conflicting again
+                list(User.objects.select_for_update().filter(
+                    user_id=user_id).values_list('pk', flat=True))
+                user, created = store.load_from_database(user_id)
+                if _already_taken(store, user, loaded, text):
+                    return user, _repeat(user)
+                return user, _take_turn(user, created, text, conversation_token)
+        except StaleExerciseState:
+            if retry == MAX_CONFLICT_RETRIES - 1:
+                raise
+
+
+def _already_taken(store, user, loaded, text):
+    """Whether another turn has already taken this one, while it was being taken.
+
+    That is if the turn would have started an exercise and one has been started, or if the answer
+    has been given since the turn's state was loaded, including answers which haven't been saved
+    yet. loaded is the user's position then, with the attempts counted.
+    """
+    if loaded is None:
+        return user.exercise_in_progress
+    state_pk, question_pk, attempts = loaded
+    if question_pk is None:
+        return False
+    answers = AnswerGiven.objects.filter(
+        exercise_state_id=state_pk,
+        question_id=question_pk,
+    ).order_by('pk').values_list('answer', flat=True)
+    saved, unsaved = store.answer_writer.with_unsaved(
+        state_pk, question_pk, lambda: list(answers))
+    return text in (saved + unsaved)[attempts:]
+
+
+def _repeat(user):
+    "Says where the conversation is up to, without changing anything."
+    if not user.exercise_in_progress:
+        speech = Speech.join([say.ANOTHER_EXERCISE])
+        return TurnResult(
+            kind=REPEATED,
+            text=speech.text,
+            ssml=speech.ssml,
+            conversation_token=TOKEN_DO_ANOTHER_EXERCISE,
+            expect_user_response=True,
+            exercise_finished=False,
+            exercise_id=None,
+        )
+    exercise_id = user.get_current_exercise_id()
+    if user.get_position()[1] is not None:
+        responses, token = [user.get_question_speech().prompt], None
+    else:
+        responses, token = _get_next_question(user, [], first_question=False)
+    speech = Speech.join(responses)
+    return TurnResult(
+        kind=REPEATED,
+        text=speech.text,
+        ssml=speech.ssml,
+        conversation_token=token,
+        expect_user_response=True,
+        exercise_finished=token == TOKEN_DO_ANOTHER_EXERCISE,
+        exercise_id=exercise_id,
+    )
+
+
+def _take_turn(user, created, text, conversation_token):
+    responses = []
+    retry_question = False
+    first_question = False
+    exercise_id = None
+
+    if created:
+        kind = WELCOME
+        responses = _welcome(user, responses)
+        exercise_id = user.get_current_exercise_id()
+        first_question = True
+    elif conversation_token == TOKEN_DO_ANOTHER_EXERCISE:
+        if any(text in r for r in ('yes', 'ok')):
+            if user.exercise_in_progress:
+                # Another delivery of this request has already started it
+                return _repeat(user)
+            kind = DO_ANOTHER
+            exercise_id = user.start_new_exercise().pk
+            responses.append(say.LETS_GO)
+        else:
+            speech = Speech.join([say.GOODBYE])
+            return TurnResult(
+                kind=GOODBYE,
+                text=speech.text,
+                ssml=speech.ssml,
+                conversation_token=None,
+                expect_user_response=False,
+                exercise_finished=False,
+                exercise_id=None,
+            )
+    elif not user.exercise_in_progress:
+        kind = RETURNING
+        exercise_id = user.start_new_exercise().pk
+        responses.append(say.WELCOME_BACK)
+        first_question = True
+    else:
+        exercise_id = user.get_current_exercise_id()
+        correct = user.check_answer(text)
+        if correct:
+            kind = CORRECT
+            responses.append(say.CORRECT.render())
+            responses.append(say.sentence(user.get_model_answer(text)))
+            user.reset_current_question(save=False)
+        else:
+            responses.append(say.INCORRECT.render(text))
+            try:
+                user.retry_question()
+            except MaxQuestionRetriesReached:
+                kind = RETRIES_EXHAUSTED
+                responses.append(say.sentence(user.get_model_answer(text)))
+                user.reset_current_question(save=False)
+                responses.append(say.MOVE_ON)
+            else:
+                kind = INCORRECT
+                responses.append(user.get_question_speech().retry_prompt)
+                retry_question = True
+
+    new_token = None
+    if not retry_question:
+        responses, new_token = _get_next_question(
+            user=user,
+            responses=responses,
+            first_question=first_question,
+        )
+
+    speech = Speech.join(responses)
+    return TurnResult(
+        kind=kind,
+        text=speech.text,
+        ssml=speech.ssml,
+        conversation_token=new_token,
+        expect_user_response=True,
+        exercise_finished=new_token == TOKEN_DO_ANOTHER_EXERCISE,
+        exercise_id=exercise_id,
+    )
+
+
+def _welcome(user, responses):
+    responses.append(say.WELCOME)
+    user.start_new_exercise()
+    return responses
+
+
+def _get_next_question(user, responses, first_question):
+    try:
+        user.get_next_question()
+    except NoQuestionsRemaining:
+        user.complete_exercise()
+        responses.append(say.EXERCISE_FINISHED)
+        responses.append(say.ANOTHER_EXERCISE)
+        return responses, TOKEN_DO_ANOTHER_EXERCISE
+
+    if first_question:
+        responses.append(say.FIRST_QUESTION)
+    else:
+        responses.append(say.NEXT_QUESTION)
+    responses.append(user.get_question_speech().prompt)
+    return responses, None
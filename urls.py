@@ -4,4 +4,6 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.index, name='index'),
+    url(r'^metrics$', views.metrics, name='metrics'),
+    url(r'^ready$', views.ready, name='ready'),
 ]
@@ -1,115 +1,103 @@
-import random
 import logging
 
-from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 
 from libs.google_actions import AppResponse, AppRequest, NoJsonException
 
-from .exceptions import NoQuestionsRemaining, MaxQuestionRetriesReached
-from .models.user import User
+from .instrumentation import FINISHED, get_sinks, measure_turn
+from .replay import REPLAYED, get_replay_cache, request_key
+from .turn import take_turn, TOKEN_DO_ANOTHER_EXERCISE  # noqa: F401
+from .warmup import is_ready, start_warm_up
 
 
 logger = logging.getLogger(__name__)
 
 
 # v1
-# BUG: model answers include extra words if they were given by the user
-# BUG: if the user gets it wrong 3 times in a row the model answer is wrong
 # what happens if the user says nothing
 # intro text for each exercise
 #
 # v2
-# refactor index!
-# add emphasis to BLANK in questions -- https://developers.google.com/actions/reference/ssml
-# random and optional question order
 # ask if they want to try a question again?
 # add last_modified and date_created to appropriate models
 # response better if don't understand response to do another exercise
 # let the user choose the exercise
 
 
-TOKEN_DO_ANOTHER_EXERCISE = 'DO_ANOTHER_EXERCISE'
-
-
 def index(request):
-    try:
-        google_request = AppRequest(request)
-    except NoJsonException:
-        return HttpResponse("Hello world. You're at the word_finding index.")
-
-    responses = []
-    retry_question = False
-    conversation_token = None
-    first_question = False
-
-    user, created = User.objects.get_or_create(user_id=google_request.user_id)
-
-    if created:
-        responses = _welcome(user, responses)
-        first_question = True
-    elif google_request.conversation_token == TOKEN_DO_ANOTHER_EXERCISE:
-        if any(google_request.text in r for r in ('yes', 'ok')):
-            user.start_new_exercise()
-            responses.append("Alright, let's go!")
-        else:
-            return JsonResponse(AppResponse().tell('Goodbye'))
-    elif not user.exercise_in_progress:
-        user.start_new_exercise()
-        responses.append("Welcome back. Let's start a new exercise.")
-        first_question = True
-    else:
-        correct = user.check_answer(google_request.text)
-        if correct:
-            responses.append(random.choice(("That's right,", "Correct,")))
-            responses.append('{}.'.format(user.get_model_answer(google_request.text)))
-            user.reset_current_question()
-        else:
-            responses.append("I'm sorry, {} is incorrect.".format(google_request.text))
+    with measure_turn() as measurement:
+        with measurement.timing('parse'):
             try:
-                question = user.retry_question()
-            except MaxQuestionRetriesReached:
-                responses.append('{}.'.format(user.get_model_answer(google_request.text)))
-                user.reset_current_question()
-                responses.append("Let's move on.")
-            else:
-                responses.append("Please try again.")
-                responses.append(question)
-                retry_question = True
-
-    if not retry_question:
-        responses, conversation_token = _get_next_question(
-            user=user,
-            responses=responses,
-            first_question=first_question,
+                google_request = AppRequest(request)
+            except NoJsonException:
+                return HttpResponse("Hello world. You're at the word_finding index.")
+
+            replay_cache = get_replay_cache()
+            if replay_cache is not None:
+                key = request_key(request.body)
+                content = replay_cache.get(key)
+                if content is not None:
+                    # Google has sent this request again, it already has a response
+                    measurement.record(kind=REPLAYED, user_id=google_request.user_id)
+                    return HttpResponse(content, content_type='application/json')
+
+        with measurement.timing('turn'):
+            result = take_turn(
+                user_id=google_request.user_id,
+                text=google_request.text,
+                conversation_token=google_request.conversation_token,
+            )
+
+        with measurement.timing('respond'):
+            response = JsonResponse(_app_response(result))
+            if replay_cache is not None:
+                replay_cache.set(key, response.content)
+
+        measurement.record(
+            kind=FINISHED if result.exercise_finished else result.kind,
+            user_id=google_request.user_id,
+            exercise_id=result.exercise_id,
         )
-
-    return JsonResponse(AppResponse().ask(
-        ' '.join(responses),
-        conversation_token=conversation_token,
-    ))
+    return response
 
 
-def _welcome(user, responses):
-    responses.append((
-        "Welcome. You have been having trouble finding your words. "
-        "These exercises will give you a chance to practice your word finding."
-    ))
-    user.start_new_exercise()
-    return responses
-
-
-def _get_next_question(user, responses, first_question):
-    try:
-        next_question = user.get_next_question()
-    except NoQuestionsRemaining:
-        user.complete_exercise()
-        responses.append("Exercise finished. Well done!")
-        responses.append("Would you like to try another exercise?")
-        return responses, TOKEN_DO_ANOTHER_EXERCISE
-
-    if first_question:
-        responses.append("This is the first question:")
+def _app_response(result):
+    "The Actions response for the turn's result, saying the SSML if WORD_FINDING_SSML is True."
+    if not result.expect_user_response:
+        response = AppResponse().tell(result.text)
     else:
-        responses.append("The next question is:")
-    responses.append(next_question)
-    return responses, None
+        response = AppResponse().ask(
+            result.text,
+            conversation_token=result.conversation_token,
+        )
+    if getattr(settings, 'WORD_FINDING_SSML', False):
+        if not result.expect_user_response:
+            prompt = response['final_response']['speech_response']
+        else:
+            prompt = response['expected_inputs'][0]['input_prompt']['initial_prompts'][0]
+        del prompt['text_to_speech']
+        prompt['ssml'] = result.ssml
+    return response
+
+
+def metrics(request):
+    "The turn histograms in Prometheus's text format, see instrumentation.HistogramSink."
+    sinks = [s for s in get_sinks() if hasattr(s, 'prometheus_text')]
+    if not sinks:
+        raise Http404("No metrics are kept")
+    return HttpResponse(
+        ''.join(s.prometheus_text() for s in sinks),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+def ready(request):
+    """Whether the worker has warmed up and is ready to take turns, for a readiness check.
+
+    Starts warming up if it hasn't, see warmup.py.
+    """
+    if not is_ready():
+        start_warm_up()
+        return HttpResponse("Warming up", status=503, content_type='text/plain')
+    return HttpResponse("Ready", content_type='text/plain')
@@ -0,0 +1,81 @@
+"""Getting a webhook worker ready to take turns before its first request.
+
+The first turn a process takes would otherwise import the views and everything they use, build
+the catalogue (with every question's AnswerMatcher and QuestionSpeech) and make the session store,
+replay cache and metrics sinks, which makes it much slower than the turns after it. warm_up does
+all of that in advance.
+
+The WSGI application in wsgi.py starts it in a background thread when it is loaded, if
+WORD_FINDING_WARM_UP is True, so the worker can accept connections straight away. The ASGI
+application warms up when the server starts it (see asgi.py). Only the servers warm up, not
+management commands. Either way views.ready says whether it has finished, for a readiness check to
+wait for before sending the worker any requests. If a warm up fails it is logged, and the next
+readiness check tries again.
+
+A worker which only serves the webhook doesn't need the admin either. Leaving
+django.contrib.admin out of the webhook's INSTALLED_APPS stops admin.py, and the analytics it
+offers, from being imported, and nothing the webhook imports needs them.
+"""
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+_ready = threading.Event()
+
+
+def warm_up():
+    "Does everything a process's first turn would otherwise do first, returns the seconds taken."
+    from . import views  # noqa: F401
+    from .catalogue import get_catalogue
+    from .instrumentation import get_sinks
+    from .replay import get_replay_cache
+    from .sessions import get_session_store
+
+    started = time.time()
+    close_old_connections()
+    try:
+        get_catalogue()
+        get_session_store()
+        get_replay_cache()
+        get_sinks()
+    finally:
+        close_old_connections()
+    _ready.set()
+    return time.time() - started
+
+
+def start_warm_up():
+    "Warms up in a background thread, unless it has already started or finished."
+    global _thread
+    with _lock:
+        if _ready.is_set() or (_thread is not None and _thread.is_alive()):
+            return
+        _thread = threading.Thread(target=try_warm_up, name='word_finding warm up', daemon=True)
+    _thread.start()
+
+
+def try_warm_up():
+    "Warms up, logging rather than raising if it fails. Returns whether it did."
+    try:
+        taken = warm_up()
+    except Exception:
+        logger.exception("Couldn't warm up, will try again on the next readiness check")
+        return False
+    logger.info("Warmed up in %.2fs", taken)
+    return True
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def wait(timeout=None):
+    "Waits for the warm up to finish, returns whether it has."
+    return _ready.wait(timeout)
@@ -0,0 +1,23 @@
+"""A WSGI application for a webhook worker, which warms up when it is loaded.
+
+Use it in place of the project's WSGI application for the processes which serve the webhook:
+
+    gunicorn apps.word_finding.wsgi:application
+
+With WORD_FINDING_WARM_UP = True it starts warming up in a background thread (see warmup.py), so
+the worker accepts connections straight away and views.ready says when it can take turns. Other
+processes, like management commands, don't load it and so don't warm up.
+"""
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+
+def get_application():
+    application = get_wsgi_application()
+    if getattr(settings, 'WORD_FINDING_WARM_UP', False):
+        from .warmup import start_warm_up
+        start_warm_up()
+    return application
+
+
+application = get_application()